@@ -0,0 +1,218 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+from sklearn.ensemble import BaggingClassifier, RandomForestClassifier, RandomForestRegressor
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import GaussianNB
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from shared_array import AttachedArray, SharedArray
+
+ANALYSIS_METHODS = {
+    "主成分分析 (PCA)": 'pca',
+    "K-means クラスタリング": 'kmeans',
+    "線形回帰": 'linear_regression',
+    "ロジスティック回帰": 'logistic_regression',
+    "サポートベクターマシン (SVM)": 'svm',
+    "ランダムフォレスト": 'random_forest',
+    "ナイーブベイズ": 'naive_bayes',
+}
+# 回帰の目的変数と分類のラベルに使う列
+REGRESSION_TARGET = 'value'
+CLASSIFICATION_TARGET = 'group'
+# 散布図として GUI に返す点数の上限
+MAX_PLOT_POINTS = 5000
+RANDOM_STATE = 0
+# 学習にワーカープロセス内の複数コアを使える手法（n_jobs を渡す）
+PARALLEL_METHODS = ('random_forest', 'svm')
+# SVC の学習は行数の 2 乗以上に重くなるので、これを超える行数では部分標本で学習した SVC の
+# バギングにして、各 SVC を並列に学習する
+SVM_EXACT_MAX_ROWS = 20_000
+SVM_BAG_SAMPLES = 5_000
+SVM_MIN_ESTIMATORS = 10
+
+
+def default_worker_count():
+    return max(1, os.cpu_count() or 1)
+
+
+def create_executor(max_workers):
+    # Qt を読み込んだプロセスを fork しないように spawn でワーカーを起動する
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class AnalysisInput:
+    # データフレームから特徴量行列と目的変数を作り、共有メモリに置く
+    def __init__(self, data, method):
+        numeric = data.select_dtypes(include=[np.number])
+        target = None
+        class_labels = None
+        if method == 'linear_regression' or (method == 'random_forest' and CLASSIFICATION_TARGET not in data):
+            if REGRESSION_TARGET not in numeric:
+                raise ValueError(f"目的変数の列 '{REGRESSION_TARGET}' が必要です。")
+            target = numeric[REGRESSION_TARGET].to_numpy(dtype=np.float64)
+            numeric = numeric.drop(columns=[REGRESSION_TARGET])
+        elif method in ('logistic_regression', 'svm', 'random_forest', 'naive_bayes'):
+            if CLASSIFICATION_TARGET not in data:
+                raise ValueError(f"分類ラベルの列 '{CLASSIFICATION_TARGET}' が必要です。")
+            codes, class_labels = pd.factorize(data[CLASSIFICATION_TARGET])
+            target = codes.astype(np.int64)
+            class_labels = [str(label) for label in class_labels]
+            numeric = numeric.drop(columns=[CLASSIFICATION_TARGET], errors='ignore')
+        if numeric.shape[1] == 0:
+            raise ValueError("特徴量として使える数値列がありません。")
+
+        features = numeric.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(features).any(axis=1)
+        if target is not None:
+            valid &= (target >= 0) if target.dtype.kind == 'i' else ~np.isnan(target)
+        if not valid.all():
+            features = features[valid]
+            target = target[valid] if target is not None else None
+
+        self.feature_names = list(numeric.columns)
+        self.class_labels = class_labels
+        self.features = SharedArray(features)
+        self.target = SharedArray(target) if target is not None else None
+
+    def specs(self):
+        return self.features.spec, self.target.spec if self.target is not None else None
+
+    def close(self):
+        self.features.close()
+        if self.target is not None:
+            self.target.close()
+
+
+def _plot_sample(n):
+    if n <= MAX_PLOT_POINTS:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(RANDOM_STATE).choice(n, MAX_PLOT_POINTS, replace=False))
+
+
+def _scatter(x, y, c=None, title="", xlabel="", ylabel=""):
+    index = _plot_sample(len(x))
+    return {'type': 'scatter', 'x': x[index], 'y': y[index], 'c': c[index] if c is not None else None,
+            'title': title, 'xlabel': xlabel, 'ylabel': ylabel}
+
+
+def run_pca(X, y, feature_names, class_labels):
+    scaled = StandardScaler().fit_transform(X)
+    n_components = min(len(feature_names), 10, len(X))
+    pca = PCA(n_components=n_components, random_state=RANDOM_STATE)
+    scores = pca.fit_transform(scaled)
+    table = pd.DataFrame({
+        '主成分': [f"PC{i + 1}" for i in range(n_components)],
+        '寄与率': pca.explained_variance_ratio_,
+        '累積寄与率': np.cumsum(pca.explained_variance_ratio_),
+    })
+    second = scores[:, 1] if n_components > 1 else np.zeros(len(scores))
+    plot = _scatter(scores[:, 0], second, title="主成分得点", xlabel="PC1", ylabel="PC2")
+    return f"主成分分析の結果:\n{table.to_string(index=False)}", table, plot
+
+
+def run_kmeans(X, y, feature_names, class_labels, n_clusters=3):
+    scaled = StandardScaler().fit_transform(X)
+    model = KMeans(n_clusters=n_clusters, n_init=10, random_state=RANDOM_STATE)
+    labels = model.fit_predict(scaled)
+    sizes = np.bincount(labels, minlength=n_clusters)
+    table = pd.DataFrame({'クラスタ': np.arange(n_clusters), '件数': sizes})
+    second = X[:, 1] if X.shape[1] > 1 else np.zeros(len(X))
+    plot = _scatter(X[:, 0], second, labels, title="K-means クラスタ",
+                    xlabel=feature_names[0], ylabel=feature_names[1] if X.shape[1] > 1 else "")
+    text = f"K-means クラスタリング（k={n_clusters}）\n慣性: {model.inertia_:.4f}\n{table.to_string(index=False)}"
+    return text, table, plot
+
+
+def _regression(model, X, y, feature_names, title):
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=RANDOM_STATE)
+    model.fit(X_train, y_train)
+    predicted = model.predict(X_test)
+    mse = mean_squared_error(y_test, predicted)
+    r2 = r2_score(y_test, predicted)
+    if hasattr(model, 'coef_'):
+        table = pd.DataFrame({'変数': feature_names, '係数': model.coef_})
+    else:
+        table = pd.DataFrame({'変数': feature_names, '重要度': model.feature_importances_})
+    plot = _scatter(y_test, predicted, title=title, xlabel="実測値", ylabel="予測値")
+    text = f"{title}\n決定係数 (R²): {r2:.4f}\n平均二乗誤差: {mse:.4f}\n{table.to_string(index=False)}"
+    return text, table, plot
+
+
+def _classification(model, X, y, class_labels, title):
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=RANDOM_STATE)
+    model.fit(X_train, y_train)
+    predicted = model.predict(X_test)
+    labels = np.arange(len(class_labels))
+    accuracy = accuracy_score(y_test, predicted)
+    report = classification_report(y_test, predicted, labels=labels, target_names=class_labels, zero_division=0)
+    matrix = confusion_matrix(y_test, predicted, labels=labels)
+    table = pd.DataFrame(matrix, index=class_labels, columns=class_labels).rename_axis('実際 \\ 予測').reset_index()
+    plot = {'type': 'matrix', 'matrix': matrix, 'labels': class_labels, 'title': f"{title} 混同行列",
+            'xlabel': "予測", 'ylabel': "実際"}
+    return f"{title}\n正解率: {accuracy:.4f}\n{report}", table, plot
+
+
+def run_linear_regression(X, y, feature_names, class_labels):
+    return _regression(LinearRegression(), X, y, feature_names, "線形回帰")
+
+
+def run_logistic_regression(X, y, feature_names, class_labels):
+    model = LogisticRegression(max_iter=1000)
+    return _classification(model, StandardScaler().fit_transform(X), y, class_labels, "ロジスティック回帰")
+
+
+def run_svm(X, y, feature_names, class_labels, n_jobs=1):
+    scaled = StandardScaler().fit_transform(X)
+    # 学習に使うのは 8 割（_classification で分割する）
+    if len(X) * 0.8 <= SVM_EXACT_MAX_ROWS:
+        return _classification(SVC(random_state=RANDOM_STATE), scaled, y, class_labels, "サポートベクターマシン")
+    n_estimators = max(SVM_MIN_ESTIMATORS, n_jobs)
+    model = BaggingClassifier(SVC(random_state=RANDOM_STATE), n_estimators=n_estimators,
+                              max_samples=SVM_BAG_SAMPLES, n_jobs=n_jobs, random_state=RANDOM_STATE)
+    title = f"サポートベクターマシン（{SVM_BAG_SAMPLES:,}行ずつ学習した{n_estimators}個のSVCのバギング）"
+    return _classification(model, scaled, y, class_labels, title)
+
+
+def run_random_forest(X, y, feature_names, class_labels, n_jobs=1):
+    if class_labels is None:
+        model = RandomForestRegressor(n_estimators=100, n_jobs=n_jobs, random_state=RANDOM_STATE)
+        return _regression(model, X, y, feature_names, "ランダムフォレスト（回帰）")
+    model = RandomForestClassifier(n_estimators=100, n_jobs=n_jobs, random_state=RANDOM_STATE)
+    return _classification(model, X, y, class_labels, "ランダムフォレスト（分類）")
+
+
+def run_naive_bayes(X, y, feature_names, class_labels):
+    return _classification(GaussianNB(), X, y, class_labels, "ナイーブベイズ")
+
+
+ANALYSIS_FUNCTIONS = {
+    'pca': run_pca,
+    'kmeans': run_kmeans,
+    'linear_regression': run_linear_regression,
+    'logistic_regression': run_logistic_regression,
+    'svm': run_svm,
+    'random_forest': run_random_forest,
+    'naive_bayes': run_naive_bayes,
+}
+
+
+def run_analysis_job(method, features_spec, target_spec, feature_names, class_labels, options=None):
+    # ワーカープロセスで実行される。データは共有メモリから参照し、結果（文字列・小さな表・描画用の点）だけを返す
+    features = AttachedArray(features_spec)
+    target = AttachedArray(target_spec) if target_spec is not None else None
+    try:
+        y = target.array if target is not None else None
+        return ANALYSIS_FUNCTIONS[method](features.array, y, feature_names, class_labels, **(options or {}))
+    finally:
+        features.close()
+        if target is not None:
+            target.close()
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from chunked_import import ImportCancelled, ImportReport, assemble_chunks, downcast_frame
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.statistical_software', 'api_cache')
+# レスポンスの JSON がオブジェクトの場合に、レコードの配列を探すキー
+RECORD_KEYS = ('data', 'results', 'items', 'records', 'rows')
+CURSOR_KEYS = ('next_cursor', 'nextCursor', 'next_page_token', 'nextPageToken')
+TOTAL_KEYS = ('total', 'total_count', 'count')
+
+
+def with_params(url, params):
+    if not params:
+        return url
+    parts = urlparse(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update({key: str(value) for key, value in params.items()})
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def extract_records(payload):
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict):
+        for key in RECORD_KEYS:
+            if isinstance(payload.get(key), list):
+                return payload[key]
+        return [payload]
+    raise ValueError("JSONの形式がデータとして解釈できません。")
+
+
+def _find_key(payload, keys):
+    if isinstance(payload, dict):
+        for key in keys:
+            if payload.get(key) not in (None, ''):
+                return payload[key]
+    return None
+
+
+class ResponseCache:
+    # URLごとにレスポンス本文と検証子（ETag / Last-Modified）をディスクに保存する
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.body'
+
+    def load(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta, body
+
+    def store(self, url, response):
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'link': response.headers.get('Link'),
+            'stored_at': time.time(),
+        }
+        if not meta['etag'] and not meta['last_modified']:
+            return
+        meta_path, body_path = self._paths(url)
+        for path, content, mode in ((body_path, response.content, 'wb'),
+                                    (meta_path, json.dumps(meta), 'w')):
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, mode) as f:
+                f.write(content)
+            os.replace(temp_path, path)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(('.json', '.body')):
+                os.remove(os.path.join(self.directory, name))
+
+
+class Page:
+    def __init__(self, url, payload, links, from_cache):
+        self.url = url
+        self.payload = payload
+        self.links = links
+        self.from_cache = from_cache
+
+
+class PaginatedAPIClient:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_workers=8, timeout=30, cache_max_age=0, session=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # cache_max_age 秒以内に保存したページは再検証せずにそのまま使う
+        self.cache_max_age = cache_max_age
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        if session is None:
+            # 接続をプールして、同じホストへのリクエストで TCP/TLS の確立をやり直さない
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=3)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def fetch_page(self, url):
+        cached = self.cache.load(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            meta = cached[0]
+            if time.time() - meta.get('stored_at', 0) < self.cache_max_age:
+                return self._cached_page(url, cached)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached is not None:
+            return self._cached_page(url, cached)
+
+        response.raise_for_status()
+        if self.cache is not None:
+            self.cache.store(url, response)
+        return Page(url, response.json(), response.links, False)
+
+    def _cached_page(self, url, cached):
+        meta, body = cached
+        links = requests.utils.parse_header_links(meta['link']) if meta.get('link') else []
+        links = {link.get('rel') or link['url']: link for link in links}
+        return Page(url, json.loads(body), links, True)
+
+    def fetch(self, url, pagination='auto', page_size=100, offset_param='offset', limit_param='limit',
+              cursor_param='cursor', max_pages=None, progress_callback=None, is_cancelled=None):
+        report = ImportReport(url)
+        start = time.perf_counter()
+        collector = _PageCollector(report)
+
+        first = self.fetch_page(with_params(url, {limit_param: page_size}) if pagination == 'offset' else url)
+        collector.add(0, first)
+
+        if pagination == 'auto':
+            if 'next' in first.links:
+                pagination = 'link'
+            elif _find_key(first.payload, CURSOR_KEYS) is not None:
+                pagination = 'cursor'
+            else:
+                pagination = 'none'
+
+        def check_cancelled():
+            if is_cancelled is not None and is_cancelled():
+                raise ImportCancelled()
+
+        def report_progress(done, total=None):
+            if progress_callback is not None:
+                progress_callback(min(99, int(done * 100 / total)) if total else min(95, done))
+
+        if pagination == 'link':
+            page = first
+            while 'next' in page.links and (max_pages is None or collector.pages < max_pages):
+                check_cancelled()
+                page = self.fetch_page(page.links['next']['url'])
+                collector.add(collector.pages, page)
+                report_progress(collector.pages)
+        elif pagination == 'cursor':
+            page = first
+            cursor = _find_key(page.payload, CURSOR_KEYS)
+            while cursor is not None and (max_pages is None or collector.pages < max_pages):
+                check_cancelled()
+                page = self.fetch_page(with_params(url, {cursor_param: cursor}))
+                collector.add(collector.pages, page)
+                cursor = _find_key(page.payload, CURSOR_KEYS)
+                report_progress(collector.pages)
+        elif pagination == 'offset':
+            self._fetch_offset_pages(url, first, collector, page_size, offset_param, limit_param,
+                                     max_pages, check_cancelled, report_progress)
+
+        df = collector.finish(start)
+        if progress_callback is not None:
+            progress_callback(100)
+        return df, report
+
+    def _fetch_offset_pages(self, url, first, collector, page_size, offset_param, limit_param,
+                            max_pages, check_cancelled, report_progress):
+        # オフセット方式はページの URL が事前に分かるので、並列に取得できる
+        total = _find_key(first.payload, TOTAL_KEYS)
+        total_pages = -(-int(total) // page_size) if isinstance(total, (int, float)) else None
+        if max_pages is not None:
+            total_pages = min(total_pages, max_pages) if total_pages is not None else max_pages
+
+        def page_url(index):
+            return with_params(url, {offset_param: index * page_size, limit_param: page_size})
+
+        index = 1
+        finished = len(extract_records(first.payload)) < page_size
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not finished and (total_pages is None or index < total_pages):
+                check_cancelled()
+                # 総件数が分からない場合は、ワーカー数分ずつ先読みして短いページが来たら止める
+                last = total_pages if total_pages is not None else index + self.max_workers
+                last = min(last, index + self.max_workers * 4)
+                indices = list(range(index, last))
+                for page_index, page in zip(indices, executor.map(lambda i: self.fetch_page(page_url(i)), indices)):
+                    records = collector.add(page_index, page)
+                    if total_pages is None and records < page_size:
+                        finished = True
+                index = last
+                report_progress(collector.pages, total_pages)
+
+
+class _PageCollector:
+    # ページごとにすぐ DataFrame に変換して型を縮小し、最後にページ順で連結する
+    def __init__(self, report):
+        self.report = report
+        self.frames = {}
+        self.decisions = {}
+        self.stored = 0
+        self.cached_pages = 0
+
+    @property
+    def pages(self):
+        return len(self.frames)
+
+    def add(self, index, page):
+        records = extract_records(page.payload)
+        frame = downcast_frame(pd.DataFrame.from_records(records), decisions=self.decisions)
+        self.frames[index] = frame
+        self.stored += int(frame.memory_usage(index=True, deep=True).sum())
+        self.report.observe(self.stored)
+        if page.from_cache:
+            self.cached_pages += 1
+        return len(records)
+
+    def finish(self, start):
+        chunks = [self.frames[index] for index in sorted(self.frames) if len(self.frames[index])]
+        self.report.chunks = len(self.frames)
+        self.report.notes.append(f"ページ数: {len(self.frames)}（うちキャッシュ利用 {self.cached_pages}）")
+        return assemble_chunks(chunks, self.report, start)
@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from chunked_import import quote_identifier
+from columnar_io import read_parquet
+from grouped_data import GroupedData
+from statistical_tests import (
+    POST_HOC_TESTS,
+    STATISTICAL_TESTS,
+    run_post_hoc_test,
+    run_statistical_test,
+)
+from streaming_stats import STREAMING_TESTS, run_streaming_test
+
+CSV_EXTENSIONS = ('.csv',)
+EXCEL_EXTENSIONS = ('.xlsx',)
+SQLITE_EXTENSIONS = ('.db', '.sqlite')
+PARQUET_EXTENSIONS = ('.parquet',)
+SUPPORTED_EXTENSIONS = CSV_EXTENSIONS + EXCEL_EXTENSIONS + SQLITE_EXTENSIONS + PARQUET_EXTENSIONS
+
+RESULT_COLUMNS = ['dataset', 'table', 'kind', 'test', 'result', 'significant', 'error', 'seconds']
+
+
+def discover_inputs(path, table=None):
+    # ディレクトリなら対応する拡張子のファイルをすべて、それ以外はマニフェストとして読む
+    if os.path.isdir(path):
+        sources = []
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    sources.append({'path': os.path.join(root, name), 'table': table})
+        return sorted(sources, key=lambda source: source['path'])
+    return read_manifest(path, table)
+
+
+def read_manifest(path, table=None):
+    # マニフェスト形式: .json（パス文字列または {"path", "table"} のリスト）、
+    # .csv（path列と任意のtable列）、それ以外は1行1パスのテキスト
+    base_dir = os.path.dirname(os.path.abspath(path))
+    lower = path.lower()
+    if lower.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    elif lower.endswith('.csv'):
+        entries = pd.read_csv(path, dtype=str).to_dict('records')
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    sources = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        entry_table = entry.get('table')
+        if not isinstance(entry_table, str) or not entry_table:
+            entry_table = table
+        entry_path = entry['path']
+        if not os.path.isabs(entry_path):
+            entry_path = os.path.join(base_dir, entry_path)
+        sources.append({'path': entry_path, 'table': entry_table})
+    return sources
+
+
+def load_dataset(source):
+    path = source['path']
+    lower = path.lower()
+    if lower.endswith(CSV_EXTENSIONS):
+        return pd.read_csv(path)
+    if lower.endswith(EXCEL_EXTENSIONS):
+        return pd.read_excel(path)
+    if lower.endswith(PARQUET_EXTENSIONS):
+        return read_parquet(path)[0]
+    if lower.endswith(SQLITE_EXTENSIONS):
+        conn = sqlite3.connect(path)
+        try:
+            table_name = source.get('table')
+            if not table_name:
+                tables = [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+                if len(tables) != 1:
+                    raise ValueError(f"テーブル名を指定してください（候補: {', '.join(tables)}）")
+                table_name = tables[0]
+            return pd.read_sql_query(f"SELECT * FROM {quote_identifier(table_name)}", conn)
+        finally:
+            conn.close()
+    raise ValueError(f"対応していないファイル形式です: {path}")
+
+
+def run_dataset_job(source, tests, post_hoc_tests, test_options=None, control=None):
+    # 1つのデータセットを読み込み、指定された検定をすべて実行する（ワーカープロセス内で実行）
+    rows = []
+    base = {'dataset': source['path'], 'table': source.get('table')}
+    start = time.perf_counter()
+    try:
+        data = GroupedData(load_dataset(source))
+    except Exception as e:
+        row = dict(base, kind='load', test=None, result=None, significant=None,
+                   error=str(e), seconds=time.perf_counter() - start)
+        return [row]
+
+    for kind, test_names in (('test', tests), ('post_hoc', post_hoc_tests)):
+        for test in test_names:
+            start = time.perf_counter()
+            row = dict(base, kind=kind, test=test, result=None, significant=None, error=None)
+            try:
+                if kind == 'test':
+                    result, is_significant = run_statistical_test(test, data, test_options)
+                    row['significant'] = bool(is_significant)
+                else:
+                    result = run_post_hoc_test(test, data, control)
+                row['result'] = result
+            except Exception as e:
+                row['error'] = str(e)
+            row['seconds'] = time.perf_counter() - start
+            rows.append(row)
+    return rows
+
+
+def run_streaming_job(source, tests, workers=None):
+    # データセットを読み込まずに、区間ごとに逐次集計した統計量から検定する（ファイルがメモリに収まらない場合）
+    rows = []
+    base = {'dataset': source['path'], 'table': source.get('table')}
+    for test in tests:
+        start = time.perf_counter()
+        row = dict(base, kind='test', test=test, result=None, significant=None, error=None)
+        try:
+            result, is_significant = run_streaming_test(test, source, workers)
+            row['result'] = result
+            row['significant'] = bool(is_significant)
+        except Exception as e:
+            row['error'] = str(e)
+        row['seconds'] = time.perf_counter() - start
+        rows.append(row)
+    return rows
+
+
+def run_batch(sources, tests, post_hoc_tests=(), workers=None, chunksize=1, test_options=None, control=None,
+              streaming=False):
+    if streaming:
+        # 1 つのファイルを区間に分けて並列に集計するので、データセットは順番に処理する
+        rows = []
+        for source in sources:
+            rows.extend(run_streaming_job(source, tests, workers))
+        return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    if test_options is not None and workers != 1:
+        # データセット単位で並列化しているので、並べ替え検定・ブートストラップは各ワーカー内で逐次に計算する
+        test_options = dict(test_options, workers=1)
+    job = partial(run_dataset_job, tests=list(tests), post_hoc_tests=list(post_hoc_tests),
+                  test_options=test_options, control=control)
+    rows = []
+    if workers == 1:
+        for source in sources:
+            rows.extend(job(source))
+    else:
+        # データの読み込みもワーカー側で行うため、プロセス間で渡すのはパスと結果文字列だけ
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for dataset_rows in executor.map(job, sources, chunksize=chunksize):
+                rows.extend(dataset_rows)
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def write_results(results, output_path):
+    if output_path.lower().endswith('.xlsx'):
+        results.to_excel(output_path, index=False)
+    else:
+        results.to_csv(output_path, index=False)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="統計検定を複数のデータセットに対して一括実行します")
+    parser.add_argument('input', nargs='?', help="入力ディレクトリ、またはマニフェストファイル（.txt/.csv/.json）")
+    parser.add_argument('-t', '--test', action='append', default=[], dest='tests',
+                        help="実行する検定名（複数指定可）")
+    parser.add_argument('-p', '--post-hoc', action='append', default=[], dest='post_hoc_tests',
+                        help="実行するPost Hoc検定名（複数指定可）")
+    parser.add_argument('-o', '--output', default='batch_results.csv',
+                        help="結果の出力先（.csv または .xlsx）")
+    parser.add_argument('--table', help="SQLiteファイルから読み込むテーブル名の既定値")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="ワーカープロセス数（既定: CPUコア数）")
+    parser.add_argument('--chunksize', type=int, default=1,
+                        help="1回にワーカーへ渡すデータセット数")
+    parser.add_argument('--permutations', type=int, default=None,
+                        help="並べ替え検定でもp値を求める場合の並べ替え回数の上限")
+    parser.add_argument('--bootstrap', type=int, default=None,
+                        help="ブートストラップ信頼区間を求める場合の復元抽出の回数")
+    parser.add_argument('--control', help="Dunnett検定の対照群（既定: 最初のグループ）")
+    parser.add_argument('--seed', type=int, default=0, help="並べ替え検定・ブートストラップの乱数シード")
+    parser.add_argument('--streaming', action='store_true',
+                        help="ファイル全体を読み込まずに逐次集計して検定する（t検定・ANOVA・ANCOVA・Mann-Whitney・Kruskal-Wallisのみ）")
+    parser.add_argument('--list-tests', action='store_true', help="利用可能な検定名を表示して終了")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.list_tests:
+        print("検定:")
+        for test in STATISTICAL_TESTS:
+            print(f"  {test}")
+        print("Post Hoc検定:")
+        for test in POST_HOC_TESTS:
+            print(f"  {test}")
+        return 0
+
+    if not args.input:
+        print("入力ディレクトリまたはマニフェストを指定してください。", file=sys.stderr)
+        return 2
+    if not args.tests and not args.post_hoc_tests:
+        print("--test または --post-hoc で検定を1つ以上指定してください。", file=sys.stderr)
+        return 2
+
+    unknown = [t for t in args.tests if t not in STATISTICAL_TESTS]
+    unknown += [t for t in args.post_hoc_tests if t not in POST_HOC_TESTS]
+    if unknown:
+        print(f"不明な検定名です: {', '.join(unknown)}（--list-tests で一覧を表示）", file=sys.stderr)
+        return 2
+
+    if args.streaming:
+        unsupported = [t for t in args.tests if t not in STREAMING_TESTS] + args.post_hoc_tests
+        if unsupported:
+            print(f"--streaming では実行できない検定です: {', '.join(unsupported)}"
+                  f"（対応: {', '.join(STREAMING_TESTS)}）", file=sys.stderr)
+            return 2
+
+    sources = discover_inputs(args.input, args.table)
+    if not sources:
+        print("対象となるデータセットが見つかりませんでした。", file=sys.stderr)
+        return 1
+
+    test_options = None
+    if args.permutations or args.bootstrap:
+        test_options = {'seed': args.seed}
+        if args.permutations:
+            test_options.update(permutation=True, permutations=args.permutations)
+        if args.bootstrap:
+            test_options.update(bootstrap=True, resamples=args.bootstrap)
+
+    start = time.perf_counter()
+    results = run_batch(sources, args.tests, args.post_hoc_tests,
+                        workers=args.workers, chunksize=args.chunksize, test_options=test_options,
+                        control=args.control, streaming=args.streaming)
+    write_results(results, args.output)
+
+    failed = results['error'].notna().sum()
+    print(f"{len(sources)}件のデータセットを処理しました（{time.perf_counter() - start:.1f}秒、エラー {failed}件）: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.cell import range_boundaries
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CATEGORY_COLUMNS = ('group', 'factor1', 'factor2', 'subject')
+DEFAULT_CHUNKSIZE = 200_000
+# 名前で指定されていない文字列列は、ユニーク値の割合がこれ未満ならカテゴリにする
+CATEGORY_RATIO = 0.5
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self, source):
+        self.source = source
+        self.rows = 0
+        self.chunks = 0
+        self.peak_bytes = 0
+        self.final_bytes = 0
+        self.seconds = 0.0
+        self.dtypes = {}
+        self.estimated_rows = None
+        self.notes = []
+
+    def observe(self, current_bytes):
+        self.peak_bytes = max(self.peak_bytes, int(current_bytes))
+
+    def process_peak_bytes(self):
+        if resource is None:
+            return None
+        # Linux では KB、macOS ではバイト単位
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def to_text(self):
+        lines = [
+            f"読み込み元: {self.source}",
+            f"行数: {self.rows:,}（{self.chunks}チャンク）",
+        ]
+        if self.estimated_rows is not None:
+            lines.append(f"推定行数: {self.estimated_rows:,}")
+        lines += [
+            f"所要時間: {self.seconds:.1f}秒",
+            f"ピークメモリ（データ）: {self.peak_bytes / 1024 / 1024:,.1f} MB",
+            f"最終メモリ: {self.final_bytes / 1024 / 1024:,.1f} MB",
+        ]
+        process_peak = self.process_peak_bytes()
+        if process_peak is not None:
+            lines.append(f"ピークメモリ（プロセス全体）: {process_peak / 1024 / 1024:,.1f} MB")
+        lines += self.notes
+        return "\n".join(lines)
+
+
+def _frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _is_float32_lossless(values):
+    as_float32 = values.astype(np.float32)
+    if not np.isfinite(as_float32[np.isfinite(values)]).all():
+        return False
+    return np.array_equal(as_float32.astype(np.float64), values, equal_nan=True)
+
+
+def downcast_frame(df, category_columns=CATEGORY_COLUMNS, decisions=None):
+    # チャンクごとに型を縮小する。decisions に文字列列のカテゴリ化の判断を保存し、
+    # 以降のチャンクでも同じ判断を使う（チャンク間で型が揃わないと連結時に object に戻るため）
+    if decisions is None:
+        decisions = {}
+    for column in df.columns:
+        series = df[column]
+        if column in category_columns:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                df[column] = series.astype('category')
+        elif isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(series.dtype):
+            continue
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series.dtype):
+            if series.dtype == np.float64 and _is_float32_lossless(series.to_numpy()):
+                df[column] = series.astype(np.float32)
+        elif pd.api.types.is_string_dtype(series.dtype):
+            if column not in decisions:
+                n = len(series)
+                decisions[column] = n > 0 and series.nunique(dropna=True) < CATEGORY_RATIO * n
+            if decisions[column]:
+                df[column] = series.astype('category')
+    return df
+
+
+def combine_chunks(chunks):
+    if not chunks:
+        return pd.DataFrame()
+    # カテゴリ列はすべてのチャンクのカテゴリを揃えてから連結する
+    for column in chunks[0].columns:
+        if not all(column in chunk and isinstance(chunk[column].dtype, pd.CategoricalDtype) for chunk in chunks):
+            continue
+        categories = chunks[0][column].cat.categories
+        for chunk in chunks[1:]:
+            categories = categories.union(chunk[column].cat.categories)
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def assemble_chunks(chunks, report, start):
+    stored = sum(_frame_bytes(chunk) for chunk in chunks)
+    df = combine_chunks(chunks)
+    report.final_bytes = _frame_bytes(df)
+    # 連結の間はチャンクと結果の両方がメモリ上にある
+    report.observe(stored + report.final_bytes)
+    report.rows = len(df)
+    report.seconds = time.perf_counter() - start
+    report.dtypes = {column: str(dtype) for column, dtype in df.dtypes.items()}
+    return df
+
+
+def read_csv_chunked(path, chunksize=DEFAULT_CHUNKSIZE, progress_callback=None, is_cancelled=None, **read_csv_kwargs):
+    report = ImportReport(path)
+    start = time.perf_counter()
+    total_bytes = max(os.path.getsize(path), 1)
+    chunks = []
+    stored = 0
+    decisions = {}
+
+    with open(path, 'rb') as f:
+        reader = pd.read_csv(f, chunksize=chunksize, **read_csv_kwargs)
+        for chunk in reader:
+            if is_cancelled is not None and is_cancelled():
+                raise ImportCancelled()
+            raw = _frame_bytes(chunk)
+            chunk = downcast_frame(chunk, decisions=decisions)
+            report.observe(stored + raw)
+            stored += _frame_bytes(chunk)
+            chunks.append(chunk)
+            report.chunks += 1
+            if progress_callback is not None:
+                progress_callback(min(99, int(f.tell() * 100 / total_bytes)))
+
+    df = assemble_chunks(chunks, report, start)
+    if progress_callback is not None:
+        progress_callback(100)
+    return df, report
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def connect_sqlite_readonly(path):
+    # 読み込み専用で開き、WHERE句などから書き込みができないようにする
+    uri = 'file:' + os.path.abspath(path).replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+    return sqlite3.connect(uri, uri=True)
+
+
+def sqlite_tables(path):
+    conn = connect_sqlite_readonly(path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    finally:
+        conn.close()
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")]
+
+
+def sqlite_columns(path, table):
+    conn = connect_sqlite_readonly(path)
+    try:
+        return _table_columns(conn, table)
+    finally:
+        conn.close()
+
+
+def build_sqlite_query(table, columns=None, where=None, limit=None, sample_fraction=None):
+    select = ", ".join(quote_identifier(column) for column in columns) if columns else "*"
+    query = f"SELECT {select} FROM {quote_identifier(table)}"
+    conditions = []
+    if where:
+        conditions.append(f"({where})")
+    if sample_fraction is not None and sample_fraction < 1:
+        # 行ごとの一様乱数で標本抽出する（ORDER BY random() のような全件ソートをしない）
+        conditions.append(f"(abs(random()) % 1000000) < {int(sample_fraction * 1000000)}")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return query
+
+
+def _table_row_estimate(conn, table):
+    # ANALYZE 済みなら sqlite_stat1、なければ rowid の範囲から概算する（どちらも全件走査しない）
+    try:
+        row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND idx IS NULL", (table,)).fetchone()
+        if row is None:
+            row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ?", (table,)).fetchone()
+        if row is not None:
+            return int(row[0].split()[0])
+    except sqlite3.Error:
+        pass
+    try:
+        low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {quote_identifier(table)}").fetchone()
+        return 0 if low is None else int(high - low + 1)
+    except sqlite3.Error:
+        return conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}").fetchone()[0]
+
+
+def estimate_sqlite_rows(path, table, limit=None, sample_fraction=None):
+    # WHERE句を考慮しない上限の見積もり
+    conn = connect_sqlite_readonly(path)
+    try:
+        estimate = _table_row_estimate(conn, table)
+    finally:
+        conn.close()
+    if sample_fraction is not None and sample_fraction < 1:
+        estimate = int(estimate * sample_fraction)
+    if limit:
+        estimate = min(estimate, int(limit))
+    return estimate
+
+
+def read_sqlite(path, table, columns=None, where=None, params=(), limit=None, sample_fraction=None,
+                chunksize=DEFAULT_CHUNKSIZE, progress_callback=None, is_cancelled=None):
+    report = ImportReport(f"{path} ({table})")
+    start = time.perf_counter()
+    conn = connect_sqlite_readonly(path)
+    try:
+        available = _table_columns(conn, table)
+        if not available:
+            raise ValueError(f"テーブルが見つかりません: {table}")
+        unknown = [column for column in columns or () if column not in available]
+        if unknown:
+            raise ValueError(f"存在しない列です: {', '.join(unknown)}")
+
+        estimate = _table_row_estimate(conn, table)
+        if sample_fraction is not None and sample_fraction < 1:
+            estimate = int(estimate * sample_fraction)
+        if limit:
+            estimate = min(estimate, int(limit))
+        report.estimated_rows = estimate
+
+        query = build_sqlite_query(table, columns, where, limit, sample_fraction)
+        chunks = []
+        stored = 0
+        fetched = 0
+        decisions = {}
+        for chunk in pd.read_sql_query(query, conn, params=list(params), chunksize=chunksize):
+            if is_cancelled is not None and is_cancelled():
+                raise ImportCancelled()
+            raw = _frame_bytes(chunk)
+            chunk = downcast_frame(chunk, decisions=decisions)
+            report.observe(stored + raw)
+            stored += _frame_bytes(chunk)
+            chunks.append(chunk)
+            report.chunks += 1
+            fetched += len(chunk)
+            if progress_callback is not None and estimate:
+                progress_callback(min(99, int(fetched * 100 / estimate)))
+    finally:
+        conn.close()
+
+    df = assemble_chunks(chunks, report, start)
+    if progress_callback is not None:
+        progress_callback(100)
+    return df, report
+
+
+def excel_sheets(path):
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def _header_names(row):
+    names = []
+    for i, value in enumerate(row):
+        name = str(value) if value is not None else f"列{i + 1}"
+        while name in names:
+            name += "_"
+        names.append(name)
+    return names
+
+
+def read_excel_streaming(path, sheet_name=None, cell_range=None, header=True, chunksize=50_000,
+                         progress_callback=None, is_cancelled=None):
+    # openpyxl の read-only モードで行を順に読み、チャンクごとに DataFrame に変換する
+    report = ImportReport(f"{path} ({sheet_name or '先頭のシート'}{' ' + cell_range if cell_range else ''})")
+    start = time.perf_counter()
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        min_col = min_row = max_col = max_row = None
+        if cell_range:
+            min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+        first_row = min_row or 1
+        last_row = max_row or sheet.max_row
+        total = (last_row - first_row + 1) if last_row else None
+        report.estimated_rows = total
+
+        rows = sheet.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col, values_only=True)
+        names = None
+        if header:
+            header_row = next(rows, None)
+            if header_row is None:
+                return pd.DataFrame(), report
+            names = _header_names(header_row)
+
+        chunks = []
+        buffer = []
+        stored = 0
+        read = 0
+        decisions = {}
+
+        def flush():
+            nonlocal stored
+            frame = pd.DataFrame.from_records(buffer, columns=names)
+            raw = int(frame.memory_usage(index=True, deep=True).sum())
+            frame = downcast_frame(frame, decisions=decisions)
+            report.observe(stored + raw)
+            stored += int(frame.memory_usage(index=True, deep=True).sum())
+            chunks.append(frame)
+            report.chunks += 1
+            buffer.clear()
+
+        for row in rows:
+            read += 1
+            if all(value is None for value in row):
+                continue
+            if names is None:
+                names = [f"列{i + 1}" for i in range(len(row))]
+            if len(row) != len(names):
+                row = (tuple(row) + (None,) * len(names))[:len(names)]
+            buffer.append(row)
+            if len(buffer) >= chunksize:
+                if is_cancelled is not None and is_cancelled():
+                    raise ImportCancelled()
+                flush()
+                if progress_callback is not None and total:
+                    progress_callback(min(99, int(read * 100 / total)))
+        if buffer:
+            flush()
+    finally:
+        workbook.close()
+
+    df = assemble_chunks(chunks, report, start)
+    if progress_callback is not None:
+        progress_callback(100)
+    return df, report
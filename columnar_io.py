@@ -0,0 +1,239 @@
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from chunked_import import ImportCancelled, ImportReport
+
+SESSION_EXTENSION = '.arrow'
+FILTER_OPERATORS = ('==', '!=', '<=', '>=', '<', '>', ' in ')
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet/Feather形式を扱うには pyarrow が必要です（pip install pyarrow）")
+
+
+def parse_columns(text):
+    columns = [column.strip() for column in text.split(',') if column.strip()]
+    return columns or None
+
+
+def parse_value(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in ('"', "'"):
+        return text[1:-1]
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_filters(text):
+    # "group == A; value > 3; subject in s1,s2" → [(列, 演算子, 値), ...]
+    filters = []
+    for clause in text.split(';'):
+        clause = clause.strip()
+        if not clause:
+            continue
+        for op in FILTER_OPERATORS:
+            if op in clause:
+                column, value = clause.split(op, 1)
+                op = op.strip()
+                if op == 'in':
+                    value = [parse_value(v) for v in value.split(',') if v.strip()]
+                else:
+                    value = parse_value(value)
+                filters.append((column.strip(), op, value))
+                break
+        else:
+            raise ValueError(f"フィルター条件を解釈できません: {clause}")
+    return filters
+
+
+def parse_row_groups(text):
+    # "0-3,7" → [0, 1, 2, 3, 7]
+    row_groups = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            row_groups.extend(range(int(first), int(last) + 1))
+        else:
+            row_groups.append(int(part))
+    return row_groups or None
+
+
+def _coerce_value(value, arrow_type):
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return [str(v) for v in value] if isinstance(value, list) else str(value)
+    return value
+
+
+def _filter_mask(table, filters):
+    mask = None
+    for column, op, value in filters:
+        array = table[column]
+        if pa.types.is_dictionary(array.type):
+            array = array.cast(array.type.value_type)
+        value = _coerce_value(value, array.type)
+        if op == 'in':
+            condition = pc.is_in(array, value_set=pa.array(value, type=array.type))
+        else:
+            function = {'==': pc.equal, '!=': pc.not_equal, '<': pc.less, '<=': pc.less_equal,
+                        '>': pc.greater, '>=': pc.greater_equal}[op]
+            condition = function(array, pa.scalar(value, type=array.type))
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return mask
+
+
+def _apply_filters(table, filters, columns):
+    if filters:
+        table = table.filter(_filter_mask(table, filters))
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def _read_columns(columns, filters):
+    # フィルターに使う列も読み込み、最後に射影する
+    if columns is None:
+        return None
+    extra = [column for column, _, _ in filters or () if column not in columns]
+    return list(columns) + extra
+
+
+def _row_group_may_match(row_group, schema, filters):
+    # 行グループの最小値・最大値の統計から、条件に合う行が存在し得るかを判定する
+    for column, op, value in filters:
+        if column not in schema.names:
+            continue
+        statistics = row_group.column(schema.names.index(column)).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        low, high = statistics.min, statistics.max
+        try:
+            if op == '==' and (value < low or value > high):
+                return False
+            if op == 'in' and all(v < low or v > high for v in value):
+                return False
+            if op == '<' and not low < value:
+                return False
+            if op == '<=' and not low <= value:
+                return False
+            if op == '>' and not high > value:
+                return False
+            if op == '>=' and not high >= value:
+                return False
+        except TypeError:
+            continue
+    return True
+
+
+def parquet_info(path):
+    _require_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    return {
+        'columns': parquet_file.schema_arrow.names,
+        'rows': parquet_file.metadata.num_rows,
+        'row_groups': parquet_file.num_row_groups,
+    }
+
+
+def table_to_frame(table):
+    # split_blocks にすると列ごとのブロックのまま変換され、数値列はゼロコピーにできる
+    return table.to_pandas(split_blocks=True)
+
+
+def _finish(table, report, start):
+    df = table_to_frame(table)
+    report.rows = len(df)
+    report.final_bytes = int(df.memory_usage(index=True, deep=True).sum())
+    report.observe(report.final_bytes + table.nbytes)
+    report.seconds = time.perf_counter() - start
+    report.dtypes = {column: str(dtype) for column, dtype in df.dtypes.items()}
+    return df, report
+
+
+def read_parquet(path, columns=None, filters=None, row_groups=None, progress_callback=None, is_cancelled=None):
+    _require_pyarrow()
+    report = ImportReport(path)
+    start = time.perf_counter()
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    schema = parquet_file.schema_arrow
+    if row_groups is None:
+        row_groups = range(parquet_file.num_row_groups)
+    read_columns = _read_columns(columns, filters)
+
+    tables = []
+    stored = 0
+    for i, index in enumerate(row_groups):
+        if is_cancelled is not None and is_cancelled():
+            raise ImportCancelled()
+        if not filters or _row_group_may_match(metadata.row_group(index), schema, filters):
+            table = parquet_file.read_row_group(index, columns=read_columns)
+            table = _apply_filters(table, filters, columns)
+            stored += table.nbytes
+            report.observe(stored)
+            tables.append(table)
+            report.chunks += 1
+        if progress_callback is not None:
+            progress_callback(min(99, int((i + 1) * 100 / max(len(row_groups), 1))))
+
+    if tables:
+        table = pa.concat_tables(tables)
+    else:
+        table = schema.empty_table() if columns is None else schema.empty_table().select(columns)
+    df, report = _finish(table, report, start)
+    if progress_callback is not None:
+        progress_callback(100)
+    return df, report
+
+
+def read_feather(path, columns=None, filters=None, progress_callback=None, is_cancelled=None):
+    # Feather (Arrow IPC) はメモリマップで開くので、読み込むのは必要な列のページだけ
+    _require_pyarrow()
+    report = ImportReport(path)
+    start = time.perf_counter()
+    table = feather.read_table(path, columns=_read_columns(columns, filters), memory_map=True)
+    if is_cancelled is not None and is_cancelled():
+        raise ImportCancelled()
+    table = _apply_filters(table, filters, columns)
+    report.chunks = 1
+    df, report = _finish(table, report, start)
+    if progress_callback is not None:
+        progress_callback(100)
+    return df, report
+
+
+def save_session(df, path):
+    # 非圧縮の Arrow IPC ファイルとして保存する（再オープン時にメモリマップできる）
+    _require_pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=None)
+    temp_path = path + '.tmp'
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+
+def open_session(path):
+    # ファイル全体を読み込まずにメモリマップし、数値列はマップ上のバッファをそのまま使う
+    _require_pyarrow()
+    source = pa.memory_map(path, 'r')
+    table = ipc.open_file(source).read_all()
+    return table_to_frame(table)
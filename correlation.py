@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from scipy import stats
+
+from ranking import rank_matrix
+from result_cache import ResultCache, estimate_size, fingerprint
+
+# 列をこの本数ずつのブロックに分けて相関行列を計算する（中間配列は block × block に収まる）
+CORRELATION_BLOCK = 512
+# 列数がこれを超えたら結果の行列を float32 で持つ
+FLOAT32_COLUMNS = 2000
+
+
+class CorrelationResult:
+    def __init__(self, columns, matrix, p_values, n_obs, method):
+        self.columns = columns
+        self.matrix = matrix
+        self.p_values = p_values
+        # 欠損値がなければ全ペアで同じ行数なので整数、あればペアごとの行数の行列
+        self.n_obs = n_obs
+        self.method = method
+
+    def to_frame(self):
+        return pd.DataFrame(self.matrix, index=self.columns, columns=self.columns)
+
+    def nbytes(self):
+        total = self.matrix.nbytes
+        if self.p_values is not None:
+            total += self.p_values.nbytes
+        if isinstance(self.n_obs, np.ndarray):
+            total += self.n_obs.nbytes
+        return total
+
+    def top_pairs(self, count=20):
+        # 相関の絶対値が大きいペア（上三角のみ）
+        rows, cols = np.triu_indices(len(self.columns), k=1)
+        values = self.matrix[rows, cols]
+        finite = np.flatnonzero(np.isfinite(values))
+        order = finite[np.argsort(-np.abs(values[finite]), kind='stable')[:count]]
+        return [(self.columns[rows[i]], self.columns[cols[i]], float(values[i]),
+                 float(self.p_values[rows[i], cols[i]]) if self.p_values is not None else None)
+                for i in order]
+
+
+def _result_size(value):
+    return value.nbytes() if isinstance(value, CorrelationResult) else estimate_size(value)
+
+
+correlation_cache = ResultCache(max_entries=8, max_bytes=1024 * 1024 * 1024, sizeof=_result_size)
+
+
+def _p_values(r, n):
+    # t = r √((n-2)/(1-r²)) の両側 p 値
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df = np.asarray(n, dtype=np.float64) - 2
+        t = r * np.sqrt(df / np.maximum(1.0 - r * r, 1e-300))
+        p = 2 * stats.t.sf(np.abs(t), df)
+    return np.where(df > 0, p, np.nan)
+
+
+def _standardize(matrix):
+    # 列を平均 0・ノルム 1 にそろえる（その後の Zᵀ Z がそのまま相関行列になる）
+    matrix -= matrix.mean(axis=0)
+    norms = np.sqrt(np.einsum('ij,ij->j', matrix, matrix))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matrix /= norms
+    return matrix
+
+
+def _blocks(k, block):
+    starts = range(0, k, block)
+    return [(start, min(start + block, k)) for start in starts]
+
+
+def _complete_correlation(matrix, block, dtype, with_p):
+    n, k = matrix.shape
+    z = _standardize(matrix)
+    result = np.empty((k, k), dtype=dtype)
+    p_values = np.empty((k, k), dtype=dtype) if with_p else None
+    blocks = _blocks(k, block)
+    for a, (i0, i1) in enumerate(blocks):
+        for j0, j1 in blocks[a:]:
+            r = np.clip(z[:, i0:i1].T @ z[:, j0:j1], -1.0, 1.0)
+            result[i0:i1, j0:j1] = r
+            result[j0:j1, i0:i1] = r.T
+            if with_p:
+                p = _p_values(r, n)
+                p_values[i0:i1, j0:j1] = p
+                p_values[j0:j1, i0:i1] = p.T
+    np.fill_diagonal(result, 1.0)
+    if with_p:
+        np.fill_diagonal(p_values, 0.0)
+    return result, p_values, n
+
+
+def _pairwise_correlation(matrix, block, dtype, with_p):
+    # 欠損値がある場合は、ペアごとに両方がそろった行だけで計算する（pandas の corr と同じ）。
+    # 行列積 6 回で各ペアの件数・和・二乗和・積和を求める
+    n, k = matrix.shape
+    mask = np.isfinite(matrix)
+    present = mask.astype(np.float64)
+    # 桁落ちを避けるため、先に列の平均を引いておく
+    matrix -= np.nanmean(matrix, axis=0)
+    matrix[~mask] = 0.0
+    squares = matrix * matrix
+    result = np.empty((k, k), dtype=dtype)
+    p_values = np.empty((k, k), dtype=dtype) if with_p else None
+    counts = np.empty((k, k), dtype=np.int64)
+    blocks = _blocks(k, block)
+    for a, (i0, i1) in enumerate(blocks):
+        for j0, j1 in blocks[a:]:
+            count = present[:, i0:i1].T @ present[:, j0:j1]
+            sum_x = matrix[:, i0:i1].T @ present[:, j0:j1]
+            sum_y = present[:, i0:i1].T @ matrix[:, j0:j1]
+            sum_xx = squares[:, i0:i1].T @ present[:, j0:j1]
+            sum_yy = present[:, i0:i1].T @ squares[:, j0:j1]
+            sum_xy = matrix[:, i0:i1].T @ matrix[:, j0:j1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                covariance = sum_xy - sum_x * sum_y / count
+                variance_x = sum_xx - sum_x * sum_x / count
+                variance_y = sum_yy - sum_y * sum_y / count
+                r = np.clip(covariance / np.sqrt(variance_x * variance_y), -1.0, 1.0)
+            r[count < 2] = np.nan
+            result[i0:i1, j0:j1] = r
+            result[j0:j1, i0:i1] = r.T
+            counts[i0:i1, j0:j1] = count
+            counts[j0:j1, i0:i1] = count.T
+            if with_p:
+                p = _p_values(r, count)
+                p_values[i0:i1, j0:j1] = p
+                p_values[j0:j1, i0:i1] = p.T
+    diagonal = np.diag(counts) >= 2
+    result[np.diag_indices(k)] = np.where(diagonal, 1.0, np.nan)
+    if with_p:
+        p_values[np.diag_indices(k)] = np.where(diagonal, 0.0, np.nan)
+    return result, p_values, counts
+
+
+def compute_correlation(data, method='pearson', with_p=False, block=CORRELATION_BLOCK):
+    numeric = data.select_dtypes(include=[np.number])
+    columns = [str(column) for column in numeric.columns]
+    if method == 'spearman':
+        # 順位は列ごとに一度だけ付ける（欠損値は順位を付けずに残す）。
+        # 欠損値がある場合、ペアごとに付け直す pandas の結果とはわずかに異なる
+        matrix = np.ascontiguousarray(rank_matrix(numeric.to_numpy(dtype=np.float64, na_value=np.nan))[0])
+    else:
+        matrix = numeric.to_numpy(dtype=np.float64, copy=True)
+    dtype = np.float32 if len(columns) > FLOAT32_COLUMNS else np.float64
+    if np.isfinite(matrix).all():
+        result, p_values, n_obs = _complete_correlation(matrix, block, dtype, with_p)
+    else:
+        result, p_values, n_obs = _pairwise_correlation(matrix, block, dtype, with_p)
+    return CorrelationResult(columns, result, p_values, n_obs, method)
+
+
+def correlation_matrix(data, method='pearson', with_p=False):
+    # データのフィンガープリントごとに結果を保持する（p 値付きの結果は p 値なしの要求にも使う）
+    frame = data if isinstance(data, pd.DataFrame) else data.frame
+    data_key = fingerprint(frame) if isinstance(data, pd.DataFrame) else data.fingerprint
+    if not with_p:
+        cached = correlation_cache.get(correlation_cache.make_key("correlation", data_key,
+                                                                  {'method': method, 'with_p': True}))
+        if cached is not None:
+            return cached
+    return correlation_cache.get_or_compute(
+        "correlation", data_key,
+        lambda: compute_correlation(frame, method, with_p),
+        {'method': method, 'with_p': with_p}
+    )
+
+
+# 注記を付けて描く列数の上限（これより多いと数値が読めず、描画も遅くなる）
+HEATMAP_ANNOTATE_COLUMNS = 20
+
+
+def plot_correlation_heatmap(ax, data, method='pearson'):
+    result = correlation_matrix(data, method)
+    if len(result.columns) <= HEATMAP_ANNOTATE_COLUMNS:
+        sns.heatmap(result.to_frame(), annot=True, cmap='coolwarm', vmin=-1, vmax=1, ax=ax)
+        return
+    # 列が多い場合は行列を 1 枚の画像として描く
+    image = ax.imshow(result.matrix, cmap='coolwarm', vmin=-1, vmax=1, interpolation='nearest', aspect='auto')
+    ax.figure.colorbar(image, ax=ax)
+    if len(result.columns) <= 100:
+        ax.set_xticks(range(len(result.columns)))
+        ax.set_xticklabels(result.columns, rotation=90, fontsize=6)
+        ax.set_yticks(range(len(result.columns)))
+        ax.set_yticklabels(result.columns, fontsize=6)
@@ -0,0 +1,136 @@
+import numpy as np
+from scipy.signal import fftconvolve
+
+from grouped_data import as_grouped
+from result_cache import ResultCache
+
+KDE_GRIDSIZE = 1024
+# ガウスカーネルを打ち切る幅（バンド幅の何倍まで計算するか）
+KERNEL_RADIUS = 5.0
+# 描画範囲をデータの最小値・最大値からバンド幅の何倍まで広げるか（seaborn と同じ既定値）
+KDE_CUT = 3.0
+VIOLIN_CUT = 2.0
+
+# 同じデータの KDE はカーネル密度推定とバイオリンプロットで共有する
+kde_cache = ResultCache(max_entries=32, max_bytes=64 * 1024 * 1024)
+
+
+def linear_binning(values, low, high, size):
+    # 各値を両隣の格子点に距離に応じて振り分ける（単純なヒストグラムより誤差が小さい）
+    delta = (high - low) / (size - 1)
+    position = (values - low) / delta
+    index = np.clip(np.floor(position).astype(np.intp), 0, size - 2)
+    fraction = position - index
+    counts = np.bincount(index, weights=1.0 - fraction, minlength=size)
+    counts += np.bincount(index + 1, weights=fraction, minlength=size)
+    return counts
+
+
+def binned_bandwidth(counts, grid, method='scott'):
+    # 格子に集約した重みから標準偏差・四分位範囲を求めてバンド幅を決める
+    n = counts.sum()
+    mean = np.dot(counts, grid) / n
+    std = np.sqrt(np.dot(counts, (grid - mean) ** 2) / max(n - 1, 1))
+    if method == 'silverman':
+        cumulative = np.cumsum(counts)
+        q1, q3 = np.interp([0.25 * n, 0.75 * n], cumulative, grid)
+        spread = min(std, (q3 - q1) / 1.349) or std
+        return 0.9 * spread * n ** (-0.2)
+    return std * n ** (-0.2)
+
+
+class KDEResult:
+    def __init__(self, grid, density, bandwidth, n, low, high):
+        self.grid = grid
+        self.density = density
+        self.bandwidth = bandwidth
+        self.n = n
+        self.low = low
+        self.high = high
+
+    def trimmed(self, cut):
+        # データの範囲からバンド幅の cut 倍までに切り詰める
+        keep = (self.grid >= self.low - cut * self.bandwidth) & (self.grid <= self.high + cut * self.bandwidth)
+        return self.grid[keep], self.density[keep]
+
+
+def binned_kde(values, gridsize=KDE_GRIDSIZE, cut=KDE_CUT, bw_method='scott', bw_adjust=1.0):
+    # 格子に集約してからガウスカーネルを FFT で畳み込む。計算量は O(n + gridsize log gridsize)
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    n = len(values)
+    if n == 0:
+        return None
+    low, high = float(values.min()), float(values.max())
+    if high <= low:
+        return KDEResult(np.array([low]), np.array([np.inf]), 0.0, n, low, high)
+
+    grid = np.linspace(low, high, gridsize)
+    delta = grid[1] - grid[0]
+    counts = linear_binning(values, low, high, gridsize)
+    bandwidth = binned_bandwidth(counts, grid, bw_method) * bw_adjust
+    bandwidth = max(bandwidth, delta)
+
+    # 描画範囲を広げる分は、重み 0 の格子点を両側に足すだけでよい
+    pad = int(np.ceil(cut * bandwidth / delta))
+    counts = np.pad(counts, pad)
+    grid = low + delta * np.arange(-pad, gridsize + pad)
+
+    radius = min(int(np.ceil(KERNEL_RADIUS * bandwidth / delta)), len(counts) - 1)
+    offsets = np.arange(-radius, radius + 1) * (delta / bandwidth)
+    kernel = np.exp(-0.5 * offsets ** 2) / (np.sqrt(2 * np.pi) * bandwidth)
+    density = fftconvolve(counts, kernel, mode='same') / n
+    return KDEResult(grid, np.maximum(density, 0.0), bandwidth, n, low, high)
+
+
+def group_kdes(data, gridsize=KDE_GRIDSIZE):
+    # グループごとの KDE をまとめて計算してキャッシュする（GroupedData でグループ分けは一度だけ）。
+    # 広い方の描画範囲（KDE_CUT）で計算し、バイオリンプロットは切り詰めて使う
+    grouped = as_grouped(data)
+
+    def compute():
+        return [(str(label), binned_kde(values, gridsize, KDE_CUT)) for label, values in
+                zip(grouped.labels, grouped.groups())]
+
+    return kde_cache.get_or_compute(("kde", gridsize), grouped, compute)
+
+
+def plot_kde(ax, data):
+    # seaborn の common_norm=True と同じく、各グループの密度を全体に占める割合で縮める
+    kdes = [(label, kde) for label, kde in group_kdes(data) if kde is not None]
+    total = sum(kde.n for _, kde in kdes)
+    for index, (label, kde) in enumerate(kdes):
+        density = kde.density * (kde.n / total)
+        ax.fill_between(kde.grid, density, alpha=0.25, color=f"C{index % 10}", linewidth=0)
+        ax.plot(kde.grid, density, color=f"C{index % 10}", label=label)
+    ax.set_ylabel("Density")
+    if kdes:
+        ax.legend(title="group")
+
+
+def plot_violin(ax, data, width=0.8, cut=VIOLIN_CUT):
+    # 面積をそろえたバイオリン（最大の密度の幅が width になる）と、四分位の箱を描く
+    grouped = as_grouped(data)
+    kdes = group_kdes(grouped)
+    peak = max((kde.density.max() for _, kde in kdes if kde is not None and np.isfinite(kde.density).all()),
+               default=1.0)
+    for position, ((label, kde), values) in enumerate(zip(kdes, grouped.groups())):
+        if kde is None:
+            continue
+        color = f"C{position % 10}"
+        if len(kde.grid) > 1:
+            grid, density = kde.trimmed(cut)
+            half = density / peak * (width / 2)
+            ax.fill_betweenx(grid, position - half, position + half, color=color, alpha=0.8, linewidth=1,
+                             edgecolor='dimgray')
+        values = values[np.isfinite(values)]
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        low = values[values >= q1 - 1.5 * iqr].min()
+        high = values[values <= q3 + 1.5 * iqr].max()
+        ax.vlines(position, low, high, color='dimgray', linewidth=1)
+        ax.vlines(position, q1, q3, color='dimgray', linewidth=5)
+        ax.scatter([position], [median], color='white', s=12, zorder=3)
+    ax.set_xticks(range(len(kdes)))
+    ax.set_xticklabels([label for label, _ in kdes])
+    ax.set_xlim(-0.5, len(kdes) - 0.5)
@@ -0,0 +1,173 @@
+import weakref
+
+import numpy as np
+from matplotlib.colors import LogNorm
+
+# これより点が多いグラフは、全点を描かずに表示範囲ごとの集約で描く
+LOD_THRESHOLD = 200_000
+# 密度表示の 1 ビンあたりの画素数
+PIXELS_PER_BIN = 4
+# 点数がこれ以下のビンの点は、外れ値が埋もれないように個別の点としても描く
+SPARSE_BIN_COUNT = 2
+
+# 集約表示が再集約のために保持している元データの量（Figure ごと）。図のキャッシュの容量計算に使う
+_retained_bytes = weakref.WeakKeyDictionary()
+
+
+def retained_bytes(figure):
+    return _retained_bytes.get(figure, 0)
+
+
+def _retain(ax, *arrays):
+    figure = ax.figure
+    _retained_bytes[figure] = _retained_bytes.get(figure, 0) + sum(array.nbytes for array in arrays)
+
+
+def _finite_sorted(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    order = np.argsort(x, kind='stable')
+    return x[order], y[order]
+
+
+def _padded_limits(values):
+    if len(values) == 0:
+        return 0.0, 1.0
+    low, high = float(values.min()), float(values.max())
+    margin = (high - low) * 0.02 or 0.5
+    return low - margin, high + margin
+
+
+def _connect_limits(ax, update):
+    # 拡大・移動で表示範囲が変わったら集約し直す。
+    # set_xlim / set_ylim の両方が呼ばれても 1 回の再集約で済むように、再入を防ぐ。
+    state = {'busy': False}
+
+    def on_limits_changed(_ax):
+        if state['busy']:
+            return
+        state['busy'] = True
+        try:
+            update()
+        finally:
+            state['busy'] = False
+
+    # 関数は強参照で登録されるので、update が参照する描画オブジェクトも Axes と同じ間だけ保持される
+    ax.callbacks.connect('xlim_changed', on_limits_changed)
+    ax.callbacks.connect('ylim_changed', on_limits_changed)
+
+
+def _visible_range(x, low, high):
+    return np.searchsorted(x, low, side='left'), np.searchsorted(x, high, side='right')
+
+
+class DensityScatter:
+    # 散布図を表示範囲の 2 次元ヒストグラム（対数色）で描き、点の少ないビンの点だけを個別に重ねる
+    def __init__(self, ax, x, y, cmap='viridis', point_color='tab:red'):
+        self.ax = ax
+        self.x, self.y = _finite_sorted(x, y)
+        _retain(ax, self.x, self.y)
+        x_limits = _padded_limits(self.x)
+        y_limits = _padded_limits(self.y)
+        self.image = ax.imshow(np.ma.masked_all((1, 1)), origin='lower', aspect='auto', cmap=cmap,
+                               norm=LogNorm(vmin=1, vmax=2), interpolation='nearest', extent=x_limits + y_limits)
+        self.points = ax.scatter([], [], s=4, color=point_color, linewidths=0)
+        ax.set_xlim(x_limits)
+        ax.set_ylim(y_limits)
+        ax.set_autoscale_on(False)
+        ax.figure.colorbar(self.image, ax=ax, label="点の数")
+        self.update()
+        _connect_limits(ax, self.update)
+
+    def update(self):
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+        start, stop = _visible_range(self.x, x0, x1)
+        xs = self.x[start:stop]
+        ys = self.y[start:stop]
+        inside = (ys >= y0) & (ys <= y1)
+        xs, ys = xs[inside], ys[inside]
+
+        bbox = self.ax.bbox
+        nx = max(10, int(bbox.width / PIXELS_PER_BIN))
+        ny = max(10, int(bbox.height / PIXELS_PER_BIN))
+        ix = np.minimum(((xs - x0) * (nx / (x1 - x0))).astype(np.intp), nx - 1)
+        iy = np.minimum(((ys - y0) * (ny / (y1 - y0))).astype(np.intp), ny - 1)
+        bins = iy * nx + ix
+        counts = np.bincount(bins, minlength=nx * ny)
+
+        self.image.set_data(np.ma.masked_equal(counts.reshape(ny, nx), 0))
+        self.image.set_extent((x0, x1, y0, y1))
+        self.image.norm.vmax = max(2, int(counts.max()) if len(counts) else 2)
+        sparse = counts[bins] <= SPARSE_BIN_COUNT
+        self.points.set_offsets(np.column_stack([xs[sparse], ys[sparse]]))
+
+
+def decimate_min_max(x, y, low, high, buckets):
+    # 表示範囲を画素列ごとに区切り、各列の最初・最小・最大・最後の点だけを残す。
+    # 線を描いたときの見た目は全点を描いた場合と変わらない。
+    start, stop = _visible_range(x, low, high)
+    start = max(start - 1, 0)
+    stop = min(stop + 1, len(x))
+    xs = x[start:stop]
+    ys = y[start:stop]
+    if len(xs) <= 4 * buckets:
+        return xs, ys
+
+    starts = np.unique(np.searchsorted(xs, np.linspace(xs[0], xs[-1], buckets + 1)[:-1], side='left'))
+    lengths = np.diff(np.append(starts, len(xs)))
+    bucket_of = np.repeat(np.arange(len(starts)), lengths)
+    keep = [starts, starts + lengths - 1]
+    for reduce in (np.minimum, np.maximum):
+        extreme = np.repeat(reduce.reduceat(ys, starts), lengths)
+        positions = np.flatnonzero(ys == extreme)
+        _, first = np.unique(bucket_of[positions], return_index=True)
+        keep.append(positions[first])
+    index = np.unique(np.concatenate(keep))
+    return xs[index], ys[index]
+
+
+class MinMaxLines:
+    # 折れ線・面グラフを系列ごとに画素単位の最小値・最大値へ間引いて描く
+    def __init__(self, ax, series, area=False):
+        self.ax = ax
+        self.area = area
+        self.series = []
+        for label, x, y in series:
+            x, y = _finite_sorted(x, y)
+            _retain(ax, x, y)
+            line, = ax.plot([], [], label=str(label), linewidth=1)
+            self.series.append({'x': x, 'y': y, 'line': line, 'fill': None})
+        all_x = np.concatenate([s['x'] for s in self.series]) if self.series else np.array([])
+        all_y = np.concatenate([s['y'] for s in self.series]) if self.series else np.array([])
+        ax.set_xlim(_padded_limits(all_x))
+        y_limits = _padded_limits(all_y)
+        ax.set_ylim(min(y_limits[0], 0) if area else y_limits[0], y_limits[1])
+        ax.set_autoscale_on(False)
+        if self.series:
+            ax.legend(title="group")
+        self.update()
+        _connect_limits(ax, self.update)
+
+    def update(self):
+        low, high = sorted(self.ax.get_xlim())
+        buckets = max(10, int(self.ax.bbox.width))
+        for s in self.series:
+            xs, ys = decimate_min_max(s['x'], s['y'], low, high, buckets)
+            s['line'].set_data(xs, ys)
+            if self.area:
+                if s['fill'] is not None:
+                    s['fill'].remove()
+                s['fill'] = self.ax.fill_between(xs, ys, alpha=0.3, color=s['line'].get_color())
+
+
+def group_series(data, x, y, hue='group'):
+    if hue not in data:
+        return [(y, data[x].to_numpy(), data[y].to_numpy())]
+    series = []
+    for label, frame in data.groupby(hue, sort=True, observed=True)[[x, y]]:
+        series.append((label, frame[x].to_numpy(), frame[y].to_numpy()))
+    return series
@@ -0,0 +1,108 @@
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from result_cache import fingerprint
+
+
+class GroupedData:
+    # group列を一度だけ因子化し、値をグループ順に並べ替えて保持する。
+    # 各グループの値は values[offsets[i]:offsets[i + 1]] のビューとして取り出せる。
+    # グループ内の行の順序は元の順序のまま（対応のある検定のため）。
+    def __init__(self, frame, group_column='group', value_column='value'):
+        self.frame = frame
+        self.group_column = group_column
+        self.value_column = value_column
+
+    @cached_property
+    def fingerprint(self):
+        return fingerprint(self.frame)
+
+    @cached_property
+    def _factorized(self):
+        codes, labels = pd.factorize(self.frame[self.group_column], sort=False)
+        n_groups = len(labels)
+        # グループ数が少なければ小さい整数型にして、安定ソートを基数ソートにする
+        code_dtype = np.int16 if n_groups < np.iinfo(np.int16).max else np.int64
+        codes = codes.astype(code_dtype, copy=False)
+        order = np.argsort(codes, kind='stable')
+        n_missing = int(np.count_nonzero(codes < 0))
+        order = order[n_missing:]
+        counts = np.bincount(codes[order], minlength=n_groups)
+        offsets = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return codes, labels, order, counts, offsets
+
+    @property
+    def codes(self):
+        return self._factorized[0]
+
+    @property
+    def labels(self):
+        return self._factorized[1]
+
+    @property
+    def order(self):
+        return self._factorized[2]
+
+    @property
+    def counts(self):
+        return self._factorized[3]
+
+    @property
+    def offsets(self):
+        return self._factorized[4]
+
+    @property
+    def n_groups(self):
+        return len(self.labels)
+
+    @cached_property
+    def values(self):
+        return self.frame[self.value_column].to_numpy(dtype=np.float64)[self.order]
+
+    @cached_property
+    def sorted_codes(self):
+        return self.codes[self.order]
+
+    def column(self, name):
+        # 任意の列をグループ順に並べ替えて返す
+        return self.frame[name].to_numpy()[self.order]
+
+    def group(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def groups(self):
+        return [self.group(i) for i in range(self.n_groups)]
+
+    def two_groups(self):
+        if self.n_groups < 2:
+            raise ValueError("2つ以上のグループが必要です。")
+        return self.group(0), self.group(1)
+
+    def group_labels(self):
+        # 並べ替え後の各行に対応するグループラベル
+        return np.asarray(self.labels)[self.sorted_codes]
+
+    @cached_property
+    def sums(self):
+        return np.add.reduceat(self.values, self.offsets[:-1]) if self.n_groups else np.zeros(0)
+
+    @cached_property
+    def means(self):
+        return self.sums / self.counts
+
+    @cached_property
+    def variances(self):
+        # 不偏分散（ddof=1）
+        deviations = self.values - np.repeat(self.means, self.counts)
+        squares = np.add.reduceat(deviations * deviations, self.offsets[:-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return squares / (self.counts - 1)
+
+
+def as_grouped(data):
+    if isinstance(data, GroupedData):
+        return data
+    return GroupedData(data)
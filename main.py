@@ -1,21 +1,94 @@
 import sys
-from PySide6.QtWidgets import QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout, QToolTip, QMessageBox, QMenu, QMenuBar
+from PySide6.QtWidgets import QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout, QToolTip, QMessageBox, QMenu, QMenuBar, QFileDialog
 from PySide6.QtGui import QFont, QAction
+from PySide6.QtCore import QThread, QThreadPool
 from tabs.test_selection import TestSelectionTab
 from tabs.data_import import DataImportTab
 from tabs.data_preprocessing import DataPreprocessingTab
 from tabs.graph_selection import GraphSelectionTab
 from tabs.statistical_results import StatisticalResultsTab
 from tabs.post_hoc import PostHocTab
-from tabs.graph_display import GraphDisplayTab
+from tabs.graph_display import GraphDisplayTab, figure_params, render_figure
 from tabs.export_results import ExportResultsTab
 from tabs.help import HelpTab
 from tabs.advanced_analysis import AdvancedAnalysisTab
 from tabs.report_generation import ReportGenerationTab
 from statistical_tests import run_statistical_test, run_post_hoc_test
+from mass_testing import MASS_TESTS, mass_test, summarize_mass_test
+from multiple_testing import CORRECTION_METHODS
+from grouped_data import GroupedData
+from result_cache import ResultCache
+from columnar_io import SESSION_EXTENSION, open_session, save_session
 from user_settings import UserSettings
+from workers import Cancelled, Worker, start_worker
 import pandas as pd
 
+
+def execute_test_run(result_cache, figure_cache, test, grouped_data, graph_type, customization, lod_threshold,
+                     test_options=None, progress_callback=None, is_cancelled=None):
+    # 検定・結果表・グラフの作成をワーカースレッドで順に実行する。
+    # 段階の合間に中止されていないかを確認する。
+    def check_cancelled():
+        if is_cancelled is not None and is_cancelled():
+            raise Cancelled()
+
+    progress_callback(5)
+    results, is_significant = result_cache.get_or_compute(
+        ("test", test),
+        grouped_data,
+        lambda: run_statistical_test(test, grouped_data, test_options),
+        test_options
+    )
+    check_cancelled()
+    progress_callback(50)
+    results_frame = pd.DataFrame({'結果': [results]})
+    check_cancelled()
+    progress_callback(60)
+    # ラベルは表示するときに GUI スレッドで付け直すので、キャッシュ済みの Figure はここでは書き換えない
+    figure = figure_cache.get_or_compute(
+        ("figure", graph_type),
+        grouped_data,
+        lambda: render_figure(grouped_data.frame, test, graph_type, customization, lod_threshold=lod_threshold),
+        figure_params(customization, lod_threshold)
+    )
+    check_cancelled()
+    progress_callback(100)
+    return results, is_significant, results_frame, figure, graph_type
+
+
+def execute_mass_test_run(result_cache, test, correction, grouped_data, progress_callback=None, is_cancelled=None):
+    # すべての測定列に同じ検定を行い、補正後の p 値の順に並べた表と要約の文字列を返す
+    def compute():
+        table = mass_test(grouped_data, MASS_TESTS[test], CORRECTION_METHODS[correction], is_cancelled=is_cancelled)
+        if table is None:
+            raise Cancelled()
+        return table
+
+    progress_callback(5)
+    table = result_cache.get_or_compute(
+        ("mass_test", MASS_TESTS[test]),
+        grouped_data,
+        compute,
+        {'correction': CORRECTION_METHODS[correction]}
+    )
+    progress_callback(90)
+    results, is_significant = summarize_mass_test(table, test, correction)
+    progress_callback(100)
+    return results, is_significant, table
+
+
+def execute_post_hoc_run(result_cache, test, grouped_data, control=None, progress_callback=None, is_cancelled=None):
+    results = result_cache.get_or_compute(
+        ("post_hoc", test),
+        grouped_data,
+        lambda: run_post_hoc_test(test, grouped_data, control),
+        {'control': control} if test == "Dunnett検定" else None
+    )
+    if is_cancelled is not None and is_cancelled():
+        raise Cancelled()
+    return results
+
+
 class StatisticalSoftware(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -23,6 +96,10 @@ class StatisticalSoftware(QMainWindow):
         self.setGeometry(100, 100, 1200, 800)
 
         self.user_settings = UserSettings()
+        self.result_cache = ResultCache(
+            max_entries=self.user_settings.get_setting("result_cache_max_entries", 128),
+            max_bytes=self.user_settings.get_setting("result_cache_max_mb", 256) * 1024 * 1024
+        )
 
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -32,6 +109,13 @@ class StatisticalSoftware(QMainWindow):
         self.layout.addWidget(self.tabs)
 
         self.data = None
+        self.grouped_data = None
+        self.test_worker = None
+        self.post_hoc_worker = None
+
+        # 検定とグラフ作成を実行するワーカープール
+        self.worker_pool = QThreadPool(self)
+        self.worker_pool.setMaxThreadCount(max(2, QThread.idealThreadCount()))
         self.selected_test = None
         self.results = None
 
@@ -59,6 +143,10 @@ class StatisticalSoftware(QMainWindow):
         self.tabs.addTab(self.report_generation_tab, "レポート生成")
         self.tabs.addTab(self.help_tab, "ヘルプ")
 
+        self.statistical_results_tab.cancel_button.clicked.connect(self.cancel_statistical_test)
+        self.test_selection_tab.options_changed.connect(self.on_test_options_changed)
+        self.test_selection_tab.mass_test_requested.connect(self.run_mass_test)
+
         self.setup_tooltips()
         self.create_menu()
         self.load_user_settings()
@@ -84,6 +172,16 @@ class StatisticalSoftware(QMainWindow):
         file_menu = QMenu("ファイル", self)
         menu_bar.addMenu(file_menu)
 
+        open_session_action = QAction("作業データを開く", self)
+        open_session_action.triggered.connect(self.open_working_dataset)
+        file_menu.addAction(open_session_action)
+
+        save_session_action = QAction("作業データを保存", self)
+        save_session_action.triggered.connect(self.save_working_dataset)
+        file_menu.addAction(save_session_action)
+
+        file_menu.addSeparator()
+
         save_settings_action = QAction("設定を保存", self)
         save_settings_action.triggered.connect(self.save_user_settings)
         file_menu.addAction(save_settings_action)
@@ -96,6 +194,40 @@ class StatisticalSoftware(QMainWindow):
         clear_settings_action.triggered.connect(self.clear_user_settings)
         file_menu.addAction(clear_settings_action)
 
+        file_menu.addSeparator()
+
+        cache_stats_action = QAction("結果キャッシュの状態", self)
+        cache_stats_action.triggered.connect(self.show_cache_stats)
+        file_menu.addAction(cache_stats_action)
+
+        clear_cache_action = QAction("結果キャッシュをクリア", self)
+        clear_cache_action.triggered.connect(self.clear_result_cache)
+        file_menu.addAction(clear_cache_action)
+
+    def save_working_dataset(self):
+        if self.data is None:
+            QMessageBox.warning(self, "警告", "保存するデータがありません。")
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "作業データを保存", "", f"Working Dataset (*{SESSION_EXTENSION})")
+        if file_name:
+            if not file_name.endswith(SESSION_EXTENSION):
+                file_name += SESSION_EXTENSION
+            try:
+                save_session(self.data, file_name)
+                QMessageBox.information(self, "成功", "作業データを保存しました。")
+            except Exception as e:
+                QMessageBox.critical(self, "エラー", f"作業データの保存中にエラーが発生しました: {str(e)}")
+
+    def open_working_dataset(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "作業データを開く", "", f"Working Dataset (*{SESSION_EXTENSION})")
+        if file_name:
+            try:
+                data = open_session(file_name)
+            except Exception as e:
+                QMessageBox.critical(self, "エラー", f"作業データの読み込み中にエラーが発生しました: {str(e)}")
+                return
+            self.data_import_tab.process_data(data)
+
     def save_user_settings(self):
         self.user_settings.set_setting("selected_test", self.selected_test)
         self.user_settings.set_setting("graph_type", self.graph_selection_tab.get_selected_graph_type())
@@ -121,6 +253,22 @@ class StatisticalSoftware(QMainWindow):
         self.user_settings.clear_settings()
         QMessageBox.information(self, "設定クリア", "ユーザー設定がクリアされました。")
 
+    def show_cache_stats(self):
+        stats = self.result_cache.stats()
+        QMessageBox.information(
+            self, "結果キャッシュ",
+            f"エントリ数: {stats['entries']} / {self.result_cache.max_entries}\n"
+            f"使用メモリ: {stats['bytes'] / 1024 / 1024:.1f} MB / {self.result_cache.max_bytes / 1024 / 1024:.0f} MB\n"
+            f"ヒット: {stats['hits']}\n"
+            f"ミス: {stats['misses']}\n"
+            f"追い出し: {stats['evictions']}\n"
+            f"ヒット率: {stats['hit_rate']:.1%}"
+        )
+
+    def clear_result_cache(self):
+        self.result_cache.clear()
+        QMessageBox.information(self, "結果キャッシュ", "結果キャッシュをクリアしました。")
+
     def on_test_selected(self, test):
         self.selected_test = test
         print(f"Selected test: {test}")
@@ -128,10 +276,16 @@ class StatisticalSoftware(QMainWindow):
         if self.data is not None:
             self.run_statistical_test()
 
+    def on_test_options_changed(self):
+        if self.data is not None and self.selected_test is not None:
+            self.run_statistical_test()
+
     def on_data_imported(self, data):
         self.data = data
+        self.grouped_data = GroupedData(data)
         self.data_preprocessing_tab.set_data(data)
         self.advanced_analysis_tab.set_data(data)
+        self.update_control_groups()
         print("Data imported")
         self.update_post_hoc_availability()
         if self.selected_test is not None:
@@ -139,11 +293,17 @@ class StatisticalSoftware(QMainWindow):
 
     def on_data_preprocessed(self, data):
         self.data = data
+        self.grouped_data = GroupedData(data)
         self.advanced_analysis_tab.set_data(data)
+        self.update_control_groups()
         print("Data preprocessed")
         if self.selected_test is not None:
             self.run_statistical_test()
 
+    def update_control_groups(self):
+        labels = list(self.grouped_data.labels) if 'group' in self.data else []
+        self.post_hoc_tab.set_groups([str(label) for label in labels])
+
     def update_post_hoc_availability(self):
         if self.data is not None and self.selected_test in ["一元配置分散分析（ANOVA）", "Kruskal-Wallis検定"]:
             self.post_hoc_tab.enable_post_hoc(True)
@@ -151,47 +311,118 @@ class StatisticalSoftware(QMainWindow):
             self.post_hoc_tab.enable_post_hoc(False)
 
     def run_statistical_test(self):
-        try:
-            results, is_significant = run_statistical_test(self.selected_test, self.data)
-            self.statistical_results_tab.update_results(results, is_significant)
-            self.results = pd.DataFrame({'結果': [results]})
-            self.export_results_tab.set_results(self.results)
-            self.report_generation_tab.set_results(self.results)
-            
-            graph = self.graph_display_tab.plot_graph(
-                self.data,
-                self.selected_test,
-                self.graph_selection_tab.get_selected_graph_type(),
-                self.graph_selection_tab.get_customization()
-            )
-            self.export_results_tab.set_graph(graph)
-            self.report_generation_tab.set_graph(graph)
-        except Exception as e:
-            QMessageBox.critical(self, "エラー", f"統計検定の実行中にエラーが発生しました: {str(e)}")
+        # 実行中の検定があれば中止し、新しい実行で置き換える
+        self.cancel_statistical_test()
+        graph_type = self.graph_display_tab.resolve_graph_type(self.graph_selection_tab.get_selected_graph_type())
+        customization = self.graph_selection_tab.get_customization()
+        self.graph_display_tab.set_graph_state(self.data, self.selected_test, customization, self.grouped_data)
 
-    def on_post_hoc_test(self, test):
-        try:
-            results = run_post_hoc_test(test, self.data)
-            self.post_hoc_tab.update_results(results)
-            self.results = pd.DataFrame({'結果': [results]})
-            self.export_results_tab.set_results(self.results)
-            self.report_generation_tab.set_results(self.results)
-        except Exception as e:
-            QMessageBox.critical(self, "エラー", f"Post Hoc検定の実行中にエラーが発生しました: {str(e)}")
-
-    def on_advanced_analysis_completed(self, results):
-        self.results = results
+        worker = Worker(execute_test_run, self.result_cache, self.graph_display_tab.figure_cache,
+                        self.selected_test, self.grouped_data,
+                        graph_type, customization, self.graph_display_tab.lod_threshold(),
+                        self.test_selection_tab.get_test_options())
+        worker.signals.progress.connect(lambda value: self.on_test_progress(worker, value))
+        worker.signals.finished.connect(lambda result: self.on_test_finished(worker, result))
+        worker.signals.error.connect(lambda error: self.on_test_error(worker, error))
+        self.statistical_results_tab.set_running(True)
+        self.test_worker = start_worker(worker, self.worker_pool)
+
+    def run_mass_test(self, test, correction):
+        if self.data is None:
+            QMessageBox.warning(self, "警告", "データがインポートされていません。")
+            return
+        self.cancel_statistical_test()
+        worker = Worker(execute_mass_test_run, self.result_cache, test, correction, self.grouped_data)
+        worker.signals.progress.connect(lambda value: self.on_test_progress(worker, value))
+        worker.signals.finished.connect(lambda result: self.on_mass_test_finished(worker, result))
+        worker.signals.error.connect(lambda error: self.on_test_error(worker, error))
+        self.statistical_results_tab.set_running(True, "一括検定を実行中...")
+        self.test_worker = start_worker(worker, self.worker_pool)
+        self.tabs.setCurrentWidget(self.statistical_results_tab)
+
+    def on_mass_test_finished(self, worker, result):
+        if worker is not self.test_worker:
+            return
+        self.test_worker = None
+        self.statistical_results_tab.set_running(False)
+        results, is_significant, table = result
+        self.statistical_results_tab.update_results(results, is_significant)
+        # エクスポートとレポートには全列の結果表を渡す
+        self.results = table
         self.export_results_tab.set_results(self.results)
         self.report_generation_tab.set_results(self.results)
-        graph = self.graph_display_tab.plot_graph(
-            self.results,
-            "高度な分析",
-            self.graph_selection_tab.get_selected_graph_type(),
-            self.graph_selection_tab.get_customization()
-        )
+
+    def cancel_statistical_test(self):
+        if self.test_worker is not None:
+            self.test_worker.cancel()
+            self.test_worker = None
+            self.statistical_results_tab.set_running(False)
+
+    def on_test_progress(self, worker, value):
+        if worker is self.test_worker:
+            self.statistical_results_tab.update_progress(value)
+
+    def on_test_finished(self, worker, result):
+        # 置き換えられた古い実行の結果は捨てる
+        if worker is not self.test_worker:
+            return
+        self.test_worker = None
+        self.statistical_results_tab.set_running(False)
+        results, is_significant, results_frame, graph, graph_type = result
+        self.statistical_results_tab.update_results(results, is_significant)
+        self.results = results_frame
+        self.export_results_tab.set_results(self.results)
+        self.report_generation_tab.set_results(self.results)
+
+        self.graph_display_tab.show_graph(graph, graph_type)
         self.export_results_tab.set_graph(graph)
         self.report_generation_tab.set_graph(graph)
 
+    def on_test_error(self, worker, error):
+        if worker is not self.test_worker:
+            return
+        self.test_worker = None
+        self.statistical_results_tab.set_running(False)
+        if not isinstance(error, Cancelled):
+            QMessageBox.critical(self, "エラー", f"統計検定の実行中にエラーが発生しました: {str(error)}")
+
+    def on_post_hoc_test(self, test):
+        if self.post_hoc_worker is not None:
+            self.post_hoc_worker.cancel()
+        worker = Worker(execute_post_hoc_run, self.result_cache, test, self.grouped_data,
+                        self.post_hoc_tab.control_group())
+        worker.signals.finished.connect(lambda results: self.on_post_hoc_finished(worker, results))
+        worker.signals.error.connect(lambda error: self.on_post_hoc_error(worker, error))
+        self.post_hoc_worker = start_worker(worker, self.worker_pool)
+
+    def on_post_hoc_finished(self, worker, results):
+        if worker is not self.post_hoc_worker:
+            return
+        self.post_hoc_worker = None
+        self.post_hoc_tab.update_results(results)
+        self.results = pd.DataFrame({'結果': [results]})
+        self.export_results_tab.set_results(self.results)
+        self.report_generation_tab.set_results(self.results)
+
+    def on_post_hoc_error(self, worker, error):
+        if worker is not self.post_hoc_worker:
+            return
+        self.post_hoc_worker = None
+        if not isinstance(error, Cancelled):
+            QMessageBox.critical(self, "エラー", f"Post Hoc検定の実行中にエラーが発生しました: {str(error)}")
+
+    def on_advanced_analysis_completed(self, results, figure):
+        self.results = results
+        self.export_results_tab.set_results(self.results)
+        self.report_generation_tab.set_results(self.results)
+        self.graph_display_tab.show_figure(figure)
+        self.export_results_tab.set_graph(figure)
+        self.report_generation_tab.set_graph(figure)
+
+    def closeEvent(self, event):
+        self.advanced_analysis_tab.shutdown()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = StatisticalSoftware()
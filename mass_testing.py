@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from grouped_data import GroupedData, as_grouped
+from multiple_testing import adjust_pvalues
+from ranking import rank_matrix
+
+MASS_TESTS = {
+    "対応のないt検定": 't_test',
+    "Mann-Whitney U検定": 'mann_whitney',
+    "一元配置分散分析（ANOVA）": 'anova',
+    "Kruskal-Wallis検定": 'kruskal',
+}
+# 列をこの本数ずつまとめて行列として計算する（行数 × 列数の一時配列の大きさを抑える）
+MASS_TEST_BLOCK = 2000
+
+
+def measurement_columns(data, group_column='group'):
+    return [column for column in data.select_dtypes(include=[np.number]).columns if column != group_column]
+
+
+def _group_sums(matrix, present, offsets):
+    # グループごとの件数・和・偏差平方和（行はグループ順に並んでいる）。欠損値は 0 として除外済み
+    starts = offsets[:-1]
+    counts = np.add.reduceat(present, starts, axis=0)
+    sums = np.add.reduceat(matrix, starts, axis=0)
+    squares = np.add.reduceat(matrix * matrix, starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        ss = squares - sums * means
+    return counts, means, np.maximum(ss, 0.0)
+
+
+def _t_test(matrix, present, offsets):
+    counts, means, ss = _group_sums(matrix, present, offsets)
+    n1, n2 = counts[0], counts[1]
+    df = n1 + n2 - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = (ss[0] + ss[1]) / df
+        t = (means[0] - means[1]) / np.sqrt(pooled * (1 / n1 + 1 / n2))
+        p = 2 * stats.t.sf(np.abs(t), df)
+    return t, p, means
+
+
+def _anova(matrix, present, offsets):
+    counts, means, ss = _group_sums(matrix, present, offsets)
+    total = counts.sum(axis=0)
+    k = np.count_nonzero(counts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grand = np.nansum(means * counts, axis=0) / total
+        between = np.nansum(counts * (means - grand) ** 2, axis=0)
+        within = ss.sum(axis=0)
+        f = (between / (k - 1)) / (within / (total - k))
+        p = stats.f.sf(f, k - 1, total - k)
+    return f, p, means
+
+
+def _ranks(block, present):
+    # 列ごとの平均順位と同順位の補正項（1 回の並べ替えで両方求める）。欠損値は順位を付けず 0 にする
+    ranks, ties = rank_matrix(block)
+    ranks[present == 0] = 0.0
+    return ranks, ties
+
+
+def _mann_whitney(block, present, offsets):
+    # scipy の mannwhitneyu（両側、連続性補正あり、正規近似）と同じ式
+    ranks, ties = _ranks(block, present)
+    counts, _, _ = _group_sums(ranks, present, offsets)
+    n1, n2 = counts[0], counts[1]
+    n = n1 + n2
+    rank_sum = np.add.reduceat(ranks, offsets[:-1], axis=0)[0]
+    u1 = rank_sum - n1 * (n1 + 1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (np.maximum(u1, n1 * n2 - u1) - n1 * n2 / 2 - 0.5) / sigma
+        p = np.minimum(2 * stats.norm.sf(z), 1.0)
+    means = np.add.reduceat(np.where(present > 0, block, 0.0), offsets[:-1], axis=0) / counts
+    return u1, p, means
+
+
+def _kruskal(block, present, offsets):
+    ranks, ties = _ranks(block, present)
+    counts, _, _ = _group_sums(ranks, present, offsets)
+    n = counts.sum(axis=0)
+    rank_sums = np.add.reduceat(ranks, offsets[:-1], axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = 12 / (n * (n + 1)) * np.nansum(rank_sums ** 2 / counts, axis=0) - 3 * (n + 1)
+        h /= 1 - ties / (n ** 3 - n)
+        p = stats.chi2.sf(h, np.count_nonzero(counts, axis=0) - 1)
+    means = np.add.reduceat(np.where(present > 0, block, 0.0), offsets[:-1], axis=0) / counts
+    return h, p, means
+
+
+TEST_FUNCTIONS = {'t_test': _t_test, 'mann_whitney': _mann_whitney, 'anova': _anova, 'kruskal': _kruskal}
+
+
+def mass_test(data, test, correction='fdr_bh', columns=None, group_column='group', block=MASS_TEST_BLOCK,
+              is_cancelled=None):
+    # すべての測定列について同じ検定を行列演算でまとめて計算し、補正後の p 値の順に並べた表を返す
+    grouped = as_grouped(data)
+    if grouped.group_column != group_column:
+        grouped = GroupedData(grouped.frame, group_column)
+    frame = grouped.frame
+    columns = measurement_columns(frame, group_column) if columns is None else list(columns)
+    if not columns:
+        raise ValueError("検定する数値列がありません。")
+    if grouped.n_groups < 2:
+        raise ValueError("2つ以上のグループが必要です。")
+    if test in ('t_test', 'mann_whitney'):
+        # 2 群の検定は既存の検定と同じく最初の 2 グループを比べる
+        offsets = grouped.offsets[:3]
+    else:
+        offsets = grouped.offsets
+    rows = grouped.order[:offsets[-1]]
+    labels = [str(label) for label in grouped.labels[:len(offsets) - 1]]
+    function = TEST_FUNCTIONS[test]
+
+    statistics, p_values, group_means, group_counts = [], [], [], []
+    for start in range(0, len(columns), block):
+        if is_cancelled is not None and is_cancelled():
+            return None
+        values = frame[columns[start:start + block]].to_numpy(dtype=np.float64, na_value=np.nan)[rows]
+        present = np.isfinite(values).astype(np.float64)
+        if test in ('t_test', 'anova'):
+            # 桁落ちを避けるため、列ごとの平均を引いてから和・平方和を求める
+            with np.errstate(invalid='ignore'):
+                center = np.nanmean(values, axis=0)
+            matrix = np.where(present > 0, values - center, 0.0)
+            statistic, p, means = function(matrix, present, offsets)
+            means = means + center
+        else:
+            statistic, p, means = function(values, present, offsets)
+        statistics.append(statistic)
+        p_values.append(p)
+        group_means.append(means)
+        group_counts.append(np.add.reduceat(present, offsets[:-1], axis=0))
+
+    p_values = np.concatenate(p_values)
+    table = pd.DataFrame({'列': [str(column) for column in columns],
+                          '統計量': np.concatenate(statistics),
+                          'p値': p_values,
+                          '補正p値': adjust_pvalues(p_values, correction)})
+    means = np.concatenate(group_means, axis=1)
+    counts = np.concatenate(group_counts, axis=1)
+    for i, label in enumerate(labels):
+        table[f"平均 ({label})"] = means[i]
+        table[f"件数 ({label})"] = counts[i].astype(np.int64)
+    table['有意'] = table['補正p値'] < 0.05
+    return table.sort_values(['補正p値', 'p値'], kind='stable', na_position='last').reset_index(drop=True)
+
+
+def summarize_mass_test(table, test_label, correction_label, top=50):
+    significant = int(table['有意'].sum())
+    lines = [f"{test_label}（{len(table):,}列、補正: {correction_label}）",
+             f"補正後 p < 0.05 の列: {significant:,}",
+             "",
+             table.head(top).to_string(index=False, float_format=lambda value: f"{value:.4g}")]
+    if len(table) > top:
+        lines.append(f"...（上位{top}列のみ表示。全件は結果のエクスポートから保存できます）")
+    return "\n".join(lines), significant > 0
@@ -0,0 +1,38 @@
+import numpy as np
+
+CORRECTION_METHODS = {
+    "Benjamini-Hochberg (FDR)": 'fdr_bh',
+    "Bonferroni": 'bonferroni',
+    "Holm": 'holm',
+    "補正なし": 'none',
+}
+
+
+def adjust_pvalues(p_values, method='fdr_bh'):
+    # 多重比較の補正を一度の並べ替えで計算する。NaN の p 値は数に含めず NaN のまま返す
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(np.isfinite(p_values.ravel()))
+    p = p_values.ravel()[valid]
+    m = len(p)
+    if m == 0 or method == 'none':
+        adjusted.ravel()[valid] = p
+        return adjusted
+
+    if method == 'bonferroni':
+        result = np.minimum(p * m, 1.0)
+    elif method == 'holm':
+        order = np.argsort(p, kind='stable')
+        steps = np.maximum.accumulate(p[order] * (m - np.arange(m)))
+        result = np.empty(m)
+        result[order] = np.minimum(steps, 1.0)
+    elif method == 'fdr_bh':
+        order = np.argsort(p, kind='stable')
+        scaled = p[order] * m / np.arange(1, m + 1)
+        steps = np.minimum.accumulate(scaled[::-1])[::-1]
+        result = np.empty(m)
+        result[order] = np.minimum(steps, 1.0)
+    else:
+        raise ValueError(f"不明な補正方法です: {method}")
+    adjusted.ravel()[valid] = result
+    return adjusted
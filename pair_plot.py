@@ -0,0 +1,161 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from matplotlib.colors import LogNorm, to_rgba_array
+from matplotlib.lines import Line2D
+
+PAIR_PLOT_MAX_COLUMNS = 30
+PAIR_PLOT_BINS = 48
+# 散布図のパネルに描く点数の上限（グループごとに層別して抽出する）
+PAIR_PLOT_SAMPLE = 5000
+# 上三角のすべてのパネルを合わせた点数の上限
+PAIR_PLOT_TOTAL_POINTS = 200_000
+# 小さいグループも見えるように、各グループから最低限抽出する点数
+PAIR_PLOT_MIN_PER_GROUP = 100
+
+
+def _bin_codes(values, bins):
+    # 列を一度だけ 0..bins-1 の整数に変換する（欠損値は bins）
+    finite = np.isfinite(values)
+    if finite.any():
+        low, high = float(values[finite].min()), float(values[finite].max())
+    else:
+        low, high = 0.0, 1.0
+    if high <= low:
+        high = low + 1.0
+    codes = np.full(len(values), bins, dtype=np.int32)
+    scaled = (values[finite] - low) * (bins / (high - low))
+    codes[finite] = np.minimum(scaled.astype(np.int32), bins - 1)
+    return codes, (low, high)
+
+
+def stratified_sample(group_codes, n_groups, size, seed=0):
+    # グループの比率を保ったまま抽出し、小さいグループからも最低限の点数を取る
+    counts = np.bincount(group_codes, minlength=n_groups)
+    if counts.sum() <= size:
+        return np.arange(len(group_codes))
+    rng = np.random.default_rng(seed)
+    order = np.argsort(group_codes, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    samples = []
+    for group, count in enumerate(counts):
+        take = min(count, max(int(round(size * count / counts.sum())), PAIR_PLOT_MIN_PER_GROUP))
+        if take:
+            members = order[offsets[group]:offsets[group + 1]]
+            samples.append(rng.choice(members, take, replace=False))
+    return np.sort(np.concatenate(samples))
+
+
+class PairPlotData:
+    # パネルの描画に必要な集計（2 次元ヒストグラム・グループ別ヒストグラム・抽出した点）をまとめて計算する
+    def __init__(self, data, group_column='group', max_columns=PAIR_PLOT_MAX_COLUMNS, bins=PAIR_PLOT_BINS,
+                 sample_size=PAIR_PLOT_SAMPLE, workers=None):
+        numeric = [column for column in data.select_dtypes(include=[np.number]).columns if column != group_column]
+        self.columns = numeric[:max_columns]
+        self.omitted = len(numeric) - len(self.columns)
+        self.bins = bins
+        if group_column in data:
+            group_codes, self.group_labels = pd.factorize(data[group_column], sort=True)
+            self.group_labels = [str(label) for label in self.group_labels]
+        else:
+            group_codes, self.group_labels = np.zeros(len(data), dtype=np.intp), []
+        # 欠損したグループは最後のコードにまとめる
+        self.n_groups = max(len(self.group_labels), 1) + int((group_codes < 0).any())
+        self.group_codes = np.where(group_codes < 0, self.n_groups - 1, group_codes)
+
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            binned = list(executor.map(lambda column: _bin_codes(data[column].to_numpy(dtype=np.float64,
+                                                                                         na_value=np.nan), bins),
+                                       self.columns))
+            self.codes = [codes for codes, _ in binned]
+            self.limits = [limits for _, limits in binned]
+            self.histograms = list(executor.map(self._histogram, range(len(self.columns))))
+            pairs = [(i, j) for i in range(len(self.columns)) for j in range(i)]
+            self.densities = dict(zip(pairs, executor.map(lambda pair: self._density(*pair), pairs)))
+
+        self.sample = stratified_sample(self.group_codes, self.n_groups, sample_size)
+        self.sample_values = {column: data[column].to_numpy(dtype=np.float64, na_value=np.nan)[self.sample]
+                              for column in self.columns}
+        self.sample_groups = self.group_codes[self.sample]
+
+    def _histogram(self, i):
+        counts = np.bincount(self.group_codes * (self.bins + 1) + self.codes[i],
+                             minlength=self.n_groups * (self.bins + 1))
+        return counts.reshape(self.n_groups, self.bins + 1)[:, :self.bins]
+
+    def _density(self, i, j):
+        # 行 i・列 j のパネル（y が i 列目、x が j 列目）
+        size = self.bins + 1
+        counts = np.bincount(self.codes[i] * size + self.codes[j], minlength=size * size)
+        return counts.reshape(size, size)[:self.bins, :self.bins]
+
+
+def _normalize(values, limits):
+    low, high = limits
+    return (values - low) / (high - low)
+
+
+def draw_pair_plot(figure, data, group_column='group'):
+    # パネルを個別の Axes にすると列数の 2 乗の Axes ができて遅いので、1 つの Axes にまとめて描く。
+    # 各パネルは 1×1 の升目で、下三角は 2 次元ヒストグラム、対角はグループ別ヒストグラム、
+    # 上三角は層別抽出した点の散布図。
+    k = min(len([column for column in data.select_dtypes(include=[np.number]).columns if column != group_column]),
+            PAIR_PLOT_MAX_COLUMNS)
+    ax = figure.add_subplot(111)
+    if k < 2:
+        ax.text(0.5, 0.5, "ペアプロットには数値列が2列以上必要です", ha='center', va='center')
+        return
+    panels = k * (k - 1) // 2
+    pair_data = PairPlotData(data, group_column, sample_size=max(PAIR_PLOT_MIN_PER_GROUP,
+                                                                 PAIR_PLOT_TOTAL_POINTS // panels))
+    bins = pair_data.bins
+
+    mosaic = np.zeros((k * bins, k * bins), dtype=np.int64)
+    for (i, j), density in pair_data.densities.items():
+        # 画像は上から下へ並ぶので、パネル内の y を反転して置く
+        mosaic[i * bins:(i + 1) * bins, j * bins:(j + 1) * bins] = density[::-1]
+    ax.imshow(np.ma.masked_equal(mosaic, 0), origin='upper', aspect='auto', cmap='viridis',
+              norm=LogNorm(vmin=1, vmax=max(2, int(mosaic.max()))), interpolation='nearest', extent=(0, k, k, 0))
+
+    steps = (np.arange(bins + 1) / bins)
+    for group in range(pair_data.n_groups):
+        xs, ys = [], []
+        for i in range(k):
+            counts = pair_data.histograms[i][group]
+            height = counts / max(int(pair_data.histograms[i].max()), 1) * 0.9
+            xs.append(i + np.repeat(steps, 2)[1:-1])
+            xs.append([np.nan])
+            ys.append(i + 1 - np.repeat(height, 2))
+            ys.append([np.nan])
+        ax.plot(np.concatenate(xs), np.concatenate(ys), color=f"C{group % 10}", linewidth=0.8)
+
+    point_colors = to_rgba_array([f"C{group % 10}" for group in range(pair_data.n_groups)])[pair_data.sample_groups]
+    normalized = [_normalize(pair_data.sample_values[column], pair_data.limits[i])
+                  for i, column in enumerate(pair_data.columns)]
+    xs, ys = [], []
+    for i in range(k):
+        for j in range(i + 1, k):
+            xs.append(j + normalized[j])
+            ys.append(i + 1 - normalized[i])
+    ax.scatter(np.concatenate(xs), np.concatenate(ys), c=np.tile(point_colors, (panels, 1)), s=1, linewidths=0)
+
+    ax.hlines(np.arange(1, k), 0, k, colors='lightgray', linewidth=0.5)
+    ax.vlines(np.arange(1, k), 0, k, colors='lightgray', linewidth=0.5)
+    ax.set_xlim(0, k)
+    ax.set_ylim(k, 0)
+    labels = [str(column) for column in pair_data.columns]
+    ax.set_xticks(np.arange(k) + 0.5)
+    ax.set_xticklabels(labels, rotation=90, fontsize=7)
+    ax.set_yticks(np.arange(k) + 0.5)
+    ax.set_yticklabels(labels, fontsize=7)
+
+    if pair_data.group_labels:
+        handles = [Line2D([], [], color=f"C{group % 10}", label=label)
+                   for group, label in enumerate(pair_data.group_labels)]
+        ax.legend(handles=handles, title=group_column, loc='upper right', fontsize=7)
+    if pair_data.omitted:
+        ax.text(0, -0.02, f"先頭の{k}列のみ表示しています（{pair_data.omitted}列を省略）", fontsize=7,
+                transform=ax.transAxes, va='top')
@@ -0,0 +1,270 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.special import gammaln, ndtr
+
+from grouped_data import as_grouped
+from multiple_testing import adjust_pvalues
+
+POST_HOC_METHODS = {
+    "Tukey's HSD検定": 'tukey',
+    "Bonferroni法": 'bonferroni',
+    "Holm法": 'holm',
+    "Scheffe法": 'scheffe',
+    "Games-Howell法": 'games_howell',
+}
+# 結果の文字列に載せるペア数の上限（超えた分は補正後の p 値の小さい順に載せる）
+POST_HOC_DISPLAY_ROWS = 1000
+POST_HOC_ALPHA = 0.05
+
+# スチューデント化範囲分布の数値積分の設定（Gauss-Legendre の節点数と、範囲 w の表の大きさ）
+RANGE_Z_NODES = 256
+RANGE_S_NODES = 96
+RANGE_W_MAX = 16.0
+RANGE_W_POINTS = 4096
+# 自由度がこれを超えたら s = 1（分散が既知）として扱う
+RANGE_DF_INFINITE = 100_000
+# Dunnett 検定の多変量 t 分布の数値積分の設定
+DUNNETT_Z_NODES = 128
+DUNNETT_U_MAX = 12.0
+DUNNETT_U_POINTS = 2048
+
+
+@lru_cache(maxsize=32)
+def _range_cdf_table(k):
+    # k 個の標準正規乱数の範囲 W の分布関数 P(W <= w) = k ∫ φ(z) [Φ(z) - Φ(z - w)]^(k-1) dz を
+    # w の格子上で計算しておく（k ごとに一度だけ）
+    nodes, weights = np.polynomial.legendre.leggauss(RANGE_Z_NODES)
+    z = nodes * 8.0
+    weights = weights * 8.0 * stats.norm.pdf(z)
+    w = np.linspace(0.0, RANGE_W_MAX, RANGE_W_POINTS)
+    inner = np.clip(stats.norm.cdf(z)[None, :] - stats.norm.cdf(z[None, :] - w[:, None]), 0.0, 1.0)
+    cdf = k * (inner ** (k - 1)) @ weights
+    return w, np.clip(cdf, 0.0, 1.0)
+
+
+def _scaled_chi_nodes(df):
+    # s = √(χ²_df / df) の積分の節点と重み（行が自由度）。節点は各自由度の s の分布の範囲に置く
+    nu = np.asarray(df, dtype=np.float64)[:, None]
+    nodes, weights = np.polynomial.legendre.leggauss(RANGE_S_NODES)
+    low = np.sqrt(stats.chi2.ppf(1e-12, nu) / nu)
+    high = np.sqrt(stats.chi2.isf(1e-12, nu) / nu)
+    s = low + (high - low) * (nodes + 1) / 2
+    log_density = ((nu / 2) * np.log(nu) - gammaln(nu / 2) - (nu / 2 - 1) * np.log(2)
+                   + (nu - 1) * np.log(s) - nu * s * s / 2)
+    weights = weights * (high - low) / 2 * np.exp(log_density)
+    return s, weights / weights.sum(axis=1, keepdims=True)
+
+
+def studentized_range_sf(q, k, df):
+    # スチューデント化範囲分布の上側確率。q と df は同じ形の配列（ブロードキャスト可）。
+    # s = √(χ²_df / df) の密度で P(W > q s) を積分する。節点は自由度ごとに s の分布の範囲へ置く
+    q, df = np.broadcast_arrays(np.asarray(q, dtype=np.float64), np.asarray(df, dtype=np.float64))
+    w_grid, cdf = _range_cdf_table(int(k))
+    result = np.empty(q.shape)
+    finite = df < RANGE_DF_INFINITE
+    result[~finite] = 1.0 - np.interp(q[~finite], w_grid, cdf, right=1.0)
+    if finite.any():
+        # 節点と重みは自由度ごとに一度だけ作る（Tukey 法ではすべてのペアで同じ自由度）
+        unique_df, inverse = np.unique(df[finite], return_inverse=True)
+        s, weights = _scaled_chi_nodes(unique_df)
+        tail = 1.0 - np.interp(q[finite][:, None] * s[inverse], w_grid, cdf, right=1.0)
+        result[finite] = np.einsum('ij,ij->i', tail, weights[inverse])
+    return np.clip(result, 0.0, 1.0)
+
+
+def studentized_range_isf(alpha, k, df):
+    # 上側確率が alpha になる q（二分法。Tukey の信頼区間の臨界値に使う）
+    low, high = 0.0, RANGE_W_MAX
+    for _ in range(40):
+        middle = (low + high) / 2
+        if studentized_range_sf(middle, k, df) > alpha:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+@lru_cache(maxsize=64)
+def _dunnett_table(correlations):
+    # 対照群と比べる統計量 T_i の相関は ρ_ij = λ_i λ_j の積の形なので、
+    # Z_i = λ_i Z_0 + √(1 - λ_i²) Y_i と書ける。分散が既知のときの P(max |Z_i| <= u) は
+    # Z_0 についての 1 次元積分になるので、u の格子上で計算しておく。
+    # correlations は (λ, 同じ λ のグループ数) の組。同じ大きさの処理群は 1 つにまとまる
+    nodes, weights = np.polynomial.legendre.leggauss(DUNNETT_Z_NODES)
+    z = nodes * 8.0
+    weights = weights * 8.0 * stats.norm.pdf(z)
+    u = np.linspace(0.0, DUNNETT_U_MAX, DUNNETT_U_POINTS)
+    log_probability = np.zeros((len(u), len(z)))
+    for lam, count in correlations:
+        scale = np.sqrt(1.0 - lam * lam)
+        inside = ndtr((u[:, None] - lam * z) / scale) - ndtr((-u[:, None] - lam * z) / scale)
+        log_probability += count * np.log(np.maximum(inside, 1e-300))
+    return u, np.clip(np.exp(log_probability) @ weights, 0.0, 1.0)
+
+
+def _dunnett_correlations(n_control, n_treatments):
+    lam = np.round(np.sqrt(n_treatments / (n_treatments + n_control)), 10)
+    values, counts = np.unique(lam, return_counts=True)
+    return tuple(zip(values.tolist(), counts.tolist()))
+
+
+def dunnett_cdf(t, correlations, df):
+    # P(max_i |T_i| <= t)（自由度 df の多変量 t 分布、両側）
+    t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+    u, table = _dunnett_table(correlations)
+    if df >= RANGE_DF_INFINITE:
+        return np.interp(t, u, table, right=1.0)
+    s, weights = _scaled_chi_nodes([df])
+    return np.interp(t[:, None] * s, u, table, right=1.0) @ weights[0]
+
+
+@lru_cache(maxsize=256)
+def dunnett_critical_value(correlations, df, alpha=POST_HOC_ALPHA):
+    # 同じ設計（処理群の大きさ・自由度・有意水準）の臨界値はセッション中に一度だけ計算する
+    low, high = 0.0, DUNNETT_U_MAX
+    for _ in range(40):
+        middle = (low + high) / 2
+        if dunnett_cdf(middle, correlations, df)[0] < 1 - alpha:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+class GroupSummary:
+    # 各グループの件数・平均・不偏分散を一度だけ求め、すべてのペアの統計量をここから作る
+    def __init__(self, data):
+        grouped = as_grouped(data)
+        keep = grouped.counts > 0
+        self.labels = [str(label) for label in np.asarray(grouped.labels)[keep]]
+        self.n = grouped.counts[keep].astype(np.float64)
+        self.mean = grouped.means[keep]
+        self.var = grouped.variances[keep]
+        if len(self.labels) < 2:
+            raise ValueError("2つ以上のグループが必要です。")
+
+    @property
+    def k(self):
+        return len(self.labels)
+
+    @property
+    def df_within(self):
+        return self.n.sum() - self.k
+
+    @property
+    def mse(self):
+        # 全グループを併合した誤差分散（一元配置分散分析の平均平方誤差）
+        return np.nansum((self.n - 1) * self.var) / self.df_within
+
+    def pairs(self):
+        return np.triu_indices(self.k, k=1)
+
+
+def pairwise_comparisons(data, method, alpha=POST_HOC_ALPHA):
+    # すべてのペアの比較をブロードキャストでまとめて計算し、1 行 1 ペアの表で返す
+    summary = data if isinstance(data, GroupSummary) else GroupSummary(data)
+    i, j = summary.pairs()
+    n_i, n_j = summary.n[i], summary.n[j]
+    diff = summary.mean[j] - summary.mean[i]
+    inverse_n = 1 / n_i + 1 / n_j
+    lower = upper = np.full(len(i), np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if method == 'tukey':
+            df = np.full(len(i), summary.df_within)
+            se = np.sqrt(summary.mse * inverse_n / 2)
+            statistic = np.abs(diff) / se
+            p_values = studentized_range_sf(statistic, summary.k, df)
+            critical = studentized_range_isf(alpha, summary.k, summary.df_within)
+            lower, upper = diff - critical * se, diff + critical * se
+        elif method == 'scheffe':
+            df = np.full(len(i), summary.df_within)
+            se = np.sqrt(summary.mse * inverse_n)
+            statistic = diff * diff / (se * se * (summary.k - 1))
+            p_values = stats.f.sf(statistic, summary.k - 1, summary.df_within)
+            critical = np.sqrt((summary.k - 1) * stats.f.isf(alpha, summary.k - 1, summary.df_within))
+            lower, upper = diff - critical * se, diff + critical * se
+        elif method == 'games_howell':
+            v_i, v_j = summary.var[i] / n_i, summary.var[j] / n_j
+            se = np.sqrt(v_i + v_j)
+            df = (v_i + v_j) ** 2 / (v_i ** 2 / (n_i - 1) + v_j ** 2 / (n_j - 1))
+            statistic = np.abs(diff) / se
+            p_values = studentized_range_sf(statistic * np.sqrt(2), summary.k, df)
+        elif method in ('bonferroni', 'holm'):
+            # 各ペアの 2 群だけで併合分散を求める t 検定（scipy の ttest_ind と同じ）
+            df = n_i + n_j - 2
+            pooled = ((n_i - 1) * summary.var[i] + (n_j - 1) * summary.var[j]) / df
+            statistic = diff / np.sqrt(pooled * inverse_n)
+            p_values = 2 * stats.t.sf(np.abs(statistic), df)
+        else:
+            raise ValueError(f"不明なPost Hoc検定です: {method}")
+
+    adjusted = adjust_pvalues(p_values, method) if method in ('bonferroni', 'holm') else p_values
+    labels = np.asarray(summary.labels, dtype=object)
+    return pd.DataFrame({
+        'group1': labels[i],
+        'group2': labels[j],
+        'meandiff': diff,
+        'statistic': statistic,
+        'df': df,
+        'p-value': p_values,
+        'p-adj': adjusted,
+        'lower': lower,
+        'upper': upper,
+        'reject': adjusted < alpha,
+    })
+
+
+def dunnett_comparisons(data, control=None, alpha=POST_HOC_ALPHA):
+    # 対照群と各処理群の比較（単一ステップの Dunnett 法、両側）
+    summary = data if isinstance(data, GroupSummary) else GroupSummary(data)
+    if control is None:
+        control = summary.labels[0]
+    if str(control) not in summary.labels:
+        raise ValueError(f"対照群 '{control}' がデータにありません。")
+    c = summary.labels.index(str(control))
+    treatments = np.array([i for i in range(summary.k) if i != c])
+    n_control, n_treatments = summary.n[c], summary.n[treatments]
+    df = summary.df_within
+    diff = summary.mean[treatments] - summary.mean[c]
+    se = np.sqrt(summary.mse * (1 / n_treatments + 1 / n_control))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = diff / se
+    correlations = _dunnett_correlations(n_control, n_treatments)
+    adjusted = np.clip(1.0 - dunnett_cdf(np.abs(statistic), correlations, df), 0.0, 1.0)
+    critical = dunnett_critical_value(correlations, float(df), alpha)
+    labels = np.asarray(summary.labels, dtype=object)
+    return pd.DataFrame({
+        'group1': labels[c],
+        'group2': labels[treatments],
+        'meandiff': diff,
+        'statistic': statistic,
+        'df': df,
+        'p-value': 2 * stats.t.sf(np.abs(statistic), df),
+        'p-adj': adjusted,
+        'lower': diff - critical * se,
+        'upper': diff + critical * se,
+        'reject': adjusted < alpha,
+    })
+
+
+def run_dunnett(data, control=None):
+    table = dunnett_comparisons(data, control)
+    return format_comparisons(table, f"Dunnett検定（対照群: {table['group1'].iloc[0]}）")
+
+
+def format_comparisons(table, title, max_rows=POST_HOC_DISPLAY_ROWS):
+    lines = [f"{title}（{len(table):,}ペア、有意 {int(table['reject'].sum()):,}ペア）"]
+    if len(table) > max_rows:
+        table = table.sort_values('p-adj', kind='stable').head(max_rows)
+        lines.append(f"補正後の p 値が小さい順に上位{max_rows:,}ペアを表示しています")
+    table = table.dropna(axis=1, how='all')
+    lines.append(table.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+    return "\n".join(lines)
+
+
+def run_pairwise(data, test):
+    return format_comparisons(pairwise_comparisons(data, POST_HOC_METHODS[test]), test)
@@ -0,0 +1,319 @@
+import copy
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from result_cache import ResultCache, estimate_size, fingerprint
+
+OUTLIER_METHODS = {"なし": None, "Z-score": 'zscore', "IQR": 'iqr'}
+SCALING_METHODS = {"なし": None, "標準化": 'standard', "最小最大スケーリング": 'minmax'}
+MISSING_METHODS = {"なし": None, "削除": 'drop', "平均値で補完": 'mean', "中央値で補完": 'median'}
+ENCODING_METHODS = {"なし": None, "One-hot encoding": 'onehot', "Label encoding": 'label'}
+TRANSFORM_METHODS = {"なし": None, "対数変換": 'log', "平方根変換": 'sqrt'}
+
+
+class PreprocessingReport:
+    def __init__(self, rows_in, numeric_columns, dtype):
+        self.rows_in = rows_in
+        self.rows_out = rows_in
+        self.numeric_columns = numeric_columns
+        self.dtype = dtype
+        self.steps = []
+        # 途中の出力を保持したときの 1 段階あたりの大きさとキャッシュの上限（バイト）
+        self.stage_bytes = None
+        self.cache_limit = None
+
+    def add_step(self, name, seconds, rows):
+        self.steps.append((name, seconds, rows))
+        self.rows_out = rows
+
+    def total_seconds(self):
+        return sum(seconds for _, seconds, _ in self.steps)
+
+    def to_text(self):
+        lines = [
+            f"行数: {self.rows_in:,} → {self.rows_out:,}",
+            f"数値列: {self.numeric_columns}列（{self.dtype} の1ブロックで処理）",
+        ]
+        for name, seconds, rows in self.steps:
+            lines.append(f"  {name}: {seconds * 1000:,.1f} ms（{rows:,}行）")
+        lines.append(f"合計: {self.total_seconds() * 1000:,.1f} ms")
+        if self.stage_bytes is not None:
+            lines.append(f"途中の出力の保存: 1段階あたり約{self.stage_bytes / 1024 ** 2:,.1f} MB"
+                         f"（上限 {self.cache_limit / 1024 ** 2:,.0f} MB）")
+        return "\n".join(lines)
+
+
+def _block_dtype(dtypes):
+    # float32 だけの列は float32 のまま処理し、それ以外は float64 にまとめる
+    dtypes = [dtype.numpy_dtype if hasattr(dtype, 'numpy_dtype') else dtype for dtype in dtypes]
+    return np.result_type(np.float32, *dtypes) if dtypes else np.dtype(np.float64)
+
+
+class NumericBlock:
+    # 数値列を一度だけ取り出し、列ごとに連続した (列数, 行数) の配列に置いて処理する。
+    # 行の削除は配列の先頭に詰めて行数を縮めるだけなので、ブロック全体のコピーは作らない。
+    def __init__(self, data):
+        # select_dtypes は数値列だけの DataFrame をコピーで作るので、列の型だけを見て元の列から直接詰める
+        numeric = [(column, dtype) for column, dtype in data.dtypes.items()
+                   if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+        self.data = data
+        self.columns = [column for column, _ in numeric]
+        self.dtypes = [dtype for _, dtype in numeric]
+        self.dtype = _block_dtype(self.dtypes)
+        self.values = np.empty((len(self.columns), len(data)), dtype=self.dtype)
+        for row, column in zip(self.values, self.columns):
+            row[:] = data[column].to_numpy(dtype=self.dtype, na_value=np.nan)
+        self.positions = np.arange(len(data))
+        self.values_changed = False
+
+    @property
+    def rows(self):
+        return len(self.positions)
+
+    @property
+    def block(self):
+        return self.values[:, :self.rows]
+
+    def keep_rows(self, keep):
+        if keep.all():
+            return
+        count = int(keep.sum())
+        for row in self.block:
+            row[:count] = row[keep]
+        self.positions = self.positions[keep]
+
+    def _column_stats(self, function):
+        return np.array([function(row) for row in self.block], dtype=np.float64)
+
+    def remove_outliers(self, method, threshold):
+        # 欠損値は外れ値として扱わず、欠損値処理に任せる
+        keep = np.ones(self.rows, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            for row in self.block:
+                if method == 'zscore':
+                    mean = np.nanmean(row, dtype=np.float64)
+                    std = np.nanstd(row, dtype=np.float64)
+                    if not std > 0:
+                        continue
+                    keep &= ~(np.abs(row - mean) >= threshold * std)
+                elif method == 'iqr':
+                    q1, q3 = np.nanpercentile(row, [25, 75])
+                    iqr = q3 - q1
+                    keep &= ~((row < q1 - threshold * iqr) | (row > q3 + threshold * iqr))
+        self.keep_rows(keep)
+
+    def scale(self, method):
+        block = self.block
+        if method == 'standard':
+            offset = self._column_stats(lambda row: np.nanmean(row, dtype=np.float64))
+            scale = self._column_stats(lambda row: np.nanstd(row, dtype=np.float64, ddof=1))
+        elif method == 'minmax':
+            offset = self._column_stats(np.nanmin)
+            scale = self._column_stats(np.nanmax) - offset
+        else:
+            return
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block -= offset.astype(self.dtype)[:, None]
+            block /= scale.astype(self.dtype)[:, None]
+        self.values_changed = True
+
+    def handle_missing(self, method):
+        if method == 'drop':
+            keep = np.ones(self.rows, dtype=bool)
+            for row in self.block:
+                keep &= ~np.isnan(row)
+            others = self.data.columns.difference(self.columns, sort=False)
+            if len(others):
+                keep &= self.data[others].notna().all(axis=1).to_numpy()[self.positions]
+            self.keep_rows(keep)
+        elif method in ('mean', 'median'):
+            function = np.nanmean if method == 'mean' else np.nanmedian
+            for row in self.block:
+                missing = np.isnan(row)
+                if missing.any() and not missing.all():
+                    row[missing] = function(row)
+            self.values_changed = True
+
+    def transform(self, method):
+        block = self.block
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if method == 'log':
+                np.log1p(block, out=block)
+            elif method == 'sqrt':
+                np.sqrt(block, out=block)
+            else:
+                return
+        self.values_changed = True
+
+    def copy(self):
+        clone = copy.copy(self)
+        clone.values = self.block.copy()
+        return clone
+
+    def nbytes(self):
+        return int(self.values.nbytes + self.positions.nbytes)
+
+    def to_frame(self, encoding=None, copy=False):
+        # 数値列は 2 次元配列のまま 1 つのブロックとして包む。キャッシュに保持しているブロックから作るときは
+        # 返したデータフレームへの書き込みが保持している出力を壊さないように copy=True でコピーする
+        df = pd.DataFrame(self.block.T, index=self.data.index.take(self.positions), columns=self.columns, copy=copy)
+        if not self.values_changed:
+            # 行を削っただけなら元の型に戻す
+            for column, dtype in zip(self.columns, self.dtypes):
+                if dtype != self.dtype:
+                    df[column] = df[column].astype(dtype)
+        others = [column for column in self.data.columns if column not in self.columns]
+        other_frame = self.data[others]
+        if self.rows != len(self.data):
+            other_frame = other_frame.take(self.positions)
+        for column in others:
+            df.insert(self.data.columns.get_loc(column), column, other_frame[column].array)
+        return encode_categories(df, encoding)
+
+
+def encode_categories(df, method):
+    categorical = df.select_dtypes(include=['object', 'category', 'string']).columns
+    if method == 'onehot':
+        return pd.get_dummies(df, columns=categorical)
+    if method == 'label':
+        for column in categorical:
+            df[column] = df[column].astype('category').cat.codes
+    return df
+
+
+STAGE_LABELS = {
+    'extract': "数値列の抽出",
+    'outlier': "外れ値処理",
+    'scaling': "正規化",
+    'missing': "欠損値処理",
+    'transform': "データ変換",
+}
+# 途中の出力のキャッシュの上限。1 段階の出力は (数値列数 × 行数 × 要素の大きさ + 行数 × 8) バイトで、
+# 元データから抽出したブロックと段階ごとに 1 つずつ保持する。既定ではブロックの大きさから決め、
+# 全段階分（抽出 + 4 段階）が入るようにするが、物理メモリの一定割合を超えないようにする
+PIPELINE_MIN_CACHE_BYTES = 1024 * 1024 * 1024
+PIPELINE_MEMORY_FRACTION = 0.5
+PIPELINE_STAGES = len(STAGE_LABELS)
+
+
+def _physical_memory():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def pipeline_cache_bytes(stage_bytes):
+    needed = max(PIPELINE_MIN_CACHE_BYTES, PIPELINE_STAGES * stage_bytes)
+    memory = _physical_memory()
+    if memory is None:
+        return needed
+    return int(min(needed, max(PIPELINE_MIN_CACHE_BYTES, memory * PIPELINE_MEMORY_FRACTION)))
+
+
+def _stage_params(settings):
+    # 実行する段階とその設定を順に並べる（「なし」の段階は出力が変わらないので含めない）
+    params = []
+    if settings.get('outlier') is not None:
+        params.append(('outlier', (settings['outlier'], settings.get('threshold', 3.0))))
+    for stage in ('scaling', 'missing', 'transform'):
+        if settings.get(stage) is not None:
+            params.append((stage, settings[stage]))
+    return params
+
+
+def _apply_stage(block, stage, params):
+    if stage == 'outlier':
+        block.remove_outliers(*params)
+    elif stage == 'scaling':
+        block.scale(params)
+    elif stage == 'missing':
+        block.handle_missing(params)
+    elif stage == 'transform':
+        block.transform(params)
+
+
+def _state_size(value):
+    return value.nbytes() if isinstance(value, NumericBlock) else estimate_size(value)
+
+
+class PreprocessingPipeline:
+    # 各段階の出力を「入力データのフィンガープリント + そこまでの段階の設定」をキーにして保持する。
+    # 設定を変えた段階の直前までは保持した出力から再開し、それ以降の段階だけを計算し直す。
+    def __init__(self, max_bytes=None, max_entries=32):
+        # max_bytes を指定しなければ、元データのブロックの大きさから上限を決める
+        self.max_bytes = max_bytes
+        self.cache = ResultCache(max_entries=max_entries, max_bytes=max_bytes or PIPELINE_MIN_CACHE_BYTES,
+                                 sizeof=_state_size)
+        self.source = None
+        self.source_key = None
+        self.last_path = []
+
+    def set_source(self, data):
+        self.source = data
+        self.source_key = None
+        self.last_path = []
+
+    def _key(self, path):
+        if self.source_key is None:
+            self.source_key = fingerprint(self.source)
+        return (self.source_key, tuple(path))
+
+    def _compute(self, path, report):
+        # 保持している出力のうち最も後ろの段階から再開する
+        state = None
+        resume = 0
+        for end in range(len(path), -1, -1):
+            state = self.cache.get(self._key(path[:end]))
+            if state is not None:
+                resume = end
+                break
+        if state is None:
+            start = time.perf_counter()
+            state = NumericBlock(self.source)
+            if self.max_bytes is None:
+                self.cache.resize(self.cache.max_entries, pipeline_cache_bytes(state.nbytes()))
+            self.cache.put(self._key([]), state)
+            report.add_step(STAGE_LABELS['extract'], time.perf_counter() - start, state.rows)
+        else:
+            report.add_step(f"{STAGE_LABELS[path[resume - 1][0] if resume else 'extract']}まで（保存済み）",
+                            0.0, state.rows)
+
+        for end in range(resume + 1, len(path) + 1):
+            stage, params = path[end - 1]
+            start = time.perf_counter()
+            # 保存済みの出力は書き換えないように、コピーに対して処理する
+            state = state.copy()
+            _apply_stage(state, stage, params)
+            self.cache.put(self._key(path[:end]), state)
+            report.add_step(STAGE_LABELS[stage], time.perf_counter() - start, state.rows)
+
+        report.numeric_columns = len(state.columns)
+        report.dtype = state.dtype
+        report.stage_bytes = state.nbytes()
+        report.cache_limit = self.cache.max_bytes
+        return state
+
+    def run(self, settings):
+        path = _stage_params(settings)
+        report = PreprocessingReport(len(self.source), 0, None)
+        state = self._compute(path, report)
+        start = time.perf_counter()
+        df = state.to_frame(settings.get('encoding'), copy=True)
+        report.add_step("データフレームの組み立て", time.perf_counter() - start, len(df))
+        self.last_path = path
+        return df, report
+
+    def history(self):
+        # 直前の実行で通った段階（戻り先の候補）
+        return ["元データ"] + [f"{STAGE_LABELS[stage]}の後" for stage, _ in self.last_path]
+
+    def revert(self, index):
+        # index 0 は元データ、i は直前の実行の i 番目の段階の出力（エンコーディング前）
+        if index == 0:
+            return self.source
+        report = PreprocessingReport(len(self.source), 0, None)
+        return self._compute(self.last_path[:index], report).to_frame(copy=True)
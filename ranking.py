@@ -0,0 +1,306 @@
+import os
+
+import numpy as np
+from scipy import stats
+
+from grouped_data import as_grouped
+from result_cache import ResultCache, estimate_size
+
+# scipy が正確な分布を使う大きさ（これ以下は scipy に任せて結果を変えない）
+MANN_WHITNEY_EXACT_MAX = 8
+WILCOXON_EXACT_MAX = 50
+# 外部マージで一度にメモリに載せる値の件数の目安
+RANK_BUCKET_ROWS = 4_000_000
+
+
+def _entry_size(value):
+    nbytes = getattr(value, 'nbytes', None)
+    return nbytes if isinstance(nbytes, int) else estimate_size(value)
+
+
+# データのフィンガープリントごとに並べ替えの結果と順位を保持する。
+# 同じデータに複数の順位検定を行っても並べ替えは 1 回で済む
+rank_cache = ResultCache(max_entries=16, max_bytes=1024 * 1024 * 1024, sizeof=_entry_size)
+
+
+def average_ranks(sorted_values):
+    # 昇順に並んだ値の平均順位（1 始まり）と同順位の補正項 Σ(t³ - t)
+    n = len(sorted_values)
+    if n == 0:
+        return np.zeros(0), 0.0
+    new_run = np.empty(n, dtype=bool)
+    new_run[0] = True
+    np.not_equal(sorted_values[1:], sorted_values[:-1], out=new_run[1:])
+    starts = np.flatnonzero(new_run)
+    sizes = np.diff(np.append(starts, n))
+    average = starts + (sizes + 1) / 2
+    sizes = sizes.astype(np.float64)
+    return np.repeat(average, sizes.astype(np.int64)), float((sizes ** 3 - sizes).sum())
+
+
+def rank_matrix(matrix):
+    # 列ごとの平均順位と補正項。全列をまとめて 1 回の argsort で並べ、欠損値は NaN のまま残す
+    values = np.asarray(matrix, dtype=np.float64).T
+    m, n = values.shape
+    if m == 0 or n == 0:
+        return np.full(values.shape, np.nan).T, np.zeros(m)
+    order = np.argsort(values, axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    new_run = np.ones((m, n), dtype=bool)
+    np.not_equal(ordered[:, 1:], ordered[:, :-1], out=new_run[:, 1:])
+    starts = np.flatnonzero(new_run)
+    sizes = np.diff(np.append(starts, m * n))
+    average = starts % n + (sizes + 1) / 2
+    ranks = np.empty((m, n))
+    np.put_along_axis(ranks, order, np.repeat(average, sizes).reshape(m, n), axis=1)
+    ranks[np.isnan(values)] = np.nan
+    # NaN は NaN 同士でも等しくないので大きさ 1 のまとまりになり、補正項には入らない
+    sizes = sizes.astype(np.float64)
+    ties = np.bincount(starts // n, weights=sizes ** 3 - sizes, minlength=m)
+    return ranks.T, ties
+
+
+class RankedColumn:
+    # 1 列を一度だけ安定ソートした結果。先頭から stop 行までの部分集合の順位も並べ替えなしで求められる
+    def __init__(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.size = len(values)
+        # 平均順位は同じ値の並び順によらないので安定ソートにしなくてよい
+        order = np.argsort(values)
+        self.order = order[:self.size - int(np.count_nonzero(np.isnan(values)))]
+        self.sorted = values[self.order]
+        self.ranks, self.ties = self._scatter(self.order, self.sorted, self.size)
+
+    @staticmethod
+    def _scatter(order, sorted_values, size):
+        average, ties = average_ranks(sorted_values)
+        ranks = np.full(size, np.nan)
+        ranks[order] = average
+        return ranks, ties
+
+    @property
+    def nbytes(self):
+        return int(self.order.nbytes + self.sorted.nbytes + self.ranks.nbytes)
+
+    def n_missing(self, stop=None):
+        stop = self.size if stop is None else stop
+        return stop - int(np.count_nonzero(self.order < stop)) if stop < self.size else self.size - len(self.order)
+
+    def prefix_ranks(self, stop):
+        # 先頭 stop 行だけを対象にした順位と補正項（ソート済みの並びから取り出すだけなので線形時間）
+        if stop >= self.size:
+            return self.ranks, self.ties
+        keep = self.order < stop
+        return self._scatter(self.order[keep], self.sorted[keep], stop)
+
+
+def column_ranks(data, column):
+    # 元の行順のままの列の順位
+    grouped = as_grouped(data)
+    return rank_cache.get_or_compute(
+        'column_ranks', grouped,
+        lambda: RankedColumn(grouped.frame[column].to_numpy(dtype=np.float64, na_value=np.nan)),
+        {'column': column})
+
+
+def group_ranks(data):
+    # グループ順に並べた値（GroupedData.values）の順位。最初の g グループはその先頭部分になる
+    grouped = as_grouped(data)
+    return rank_cache.get_or_compute(
+        'group_ranks', grouped, lambda: RankedColumn(grouped.values),
+        {'group_column': grouped.group_column, 'value_column': grouped.value_column})
+
+
+def _paired_differences(grouped):
+    group1, group2 = grouped.two_groups()
+    if len(group1) != len(group2):
+        raise ValueError("対応のある検定では2つのグループの件数が同じである必要があります。")
+    return group1 - group2
+
+
+def _signed_ranks(grouped):
+    # scipy の wilcoxon と同じく差が 0 の組は除き、差の絶対値に順位を付けて符号を戻す
+    differences = _paired_differences(grouped)
+    differences = differences[differences != 0]
+    ranked = RankedColumn(np.abs(differences))
+    return np.sign(differences) * ranked.ranks, ranked.ties
+
+
+def signed_ranks(data):
+    grouped = as_grouped(data)
+    return rank_cache.get_or_compute(
+        'signed_ranks', grouped, lambda: _signed_ranks(grouped),
+        {'group_column': grouped.group_column, 'value_column': grouped.value_column})
+
+
+def _block_ranks(grouped):
+    k = grouped.n_groups
+    if k < 3:
+        raise ValueError("Friedman検定には3つ以上のグループが必要です。")
+    if (grouped.counts != grouped.counts[0]).any():
+        raise ValueError("Friedman検定では各グループの件数が同じである必要があります。")
+    # グループごとに連続して並んでいるので (グループ, ブロック) の行列として見られる。列ごと（ブロック内）に順位を付ける
+    ranks, ties = rank_matrix(grouped.values.reshape(k, -1))
+    return ranks.sum(axis=1), float(ties.sum())
+
+
+def block_ranks(data):
+    grouped = as_grouped(data)
+    return rank_cache.get_or_compute(
+        'block_ranks', grouped, lambda: _block_ranks(grouped),
+        {'group_column': grouped.group_column, 'value_column': grouped.value_column})
+
+
+def mann_whitney_from_ranks(rank_sum, n1, n2, ties):
+    # scipy の mannwhitneyu（両側、連続性補正あり、正規近似）と同じ式
+    n = n1 + n2
+    u1 = rank_sum - n1 * (n1 + 1) / 2
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    z = (max(u1, n1 * n2 - u1) - n1 * n2 / 2 - 0.5) / sigma
+    return u1, min(2 * stats.norm.sf(z), 1.0)
+
+
+def kruskal_from_ranks(rank_sums, counts, ties):
+    counts = np.asarray(counts, dtype=np.float64)
+    keep = counts > 0
+    rank_sums, counts = np.asarray(rank_sums)[keep], counts[keep]
+    n = counts.sum()
+    h = 12 / (n * (n + 1)) * np.sum(rank_sums ** 2 / counts) - 3 * (n + 1)
+    h /= 1 - ties / (n ** 3 - n)
+    return h, stats.chi2.sf(h, len(counts) - 1)
+
+
+def mann_whitney(data):
+    grouped = as_grouped(data)
+    group1, group2 = grouped.two_groups()
+    n1, n2 = len(group1), len(group2)
+    if min(n1, n2) <= MANN_WHITNEY_EXACT_MAX:
+        return tuple(stats.mannwhitneyu(group1, group2))[:2]
+    ranked = group_ranks(grouped)
+    stop = grouped.offsets[2]
+    if ranked.n_missing(stop):
+        return np.nan, np.nan
+    ranks, ties = ranked.prefix_ranks(stop)
+    return mann_whitney_from_ranks(ranks[:n1].sum(), n1, n2, ties)
+
+
+def kruskal(data):
+    grouped = as_grouped(data)
+    if grouped.n_groups < 2:
+        raise ValueError("2つ以上のグループが必要です。")
+    ranked = group_ranks(grouped)
+    if ranked.n_missing():
+        return np.nan, np.nan
+    return kruskal_from_ranks(np.add.reduceat(ranked.ranks, grouped.offsets[:-1]), grouped.counts, ranked.ties)
+
+
+def wilcoxon(data):
+    grouped = as_grouped(data)
+    differences = _paired_differences(grouped)
+    if len(differences) <= WILCOXON_EXACT_MAX:
+        group1, group2 = grouped.two_groups()
+        return tuple(stats.wilcoxon(group1, group2))[:2]
+    if np.isnan(differences).any():
+        return np.nan, np.nan
+    ranks, ties = signed_ranks(grouped)
+    n = len(ranks)
+    r_plus = ranks[ranks > 0].sum()
+    statistic = min(r_plus, n * (n + 1) / 2 - r_plus)
+    se = np.sqrt((n * (n + 1) * (2 * n + 1) - ties / 2) / 24)
+    z = (statistic - n * (n + 1) / 4) / se
+    return statistic, 2 * stats.norm.sf(abs(z))
+
+
+def friedman(data):
+    grouped = as_grouped(data)
+    rank_sums, ties = block_ranks(grouped)
+    if np.isnan(rank_sums).any():
+        return np.nan, np.nan
+    k, n = grouped.n_groups, grouped.counts[0]
+    statistic = (12 / (k * n * (k + 1)) * np.sum(rank_sums ** 2) - 3 * n * (k + 1)) / (1 - ties / (k * (k * k - 1) * n))
+    return statistic, stats.chi2.sf(statistic, k - 1)
+
+
+def spearman(data, x='x', y='y'):
+    # 2 列それぞれのキャッシュ済みの順位から相関係数と p 値（scipy の spearmanr と同じ t 分布）を求める
+    ranked_x, ranked_y = column_ranks(data, x), column_ranks(data, y)
+    n = ranked_x.size
+    if ranked_x.n_missing() or ranked_y.n_missing() or n < 3:
+        return np.nan, np.nan
+    a = ranked_x.ranks - (n + 1) / 2
+    b = ranked_y.ranks - (n + 1) / 2
+    rho = float(np.clip(a @ b / np.sqrt((a @ a) * (b @ b)), -1.0, 1.0))
+    df = n - 2
+    with np.errstate(divide='ignore'):
+        t = rho * np.sqrt(df / ((rho + 1.0) * (1.0 - rho)))
+    return rho, 2 * stats.t.sf(abs(t), df)
+
+
+def write_sorted_run(values, codes, directory, name):
+    # メモリに収まる大きさの 1 チャンクを並べ替えてディスクに書く（外部マージの 1 本の並び）
+    order = np.argsort(values)
+    values_path = os.path.join(directory, f"{name}.values.npy")
+    codes_path = os.path.join(directory, f"{name}.codes.npy")
+    np.save(values_path, np.asarray(values, dtype=np.float64)[order])
+    np.save(codes_path, np.asarray(codes, dtype=np.int32)[order])
+    return values_path, codes_path
+
+
+def merge_rank_sums(runs, keep, bucket_rows=RANK_BUCKET_ROWS):
+    # 並べ替え済みの並び (値のパス, グループ番号のパス, 全体のグループ番号への対応) を値の範囲ごとに
+    # 少しずつマージし、グループごとの順位和・件数と補正項を求める。keep は対象にするグループ
+    values = [np.load(values_path, mmap_mode='r') for values_path, _, _ in runs]
+    codes = [np.load(codes_path, mmap_mode='r') for _, codes_path, _ in runs]
+    code_maps = [np.asarray(code_map, dtype=np.int64) for _, _, code_map in runs]
+    keep = np.asarray(keep, dtype=bool)
+    rank_sums = np.zeros(len(keep))
+    counts = np.zeros(len(keep))
+    ties = 0.0
+    if not any(len(run) for run in values):
+        return rank_sums, counts, ties
+
+    # 各並びから一定間隔で取った値を区切りにすると、区切りの間に入る件数はおよそ bucket_rows 以下になる
+    stride = max(1, bucket_rows // (2 * len(runs)))
+    samples = np.unique(np.concatenate([np.asarray(run[::stride]) for run in values]))
+    splitters = samples[::len(runs)]
+    lower = [np.searchsorted(run, splitters, side='left') for run in values]
+    upper = [np.searchsorted(run, splitters, side='right') for run in values]
+
+    def piece(i, first, last):
+        piece_codes = code_maps[i][np.asarray(codes[i][first:last])]
+        selected = keep[piece_codes]
+        return selected, piece_codes[selected]
+
+    offset = 0.0
+    for j in range(len(splitters)):
+        # 区切りの値と等しいものは 1 つの同順位のまとまり（件数が多くても並べ替えずに数えるだけ）
+        equal = np.zeros(len(keep))
+        for i in range(len(runs)):
+            if upper[i][j] > lower[i][j]:
+                equal += np.bincount(piece(i, lower[i][j], upper[i][j])[1], minlength=len(keep))
+        size = equal.sum()
+        if size:
+            rank_sums += equal * (offset + (size + 1) / 2)
+            counts += equal
+            ties += size ** 3 - size
+            offset += size
+        # 次の区切りまでの値は各並びの連続した部分なので、つなげて安定ソートするとマージになる
+        bucket_values, bucket_codes = [], []
+        for i in range(len(runs)):
+            first = upper[i][j]
+            last = lower[i][j + 1] if j + 1 < len(splitters) else len(values[i])
+            if last > first:
+                selected, piece_codes = piece(i, first, last)
+                bucket_values.append(np.asarray(values[i][first:last])[selected])
+                bucket_codes.append(piece_codes)
+        if not bucket_values:
+            continue
+        bucket_values = np.concatenate(bucket_values)
+        bucket_codes = np.concatenate(bucket_codes)
+        order = np.argsort(bucket_values, kind='stable')
+        average, bucket_ties = average_ranks(bucket_values[order])
+        rank_sums += np.bincount(bucket_codes[order], weights=average + offset, minlength=len(keep))
+        counts += np.bincount(bucket_codes, minlength=len(keep))
+        ties += bucket_ties
+        offset += len(bucket_values)
+    return rank_sums, counts, ties
@@ -0,0 +1,135 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(data):
+    # DataFrame の内容（列名・型・インデックス・値）から高速なハッシュを作る
+    frame = data if isinstance(data, pd.DataFrame) else data.frame
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((frame.shape, list(frame.columns), [str(dtype) for dtype in frame.dtypes])).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def estimate_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    # パラメータをキーとして使えるようにハッシュ可能な形へ変換する
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class ResultCache:
+    # データのフィンガープリント + 検定名 + パラメータをキーにした LRU キャッシュ。
+    # 件数とおおよそのメモリ量の両方で古いものから追い出す。
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024, sizeof=estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # ワーカースレッドからも参照されるため、辞書の操作はロックの中で行う
+        self._lock = threading.RLock()
+
+    def make_key(self, name, data, params=None):
+        # GroupedData はフィンガープリントを保持しているので再計算しない。計算済みの文字列もそのまま使う
+        if isinstance(data, str):
+            data_key = data
+        else:
+            data_key = fingerprint(data) if isinstance(data, pd.DataFrame) else data.fingerprint
+        return (data_key, _freeze(name), _freeze(params or {}))
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            self._evict()
+
+    def get_or_compute(self, name, data, compute, params=None):
+        # 計算自体はロックの外で行う（同じキーを同時に計算することはあり得るが結果は同じ）
+        key = self.make_key(name, data, params)
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _evict(self):
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def resize(self, max_entries=None, max_bytes=None):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,46 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArray:
+    # NumPy 配列を共有メモリにコピーし、ワーカープロセスには名前・形状・型だけを渡す
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf)
+        self.array[...] = array
+        self.spec = (self.shm.name, array.shape, array.dtype.str)
+
+    def close(self):
+        if self.shm is not None:
+            self.array = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AttachedArray:
+    # ワーカー側で共有メモリに接続し、コピーせずに配列として参照する
+    def __init__(self, spec):
+        name, shape, dtype = spec
+        # プールのワーカーは親プロセスのリソーストラッカーを共有するので、
+        # 破棄（unlink）は作成側の SharedArray.close に任せる
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+
+    def __enter__(self):
+        return self.array
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -2,11 +2,67 @@ import numpy as np
 from scipy import stats
 import pandas as pd
 import statsmodels.api as sm
-from statsmodels.stats.multicomp import pairwise_tukeyhsd, MultiComparison
 from statsmodels.formula.api import ols
 from statsmodels.stats.anova import AnovaRM
-
-def run_statistical_test(test, data):
+from grouped_data import as_grouped
+from correlation import correlation_matrix
+from posthoc import run_dunnett, run_pairwise
+from ranking import friedman, kruskal, mann_whitney, spearman, wilcoxon
+from resampling import BOOTSTRAP_COUNT, PERMUTATION_COUNT, bootstrap, permutation_test
+
+STATISTICAL_TESTS = (
+    "対応のないt検定", "対応のあるt検定", "一元配置分散分析（ANOVA）",
+    "二元配置分散分析", "反復測定分散分析", "共分散分析（ANCOVA）",
+    "Mann-Whitney U検定", "Wilcoxon符号順位検定", "Kruskal-Wallis検定",
+    "Friedman検定", "Spearman順位相関係数"
+)
+
+POST_HOC_TESTS = (
+    "Tukey's HSD検定", "Dunnett検定", "Bonferroni法",
+    "Holm法", "Scheffe法", "Games-Howell法"
+)
+
+# 並べ替え検定で p 値を求められる検定と、その並べ替えの方法
+PERMUTATION_TESTS = {
+    "対応のないt検定": 'two_sample',
+    "対応のあるt検定": 'paired',
+    "一元配置分散分析（ANOVA）": 'k_sample',
+    "Mann-Whitney U検定": 'two_sample_rank',
+    "Wilcoxon符号順位検定": 'signed_rank',
+    "Kruskal-Wallis検定": 'k_sample_rank',
+}
+
+# ブートストラップ信頼区間を付けられる検定と、その抽出の方法
+BOOTSTRAP_TESTS = {
+    "対応のないt検定": 'two_sample',
+    "対応のあるt検定": 'paired',
+    "一元配置分散分析（ANOVA）": 'k_sample',
+    "Mann-Whitney U検定": 'two_sample',
+    "Wilcoxon符号順位検定": 'paired',
+    "Kruskal-Wallis検定": 'k_sample',
+}
+
+def default_test_options():
+    return {'permutation': False, 'permutations': PERMUTATION_COUNT, 'bootstrap': False,
+            'resamples': BOOTSTRAP_COUNT, 'seed': 0, 'workers': None}
+
+def run_statistical_test(test, data, options=None):
+    # group列の因子化は全検定で共有する
+    data = as_grouped(data)
+    options = dict(default_test_options(), **(options or {}))
+    results, is_significant = _run_test(test, data)
+    if options['permutation'] and test in PERMUTATION_TESTS:
+        # 漸近的な p 値に加えて並べ替え検定の p 値を示し、有意かどうかは後者で判定する
+        permutation = permutation_test(data, PERMUTATION_TESTS[test], options['permutations'],
+                                       options['seed'], options['workers'])
+        results = f"{results}\n{permutation.to_text()}"
+        is_significant = permutation.p_value < 0.05
+    if options['bootstrap'] and test in BOOTSTRAP_TESTS:
+        intervals = bootstrap(data, BOOTSTRAP_TESTS[test], options['resamples'], options['seed'], options['workers'])
+        results = f"{results}\n{intervals.to_text()}"
+    return results, is_significant
+
+def _run_test(test, data):
     if test == "対応のないt検定":
         return t_test_independent(data)
     elif test == "対応のあるt検定":
@@ -32,11 +88,13 @@ def run_statistical_test(test, data):
     else:
         return "選択された検定はまだ実装されていません。", False
 
-def run_post_hoc_test(test, data):
+def run_post_hoc_test(test, data, control=None):
+    # control は Dunnett 検定の対照群（省略時は最初のグループ）
+    data = as_grouped(data)
     if test == "Tukey's HSD検定":
         return tukey_hsd(data)
     elif test == "Dunnett検定":
-        return dunnett(data)
+        return dunnett(data, control)
     elif test == "Bonferroni法":
         return bonferroni(data)
     elif test == "Holm法":
@@ -49,26 +107,25 @@ def run_post_hoc_test(test, data):
         return "選択されたPost Hoc検定はまだ実装されていません。"
 
 def t_test_independent(data):
-    group1 = data[data['group'] == data['group'].unique()[0]]['value']
-    group2 = data[data['group'] == data['group'].unique()[1]]['value']
+    group1, group2 = as_grouped(data).two_groups()
     t_stat, p_value = stats.ttest_ind(group1, group2)
     results = f"t統計量: {t_stat:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def t_test_paired(data):
-    group1 = data[data['group'] == data['group'].unique()[0]]['value']
-    group2 = data[data['group'] == data['group'].unique()[1]]['value']
+    group1, group2 = as_grouped(data).two_groups()
     t_stat, p_value = stats.ttest_rel(group1, group2)
     results = f"t統計量: {t_stat:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def one_way_anova(data):
-    groups = [group for name, group in data.groupby('group')['value']]
+    groups = as_grouped(data).groups()
     f_value, p_value = stats.f_oneway(*groups)
     results = f"F値: {f_value:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def two_way_anova(data):
+    data = as_grouped(data).frame
     formula = 'value ~ C(factor1) + C(factor2) + C(factor1):C(factor2)'
     model = ols(formula, data).fit()
     anova_table = sm.stats.anova_lm(model, typ=2)
@@ -76,12 +133,14 @@ def two_way_anova(data):
     return results, any(anova_table['PR(>F)'] < 0.05)
 
 def repeated_measures_anova(data):
+    data = as_grouped(data).frame
     aov = AnovaRM(data, 'value', 'subject', within=['time'])
     res = aov.fit()
     results = res.summary().as_text()
     return results, res.anova_table['Pr > F']['time'] < 0.05
 
 def ancova(data):
+    data = as_grouped(data).frame
     formula = 'value ~ C(group) + covariate'
     model = ols(formula, data).fit()
     anova_table = sm.stats.anova_lm(model, typ=2)
@@ -89,62 +148,60 @@ def ancova(data):
     return results, anova_table.loc['C(group)', 'PR(>F)'] < 0.05
 
 def mann_whitney_u(data):
-    group1 = data[data['group'] == data['group'].unique()[0]]['value']
-    group2 = data[data['group'] == data['group'].unique()[1]]['value']
-    statistic, p_value = stats.mannwhitneyu(group1, group2)
+    # 順位はデータごとに一度だけ付けてキャッシュし、他の順位検定と共有する
+    statistic, p_value = mann_whitney(data)
     results = f"U統計量: {statistic:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def wilcoxon_signed_rank(data):
-    group1 = data[data['group'] == data['group'].unique()[0]]['value']
-    group2 = data[data['group'] == data['group'].unique()[1]]['value']
-    statistic, p_value = stats.wilcoxon(group1, group2)
+    statistic, p_value = wilcoxon(data)
     results = f"W統計量: {statistic:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def kruskal_wallis(data):
-    groups = [group for _, group in data.groupby('group')['value']]
-    statistic, p_value = stats.kruskal(*groups)
+    statistic, p_value = kruskal(data)
     results = f"H統計量: {statistic:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def friedman_test(data):
-    groups = [group for _, group in data.groupby('group')['value']]
-    statistic, p_value = stats.friedmanchisquare(*groups)
+    statistic, p_value = friedman(data)
     results = f"Friedman統計量: {statistic:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
 def spearman_correlation(data):
-    correlation, p_value = stats.spearmanr(data['x'], data['y'])
+    grouped = as_grouped(data)
+    data = grouped.frame
+    if 'x' not in data or 'y' not in data:
+        return spearman_correlation_matrix(grouped)
+    correlation, p_value = spearman(grouped)
     results = f"Spearman相関係数: {correlation:.4f}\np値: {p_value:.4f}"
     return results, p_value < 0.05
 
+def spearman_correlation_matrix(data, count=20):
+    # x・y 列がない場合は、すべての数値列の組み合わせについて順位相関を求め、絶対値の大きい順に示す
+    result = correlation_matrix(data, 'spearman', with_p=True)
+    pairs = result.top_pairs(count)
+    if not pairs:
+        return "Spearman順位相関係数には数値列が2列以上必要です。", False
+    lines = [f"Spearman順位相関係数（{len(result.columns)}列、絶対値の大きい上位{len(pairs)}組）"]
+    lines += [f"{a} - {b}: 相関係数 {rho:.4f}, p値 {p_value:.4g}" for a, b, rho, p_value in pairs]
+    p_values = result.p_values[np.triu_indices(len(result.columns), k=1)]
+    return "\n".join(lines), bool(np.nanmin(p_values) < 0.05)
+
 def tukey_hsd(data):
-    mc = MultiComparison(data['value'], data['group'])
-    result = mc.tukeyhsd()
-    return str(result)
+    return run_pairwise(data, "Tukey's HSD検定")
 
-def dunnett(data):
-    from statsmodels.stats.multicomp import pairwise_tukeyhsd
-    result = pairwise_tukeyhsd(data['value'], data['group'])
-    return str(result)
+def dunnett(data, control=None):
+    return run_dunnett(data, control)
 
 def bonferroni(data):
-    mc = MultiComparison(data['value'], data['group'])
-    result = mc.allpairtest(stats.ttest_ind, method='bonf')
-    return str(result[0])
+    return run_pairwise(data, "Bonferroni法")
 
 def holm(data):
-    mc = MultiComparison(data['value'], data['group'])
-    result = mc.allpairtest(stats.ttest_ind, method='holm')
-    return str(result[0])
+    return run_pairwise(data, "Holm法")
 
 def scheffe(data):
-    mc = MultiComparison(data['value'], data['group'])
-    result = mc.scheffe_test()
-    return str(result)
+    return run_pairwise(data, "Scheffe法")
 
 def games_howell(data):
-    from statsmodels.stats.multicomp import pairwise_gameshowell
-    result = pairwise_gameshowell(data['value'], data['group'])
-    return str(result)
\ No newline at end of file
+    return run_pairwise(data, "Games-Howell法")
@@ -0,0 +1,409 @@
+import io
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import columnar_io
+from chunked_import import connect_sqlite_readonly, quote_identifier, sqlite_tables
+from ranking import kruskal_from_ranks, mann_whitney_from_ranks, merge_rank_sums, write_sorted_run
+
+STREAMING_CHUNKSIZE = 500_000
+# CSV を分割するときの 1 区間あたりのバイト数の目安
+CSV_PARTITION_BYTES = 256 * 1024 * 1024
+SQLITE_PARTITION_ROWS = 5_000_000
+PARQUET_PARTITION_ROW_GROUPS = 4
+
+# 逐次集計で計算できる検定（全データを読み込まずに十分統計量から計算する）
+STREAMING_TESTS = ("対応のないt検定", "一元配置分散分析（ANOVA）", "共分散分析（ANCOVA）",
+                   "Mann-Whitney U検定", "Kruskal-Wallis検定")
+# 順位検定はチャンクごとに並べ替えてディスクに書き、外部マージで順位和を求める
+RANK_STREAMING_TESTS = ("Mann-Whitney U検定", "Kruskal-Wallis検定")
+
+
+class GroupMoments:
+    # グループごとの件数・平均・偏差平方和（M2）を保持する。共変量があれば共変量の平均・M2 と
+    # 目的変数との偏差積和も持つ。チャンクごとに計算した値は Chan の公式で結合できるので、
+    # 読み込む順序や分割のしかたによらず同じ結果になる
+    def __init__(self, covariate=False):
+        self.covariate = covariate
+        self.labels = []
+        self.index = {}
+        self.n = np.zeros(0)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        if covariate:
+            self.mean_x = np.zeros(0)
+            self.m2_x = np.zeros(0)
+            self.c_xy = np.zeros(0)
+
+    def _fields(self):
+        return ('n', 'mean', 'm2', 'mean_x', 'm2_x', 'c_xy') if self.covariate else ('n', 'mean', 'm2')
+
+    def _align(self, labels):
+        # 新しいグループを末尾に追加し、labels の各グループの位置を返す
+        positions = []
+        for label in labels:
+            position = self.index.get(label)
+            if position is None:
+                position = self.index[label] = len(self.labels)
+                self.labels.append(label)
+            positions.append(position)
+        grow = len(self.labels) - len(self.n)
+        if grow:
+            for field in self._fields():
+                setattr(self, field, np.concatenate([getattr(self, field), np.zeros(grow)]))
+        return np.asarray(positions, dtype=np.intp)
+
+    def _combine(self, positions, other):
+        # Chan らの並列アルゴリズムで (件数, 平均, M2, 偏差積和) を結合する
+        n_a, n_b = self.n[positions], other['n']
+        n = n_a + n_b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(n > 0, n_a * n_b / n, 0.0)
+            share = np.where(n > 0, n_b / n, 0.0)
+        delta = other['mean'] - self.mean[positions]
+        self.m2[positions] += other['m2'] + delta * delta * weight
+        if self.covariate:
+            delta_x = other['mean_x'] - self.mean_x[positions]
+            self.m2_x[positions] += other['m2_x'] + delta_x * delta_x * weight
+            self.c_xy[positions] += other['c_xy'] + delta_x * delta * weight
+            self.mean_x[positions] += delta_x * share
+        self.mean[positions] += delta * share
+        self.n[positions] = n
+
+    def update(self, groups, values, covariates=None):
+        # 1 チャンク分の値をグループごとに集計して結合する（欠損値を含む行は除く）
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values) & pd.notna(np.asarray(groups))
+        if self.covariate:
+            covariates = np.asarray(covariates, dtype=np.float64)
+            valid &= np.isfinite(covariates)
+        if not valid.all():
+            groups, values = np.asarray(groups)[valid], values[valid]
+            covariates = covariates[valid] if self.covariate else None
+        if len(values) == 0:
+            return self
+        codes, labels = _factorize_groups(groups)
+        size = len(labels)
+        n = np.bincount(codes, minlength=size).astype(np.float64)
+        chunk = {'n': n}
+        chunk['mean'] = np.bincount(codes, weights=values, minlength=size) / n
+        deviations = values - chunk['mean'][codes]
+        chunk['m2'] = np.bincount(codes, weights=deviations * deviations, minlength=size)
+        if self.covariate:
+            chunk['mean_x'] = np.bincount(codes, weights=covariates, minlength=size) / n
+            deviations_x = covariates - chunk['mean_x'][codes]
+            chunk['m2_x'] = np.bincount(codes, weights=deviations_x * deviations_x, minlength=size)
+            chunk['c_xy'] = np.bincount(codes, weights=deviations_x * deviations, minlength=size)
+        self._combine(self._align(labels), chunk)
+        return self
+
+    def merge(self, other):
+        positions = self._align(other.labels)
+        self._combine(positions, {field: getattr(other, field) for field in self._fields()})
+        return self
+
+    def total(self):
+        # 全グループを 1 つにまとめた件数・平均・M2（と共変量の値）
+        combined = GroupMoments(self.covariate)
+        combined._align(['全体'])
+        for position in range(len(self.labels)):
+            combined._combine(np.array([0]), {field: getattr(self, field)[position:position + 1]
+                                              for field in self._fields()})
+        return combined
+
+    @property
+    def variance(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / (self.n - 1)
+
+
+def _label(value):
+    # 欠損値を含むチャンクでは整数のグループ列が float として読まれるので、整数値の float は整数にしてから
+    # 文字列にする（同じグループがチャンクによって "2" と "2.0" に分かれないように）
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _factorize_groups(groups):
+    # チャンク内のグループ番号と文字列にそろえたグループ名。そろえた結果同じ名前になったものは 1 つにまとめる
+    codes, labels = pd.factorize(groups)
+    inverse, labels = pd.factorize(pd.Index([_label(label) for label in labels], dtype=object))
+    return inverse[codes], list(labels)
+
+
+def t_test(moments, welch=False):
+    # 最初の 2 グループの t 検定（scipy の ttest_ind と同じ並び）
+    if len(moments.labels) < 2:
+        raise ValueError("2つ以上のグループが必要です。")
+    n1, n2 = moments.n[:2]
+    mean1, mean2 = moments.mean[:2]
+    var1, var2 = moments.variance[:2]
+    if welch:
+        se2 = var1 / n1 + var2 / n2
+        df = se2 ** 2 / ((var1 / n1) ** 2 / (n1 - 1) + (var2 / n2) ** 2 / (n2 - 1))
+    else:
+        df = n1 + n2 - 2
+        se2 = ((n1 - 1) * var1 + (n2 - 1) * var2) / df * (1 / n1 + 1 / n2)
+    t = (mean1 - mean2) / np.sqrt(se2)
+    return t, 2 * stats.t.sf(abs(t), df), df
+
+
+def one_way_anova(moments):
+    keep = moments.n > 0
+    n, mean, m2 = moments.n[keep], moments.mean[keep], moments.m2[keep]
+    k, total = len(n), n.sum()
+    grand = n @ mean / total
+    between = n @ (mean - grand) ** 2
+    within = m2.sum()
+    f = (between / (k - 1)) / (within / (total - k))
+    return f, stats.f.sf(f, k - 1, total - k), (k - 1, total - k)
+
+
+def ancova(moments):
+    # 共変量で調整したグループの効果（statsmodels の value ~ C(group) + covariate の Type II と同じ）
+    keep = moments.n > 0
+    k, total = int(keep.sum()), moments.n[keep].sum()
+    whole = moments.total()
+    ss_y_total, ss_x_total, sp_total = whole.m2[0], whole.m2_x[0], whole.c_xy[0]
+    ss_y_within, ss_x_within, sp_within = moments.m2.sum(), moments.m2_x.sum(), moments.c_xy.sum()
+    residual = ss_y_within - sp_within ** 2 / ss_x_within
+    adjusted_total = ss_y_total - sp_total ** 2 / ss_x_total
+    df_group, df_residual = k - 1, total - k - 1
+    group_ss = adjusted_total - residual
+    covariate_ss = sp_within ** 2 / ss_x_within
+    mse = residual / df_residual
+    table = pd.DataFrame({
+        'sum_sq': [group_ss, covariate_ss, residual],
+        'df': [df_group, 1, df_residual],
+        'F': [group_ss / df_group / mse, covariate_ss / mse, np.nan],
+    }, index=['C(group)', 'covariate', 'Residual'])
+    table['PR(>F)'] = [stats.f.sf(table['F'].iloc[0], df_group, df_residual),
+                       stats.f.sf(table['F'].iloc[1], 1, df_residual), np.nan]
+    return table
+
+
+class _RangeReader(io.RawIOBase):
+    # ファイルの [start, stop) のバイトだけを読むファイルオブジェクト
+    def __init__(self, path, start, stop):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        count = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining -= count
+        return count
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def csv_partitions(path, partition_bytes=CSV_PARTITION_BYTES):
+    # 行の途中で切れないように、区切り位置を次の改行の直後にずらす。先頭行は見出し
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        boundaries = [f.tell()]
+        position = boundaries[0] + partition_bytes
+        while position < size:
+            f.seek(position)
+            f.readline()
+            if f.tell() >= size:
+                break
+            boundaries.append(f.tell())
+            position = f.tell() + partition_bytes
+    boundaries.append(size)
+    columns = pd.read_csv(io.BytesIO(header), nrows=0).columns.tolist()
+    return [('csv', path, start, stop, columns) for start, stop in zip(boundaries[:-1], boundaries[1:])
+            if stop > start]
+
+
+def sqlite_partitions(path, table, partition_rows=SQLITE_PARTITION_ROWS):
+    conn = connect_sqlite_readonly(path)
+    try:
+        low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {quote_identifier(table)}").fetchone()
+    finally:
+        conn.close()
+    if low is None:
+        return []
+    return [('sqlite', path, table, start, min(start + partition_rows - 1, high))
+            for start in range(low, high + 1, partition_rows)]
+
+
+def parquet_partitions(path, row_groups_per_partition=PARQUET_PARTITION_ROW_GROUPS):
+    columnar_io._require_pyarrow()
+    count = columnar_io.pq.ParquetFile(path).num_row_groups
+    return [('parquet', path, list(range(start, min(start + row_groups_per_partition, count))))
+            for start in range(0, count, row_groups_per_partition)]
+
+
+def partition_source(source):
+    path = source['path']
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        return csv_partitions(path)
+    if lower.endswith(('.db', '.sqlite')):
+        table = source.get('table')
+        if not table:
+            tables = sqlite_tables(path)
+            if len(tables) != 1:
+                raise ValueError(f"テーブル名を指定してください（候補: {', '.join(tables)}）")
+            table = tables[0]
+        return sqlite_partitions(path, table)
+    if lower.endswith('.parquet'):
+        return parquet_partitions(path)
+    raise ValueError(f"逐次集計に対応していないファイル形式です: {path}")
+
+
+def _partition_chunks(partition, columns, chunksize, group_column=None):
+    kind = partition[0]
+    if kind == 'csv':
+        _, path, start, stop, names = partition
+        reader = io.BufferedReader(_RangeReader(path, start, stop), buffer_size=1024 * 1024)
+        # グループ列は文字列として読み、チャンクごとの型の推定にまかせない
+        dtype = {group_column: str} if group_column is not None else None
+        try:
+            yield from pd.read_csv(reader, header=None, names=names, usecols=columns, dtype=dtype,
+                                   chunksize=chunksize)
+        finally:
+            reader.close()
+    elif kind == 'sqlite':
+        _, path, table, low, high = partition
+        selected = ', '.join(quote_identifier(column) for column in columns)
+        conn = connect_sqlite_readonly(path)
+        try:
+            yield from pd.read_sql_query(
+                f"SELECT {selected} FROM {quote_identifier(table)} WHERE rowid BETWEEN ? AND ?",
+                conn, params=(low, high), chunksize=chunksize)
+        finally:
+            conn.close()
+    else:
+        _, path, row_groups = partition
+        parquet = columnar_io.pq.ParquetFile(path)
+        for batch in parquet.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=columns):
+            yield batch.to_pandas()
+
+
+def accumulate_partition(partition, group_column='group', value_column='value', covariate_column=None,
+                         chunksize=STREAMING_CHUNKSIZE):
+    # 1 区間をチャンクごとに読み、グループごとの統計量だけを残す（メモリ使用量はチャンクの大きさで決まる）
+    columns = [group_column, value_column] + ([covariate_column] if covariate_column else [])
+    moments = GroupMoments(covariate=covariate_column is not None)
+    for chunk in _partition_chunks(partition, columns, chunksize, group_column):
+        moments.update(chunk[group_column].to_numpy(), pd.to_numeric(chunk[value_column], errors='coerce'),
+                       pd.to_numeric(chunk[covariate_column], errors='coerce') if covariate_column else None)
+    return moments
+
+
+def _map_partitions(function, partitions, workers=None, progress_callback=None, **kwargs):
+    # 区間ごとの処理をプロセスプールで並列に行い、結果を区間の順に返す
+    workers = min(workers or os.cpu_count() or 1, max(len(partitions), 1))
+    if workers == 1:
+        results = (function(partition, **kwargs) for partition in partitions)
+        for done, result in enumerate(results, 1):
+            yield result
+            if progress_callback is not None:
+                progress_callback(int(done / len(partitions) * 100))
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(function, partition, **kwargs) for partition in partitions]
+        for done, future in enumerate(futures, 1):
+            yield future.result()
+            if progress_callback is not None:
+                progress_callback(int(done / len(partitions) * 100))
+
+
+def accumulate_source(source, covariate_column=None, workers=None, progress_callback=None):
+    moments = GroupMoments(covariate=covariate_column is not None)
+    for partial_moments in _map_partitions(accumulate_partition, partition_source(source), workers,
+                                           progress_callback, covariate_column=covariate_column):
+        moments.merge(partial_moments)
+    return moments
+
+
+def sort_partition(partition, number, directory, group_column='group', value_column='value',
+                   chunksize=STREAMING_CHUNKSIZE):
+    # 区間をチャンクごとに並べ替えてディスクに書き、(値のパス, グループ番号のパス, グループ名) の並びを返す
+    runs = []
+    chunks = _partition_chunks(partition, [group_column, value_column], chunksize, group_column)
+    for chunk_number, chunk in enumerate(chunks):
+        values = pd.to_numeric(chunk[value_column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        groups = chunk[group_column].to_numpy()
+        valid = np.isfinite(values) & pd.notna(groups)
+        if not valid.any():
+            continue
+        codes, labels = _factorize_groups(groups[valid])
+        paths = write_sorted_run(values[valid], codes, directory, f"{number}_{chunk_number}")
+        runs.append(paths + (labels,))
+    return runs
+
+
+def rank_source(source, n_groups=None, workers=None, progress_callback=None):
+    # グループごとの順位和・件数と同順位の補正項。n_groups を指定すると最初のグループだけで順位を付ける
+    partitions = partition_source(source)
+    index = {}
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='rank_runs_') as directory:
+        numbered = list(enumerate(partitions))
+        for partition_runs in _map_partitions(_sort_numbered_partition, numbered, workers, progress_callback,
+                                              directory=directory):
+            for values_path, codes_path, labels in partition_runs:
+                code_map = [index.setdefault(label, len(index)) for label in labels]
+                runs.append((values_path, codes_path, code_map))
+        keep = np.arange(len(index)) < (len(index) if n_groups is None else n_groups)
+        rank_sums, counts, ties = merge_rank_sums(runs, keep)
+    return list(index)[:int(keep.sum())], rank_sums[keep], counts[keep], ties
+
+
+def _sort_numbered_partition(numbered, directory):
+    number, partition = numbered
+    return sort_partition(partition, number, directory)
+
+
+def _run_rank_test(test, source, workers=None):
+    two_groups = test == "Mann-Whitney U検定"
+    labels, rank_sums, counts, ties = rank_source(source, 2 if two_groups else None, workers)
+    if len(labels) < 2:
+        raise ValueError("2つ以上のグループが必要です。")
+    rows = f"{int(counts.sum()):,}行（{len(labels)}グループ）を外部マージで順位付け"
+    if two_groups:
+        statistic, p_value = mann_whitney_from_ranks(rank_sums[0], counts[0], counts[1], ties)
+        return f"U統計量: {statistic:.4f}\np値: {p_value:.4f}\n{rows}", p_value < 0.05
+    statistic, p_value = kruskal_from_ranks(rank_sums, counts, ties)
+    return f"H統計量: {statistic:.4f}\np値: {p_value:.4f}\n{rows}", p_value < 0.05
+
+
+def run_streaming_test(test, source, workers=None):
+    # 逐次集計した統計量から検定を行い、run_statistical_test と同じ (結果の文字列, 有意かどうか) を返す
+    if test not in STREAMING_TESTS:
+        raise ValueError(f"逐次集計では実行できない検定です: {test}")
+    if test in RANK_STREAMING_TESTS:
+        return _run_rank_test(test, source, workers)
+    covariate = 'covariate' if test == "共分散分析（ANCOVA）" else None
+    moments = accumulate_source(source, covariate_column=covariate, workers=workers)
+    rows = f"{int(moments.n.sum()):,}行（{len(moments.labels)}グループ）を逐次集計"
+    if test == "対応のないt検定":
+        t_stat, p_value, _ = t_test(moments)
+        welch_t, welch_p, welch_df = t_test(moments, welch=True)
+        results = (f"t統計量: {t_stat:.4f}\np値: {p_value:.4f}\n"
+                   f"Welchのt統計量: {welch_t:.4f}（自由度 {welch_df:.1f}）\nWelchのp値: {welch_p:.4f}\n{rows}")
+        return results, p_value < 0.05
+    if test == "一元配置分散分析（ANOVA）":
+        f_value, p_value, _ = one_way_anova(moments)
+        return f"F値: {f_value:.4f}\np値: {p_value:.4f}\n{rows}", p_value < 0.05
+    table = ancova(moments)
+    return f"{table.to_string()}\n{rows}", table.loc['C(group)', 'PR(>F)'] < 0.05
@@ -1,27 +1,59 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QComboBox, QLabel, QTextEdit, QScrollArea
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
-from sklearn.linear_model import LinearRegression, LogisticRegression
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.metrics import mean_squared_error, r2_score, accuracy_score, classification_report
-from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVC
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.naive_bayes import GaussianNB
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QComboBox, QLabel, QTextEdit, QScrollArea, QSpinBox
+from PySide6.QtCore import Signal
+from matplotlib.figure import Figure
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from concurrent.futures import ThreadPoolExecutor
 import logging
+from concurrent.futures.process import BrokenProcessPool
+
+from analysis_backend import (
+    ANALYSIS_METHODS,
+    PARALLEL_METHODS,
+    AnalysisInput,
+    create_executor,
+    default_worker_count,
+    run_analysis_job,
+)
+
+
+def build_analysis_figure(plot):
+    # ワーカープロセスから返された描画用データから GUI スレッドで図を作る
+    figure = Figure(figsize=(10, 6))
+    ax = figure.add_subplot(111)
+    if plot['type'] == 'matrix':
+        image = ax.imshow(plot['matrix'], cmap='Blues')
+        figure.colorbar(image, ax=ax)
+        ticks = np.arange(len(plot['labels']))
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(plot['labels'], rotation=45, ha='right')
+        ax.set_yticks(ticks)
+        ax.set_yticklabels(plot['labels'])
+        for (i, j), count in np.ndenumerate(plot['matrix']):
+            ax.text(j, i, str(count), ha='center', va='center')
+    else:
+        if plot['c'] is not None:
+            ax.scatter(plot['x'], plot['y'], c=plot['c'], cmap='viridis', s=10, alpha=0.7)
+        else:
+            ax.scatter(plot['x'], plot['y'], s=10, alpha=0.7)
+    ax.set_title(plot['title'])
+    ax.set_xlabel(plot['xlabel'])
+    ax.set_ylabel(plot['ylabel'])
+    figure.tight_layout()
+    return figure
+
 
 class AdvancedAnalysisTab(QWidget):
+    # concurrent.futures のコールバックはワーカー側のスレッドで呼ばれるので、シグナル経由で GUI スレッドに渡す
+    job_done = Signal(object)
+
     def __init__(self, on_analysis_completed_callback):
         super().__init__()
         self.layout = QVBoxLayout(self)
         self.on_analysis_completed_callback = on_analysis_completed_callback
         self.data = None
-        self.thread_pool = ThreadPoolExecutor(max_workers=4)  # スレッドプールの初期化
+        self.executor = None
+        self.executor_workers = None
+        self.current_future = None
+        self.job_done.connect(self.analysis_completed)
 
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
@@ -29,18 +61,18 @@ class AdvancedAnalysisTab(QWidget):
         scroll_layout = QVBoxLayout(scroll_content)
 
         self.analysis_method = QComboBox()
-        self.analysis_method.addItems([
-            "主成分分析 (PCA)",
-            "K-means クラスタリング",
-            "線形回帰",
-            "ロジスティック回帰",
-            "サポートベクターマシン (SVM)",
-            "ランダムフォレスト",
-            "ナイーブベイズ"
-        ])
+        self.analysis_method.addItems(list(ANALYSIS_METHODS))
         scroll_layout.addWidget(QLabel("分析手法:"))
         scroll_layout.addWidget(self.analysis_method)
 
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("ワーカープロセス数:"))
+        self.worker_count = QSpinBox()
+        self.worker_count.setRange(1, max(default_worker_count(), 64))
+        self.worker_count.setValue(default_worker_count())
+        workers_layout.addWidget(self.worker_count)
+        scroll_layout.addLayout(workers_layout)
+
         self.run_button = QPushButton("分析実行")
         self.run_button.clicked.connect(self.run_analysis)
         scroll_layout.addWidget(self.run_button)
@@ -55,67 +87,82 @@ class AdvancedAnalysisTab(QWidget):
     def set_data(self, data):
         self.data = data
 
+    def get_executor(self):
+        workers = self.worker_count.value()
+        # ワーカーが異常終了して壊れたプールは submit できないので作り直す
+        broken = self.executor is not None and getattr(self.executor, '_broken', False)
+        if self.executor is None or broken or self.executor_workers != workers:
+            self.shutdown()
+            self.executor = create_executor(workers)
+            self.executor_workers = workers
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
     def run_analysis(self):
         if self.data is None:
             self.result_text.setText("データが読み込まれていません。")
             return
 
-        method = self.analysis_method.currentText()
-        analysis_methods = {
-            "主成分分析 (PCA)": self.run_pca,
-            "K-means クラスタリング": self.run_kmeans,
-            "線形回帰": self.run_linear_regression,
-            "ロジスティック回帰": self.run_logistic_regression,
-            "サポートベクターマシン (SVM)": self.run_svm,
-            "ランダムフォレスト": self.run_random_forest,
-            "ナイーブベイズ": self.run_naive_bayes
-        }
-
-        if method in analysis_methods:
-            # 分析をスレッドプールで実行
-            future = self.thread_pool.submit(analysis_methods[method])
-            future.add_done_callback(self.analysis_completed)
-        else:
+        label = self.analysis_method.currentText()
+        method = ANALYSIS_METHODS.get(label)
+        if method is None:
             self.result_text.setText("選択された分析手法は実装されていません。")
+            return
 
-    def analysis_completed(self, future):
         try:
-            result, figure = future.result()
-            self.result_text.setText(result)
-            self.on_analysis_completed_callback(figure)
-            logging.info(f"Advanced analysis '{self.analysis_method.currentText()}' completed successfully")
+            analysis_input = AnalysisInput(self.data, method)
         except Exception as e:
-            error_msg = f"分析中にエラーが発生しました: {str(e)}"
-            self.result_text.setText(error_msg)
-            logging.error(f"Error in advanced analysis: {str(e)}")
-
-    # 以下、各分析手法の実装（run_pca, run_kmeans, etc.）は変更なし
-    # ただし、各メソッドの最後で (result, figure) を返すように修正する
-
-    def run_pca(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
-
-    def run_kmeans(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
-
-    def run_linear_regression(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
+            self.result_text.setText(f"分析中にエラーが発生しました: {str(e)}")
+            return
 
-    def run_logistic_regression(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
+        options = {}
+        if method in PARALLEL_METHODS:
+            # 1 ジョブだけなので、木や部分標本の SVC の学習はワーカープロセス内で全コアを使う
+            options['n_jobs'] = self.worker_count.value()
+        features_spec, target_spec = analysis_input.specs()
+        try:
+            future = self.get_executor().submit(
+                run_analysis_job, method, features_spec, target_spec,
+                analysis_input.feature_names, analysis_input.class_labels, options
+            )
+        except Exception as e:
+            # 投入できなかったジョブの共有メモリはここで解放する
+            analysis_input.close()
+            if isinstance(e, BrokenProcessPool):
+                self.shutdown()
+            self.result_text.setText(f"分析中にエラーが発生しました: {str(e)}")
+            logging.error(f"Error in advanced analysis: {str(e)}")
+            return
+        self.current_future = future
+        self.run_button.setEnabled(False)
+        self.result_text.setText(f"{label} を実行中です...")
 
-    def run_svm(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
+        def done(future):
+            # 共有メモリはワーカーの終了後に作成側で解放する
+            analysis_input.close()
+            self.job_done.emit((label, future))
 
-    def run_random_forest(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
+        future.add_done_callback(done)
 
-    def run_naive_bayes(self):
-        # ... (既存のコード)
-        return result, plt.gcf()
\ No newline at end of file
+    def analysis_completed(self, job):
+        label, future = job
+        if future is not self.current_future:
+            return
+        self.current_future = None
+        self.run_button.setEnabled(True)
+        try:
+            result, table, plot = future.result()
+            self.result_text.setText(result)
+            self.on_analysis_completed_callback(table, build_analysis_figure(plot))
+            logging.info(f"Advanced analysis '{label}' completed successfully")
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # ワーカーが異常終了したプールは使えないので、次の実行で作り直す
+                self.shutdown()
+            error_msg = f"分析中にエラーが発生しました: {str(e)}"
+            self.result_text.setText(error_msg)
+            logging.error(f"Error in advanced analysis: {str(e)}")
@@ -1,8 +1,95 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QFileDialog, QTextEdit, QInputDialog, QMessageBox
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QPushButton, QFileDialog, QInputDialog, QMessageBox, QProgressDialog,
+                               QDialog, QFormLayout, QComboBox, QListWidget, QListWidgetItem, QLineEdit, QSpinBox, QDoubleSpinBox,
+                               QDialogButtonBox, QLabel)
+from PySide6.QtCore import Qt
 import pandas as pd
-import sqlite3
-import requests
-import json
+from chunked_import import (ImportCancelled, estimate_sqlite_rows, excel_sheets, read_csv_chunked, read_excel_streaming,
+                            read_sqlite, sqlite_columns, sqlite_tables)
+from api_import import PaginatedAPIClient
+from columnar_io import parquet_info, parse_columns, parse_filters, parse_row_groups, parse_value, read_feather, read_parquet
+from tabs.data_preview import DataPreviewWidget
+from workers import Worker, start_worker
+
+
+class SQLiteImportDialog(QDialog):
+    def __init__(self, file_name, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("SQLiteデータベースから取り込む")
+        self.file_name = file_name
+        layout = QFormLayout(self)
+
+        self.table_combo = QComboBox()
+        self.table_combo.addItems(sqlite_tables(file_name))
+        self.table_combo.currentTextChanged.connect(self.update_table)
+        layout.addRow("テーブル:", self.table_combo)
+
+        self.column_list = QListWidget()
+        layout.addRow("列:", self.column_list)
+
+        self.where_input = QLineEdit()
+        self.where_input.setPlaceholderText("例: cohort = ? AND value > ?")
+        layout.addRow("WHERE句:", self.where_input)
+
+        self.params_input = QLineEdit()
+        self.params_input.setPlaceholderText("例: 3, 0.5（? に順に割り当てます）")
+        layout.addRow("パラメータ:", self.params_input)
+
+        self.limit_input = QSpinBox()
+        self.limit_input.setRange(0, 2_000_000_000)
+        self.limit_input.setSpecialValueText("制限なし")
+        layout.addRow("最大行数:", self.limit_input)
+
+        self.sample_input = QDoubleSpinBox()
+        self.sample_input.setRange(0.01, 100.0)
+        self.sample_input.setValue(100.0)
+        self.sample_input.setSuffix(" %")
+        layout.addRow("標本抽出率:", self.sample_input)
+
+        self.estimate_label = QLabel()
+        layout.addRow("推定行数:", self.estimate_label)
+        self.limit_input.valueChanged.connect(self.update_estimate)
+        self.sample_input.valueChanged.connect(self.update_estimate)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+        self.update_table(self.table_combo.currentText())
+
+    def update_table(self, table):
+        self.column_list.clear()
+        if not table:
+            return
+        for column in sqlite_columns(self.file_name, table):
+            item = QListWidgetItem(column)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            self.column_list.addItem(item)
+        self.update_estimate()
+
+    def update_estimate(self):
+        options = self.get_options()
+        if not options['table']:
+            self.estimate_label.clear()
+            return
+        estimate = estimate_sqlite_rows(self.file_name, options['table'], options['limit'], options['sample_fraction'])
+        suffix = "（WHERE句による絞り込み前の上限）" if options['where'] else ""
+        self.estimate_label.setText(f"約 {estimate:,} 行{suffix}")
+
+    def get_options(self):
+        items = [self.column_list.item(i) for i in range(self.column_list.count())]
+        columns = [item.text() for item in items if item.checkState() == Qt.Checked]
+        params_text = self.params_input.text().strip()
+        return {
+            'table': self.table_combo.currentText(),
+            'columns': columns if len(columns) < len(items) else None,
+            'where': self.where_input.text().strip() or None,
+            'params': [parse_value(v) for v in params_text.split(',')] if params_text else [],
+            'limit': self.limit_input.value() or None,
+            'sample_fraction': self.sample_input.value() / 100 if self.sample_input.value() < 100 else None,
+        }
+
 
 class DataImportTab(QWidget):
     def __init__(self, on_data_imported_callback):
@@ -18,6 +105,14 @@ class DataImportTab(QWidget):
         self.csv_button.clicked.connect(self.import_csv)
         self.layout.addWidget(self.csv_button)
 
+        self.csv_streaming_button = QPushButton("大容量CSVファイルを分割読み込み (.csv)")
+        self.csv_streaming_button.clicked.connect(self.import_csv_streaming)
+        self.layout.addWidget(self.csv_streaming_button)
+
+        self.columnar_button = QPushButton("Parquet / Featherファイルを選択 (.parquet, .feather, .arrow)")
+        self.columnar_button.clicked.connect(self.import_columnar)
+        self.layout.addWidget(self.columnar_button)
+
         self.clipboard_button = QPushButton("クリップボードからデータを取り込む")
         self.clipboard_button.clicked.connect(self.import_clipboard)
         self.layout.addWidget(self.clipboard_button)
@@ -30,18 +125,34 @@ class DataImportTab(QWidget):
         self.api_button.clicked.connect(self.import_api)
         self.layout.addWidget(self.api_button)
 
-        self.data_preview = QTextEdit()
-        self.data_preview.setReadOnly(True)
+        self.data_preview = DataPreviewWidget()
         self.layout.addWidget(self.data_preview)
 
+        self.worker = None
+        self.progress_dialog = None
+        self.api_client = PaginatedAPIClient()
+
     def import_excel(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "Excelファイルを選択", "", "Excel Files (*.xlsx)")
-        if file_name:
-            try:
-                df = pd.read_excel(file_name)
-                self.process_data(df)
-            except Exception as e:
-                QMessageBox.critical(self, "エラー", f"Excelファイルの読み込み中にエラーが発生しました: {str(e)}")
+        if not file_name:
+            return
+        try:
+            sheets = excel_sheets(file_name)
+        except Exception as e:
+            QMessageBox.critical(self, "エラー", f"Excelファイルの読み込み中にエラーが発生しました: {str(e)}")
+            return
+        sheet_name, ok = QInputDialog.getItem(self, "シートの選択", "読み込むシートを選択してください:", sheets, 0, False)
+        if not ok:
+            return
+        cell_range, ok = QInputDialog.getText(
+            self, "セル範囲", "読み込むセル範囲を入力してください（例: A1:D5000、空欄でシート全体）\n先頭行を列名として扱います")
+        if not ok:
+            return
+        self.run_import_worker(
+            Worker(read_excel_streaming, file_name, sheet_name, cell_range.strip().upper() or None),
+            "Excelファイルを読み込んでいます...",
+            "Excelファイル"
+        )
 
     def import_csv(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "CSVファイルを選択", "", "CSV Files (*.csv)")
@@ -52,6 +163,81 @@ class DataImportTab(QWidget):
             except Exception as e:
                 QMessageBox.critical(self, "エラー", f"CSVファイルの読み込み中にエラーが発生しました: {str(e)}")
 
+    def import_csv_streaming(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "CSVファイルを選択", "", "CSV Files (*.csv)")
+        if file_name:
+            self.run_import_worker(Worker(read_csv_chunked, file_name), "CSVファイルを読み込んでいます...", "CSVファイル")
+
+    def import_columnar(self):
+        file_name, _ = QFileDialog.getOpenFileName(
+            self, "Parquet / Featherファイルを選択", "",
+            "Columnar Files (*.parquet *.feather *.arrow);;Parquet Files (*.parquet);;Feather Files (*.feather *.arrow)"
+        )
+        if not file_name:
+            return
+        try:
+            is_parquet = file_name.lower().endswith('.parquet')
+            if is_parquet:
+                info = parquet_info(file_name)
+                description = f"列: {', '.join(info['columns'])}\n（{info['rows']:,}行、{info['row_groups']}行グループ）"
+            else:
+                description = "空欄の場合はすべての列を読み込みます"
+
+            columns_text, ok = QInputDialog.getText(
+                self, "列の選択", f"読み込む列をカンマ区切りで入力してください（空欄ですべて）\n{description}")
+            if not ok:
+                return
+            filters_text, ok = QInputDialog.getText(
+                self, "行の絞り込み", "条件を入力してください（例: group == A; value > 0、空欄で絞り込みなし）")
+            if not ok:
+                return
+            kwargs = {'columns': parse_columns(columns_text), 'filters': parse_filters(filters_text)}
+
+            if is_parquet:
+                row_groups_text, ok = QInputDialog.getText(
+                    self, "行グループの選択", "読み込む行グループを入力してください（例: 0-3,7、空欄ですべて）")
+                if not ok:
+                    return
+                kwargs['row_groups'] = parse_row_groups(row_groups_text)
+                worker = Worker(read_parquet, file_name, **kwargs)
+            else:
+                worker = Worker(read_feather, file_name, **kwargs)
+        except Exception as e:
+            QMessageBox.critical(self, "エラー", f"ファイルの読み込み設定中にエラーが発生しました: {str(e)}")
+            return
+        self.run_import_worker(worker, "ファイルを読み込んでいます...", "Parquet / Featherファイル")
+
+    def run_import_worker(self, worker, label, source_name):
+        # 読み込みをバックグラウンドで実行し、進捗ダイアログから中止できるようにする
+        self.progress_dialog = QProgressDialog(label, "キャンセル", 0, 100, self)
+        self.progress_dialog.setWindowModality(Qt.WindowModal)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(worker.cancel)
+
+        worker.signals.progress.connect(self.progress_dialog.setValue)
+        worker.signals.finished.connect(self.on_import_finished)
+        worker.signals.error.connect(lambda e: self.on_import_error(e, source_name))
+        self.worker = start_worker(worker)
+
+    def close_progress_dialog(self):
+        if self.progress_dialog is not None:
+            self.progress_dialog.canceled.disconnect()
+            self.progress_dialog.close()
+            self.progress_dialog = None
+        self.worker = None
+
+    def on_import_finished(self, result):
+        self.close_progress_dialog()
+        df, report = result
+        self.process_data(df, report)
+
+    def on_import_error(self, error, source_name):
+        self.close_progress_dialog()
+        if isinstance(error, ImportCancelled):
+            QMessageBox.information(self, "中止", "データの読み込みを中止しました。")
+        else:
+            QMessageBox.critical(self, "エラー", f"{source_name}の読み込み中にエラーが発生しました: {str(error)}")
+
     def import_clipboard(self):
         try:
             df = pd.read_clipboard()
@@ -62,37 +248,51 @@ class DataImportTab(QWidget):
     def import_sqlite(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "SQLiteデータベースを選択", "", "SQLite Files (*.db *.sqlite)")
         if file_name:
-            table_name, ok = QInputDialog.getText(self, "テーブル名", "データを取得するテーブル名を入力してください:")
-            if ok and table_name:
-                try:
-                    conn = sqlite3.connect(file_name)
-                    df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
-                    conn.close()
-                    self.process_data(df)
-                except Exception as e:
-                    QMessageBox.critical(self, "エラー", f"SQLiteデータベースからのデータ取得中にエラーが発生しました: {str(e)}")
+            try:
+                dialog = SQLiteImportDialog(file_name, self)
+                if dialog.exec() != QDialog.Accepted:
+                    return
+                options = dialog.get_options()
+                if not options['table']:
+                    QMessageBox.warning(self, "警告", "テーブルが選択されていません。")
+                    return
+                estimate = estimate_sqlite_rows(file_name, options['table'], options['limit'], options['sample_fraction'])
+            except Exception as e:
+                QMessageBox.critical(self, "エラー", f"SQLiteデータベースからのデータ取得中にエラーが発生しました: {str(e)}")
+                return
+            table = options.pop('table')
+            self.run_import_worker(
+                Worker(read_sqlite, file_name, table, **options),
+                f"SQLiteデータベースから読み込んでいます...（推定 最大{estimate:,}行）",
+                "SQLiteデータベース"
+            )
 
     def import_api(self):
         api_url, ok = QInputDialog.getText(self, "API URL", "データを取得するAPIのURLを入力してください:")
-        if ok and api_url:
-            try:
-                response = requests.get(api_url)
-                data = json.loads(response.text)
-                df = pd.DataFrame(data)
-                self.process_data(df)
-            except Exception as e:
-                QMessageBox.critical(self, "エラー", f"APIからのデータ取得中にエラーが発生しました: {str(e)}")
+        if not (ok and api_url):
+            return
+        modes = {
+            "自動判定（Linkヘッダー / カーソル）": 'auto',
+            "Linkヘッダー": 'link',
+            "カーソル": 'cursor',
+            "オフセット（並列取得）": 'offset',
+            "ページ分割なし": 'none',
+        }
+        mode, ok = QInputDialog.getItem(self, "ページ分割", "ページ分割の方式を選択してください:", list(modes), 0, False)
+        if not ok:
+            return
+        kwargs = {'pagination': modes[mode]}
+        if kwargs['pagination'] == 'offset':
+            page_size, ok = QInputDialog.getInt(self, "ページサイズ", "1ページあたりの件数:", 100, 1, 100000)
+            if not ok:
+                return
+            kwargs['page_size'] = page_size
+        self.run_import_worker(Worker(self.api_client.fetch, api_url, **kwargs), "APIからデータを取得しています...", "API")
 
-    def process_data(self, df):
+    def process_data(self, df, report=None):
         try:
-            # データの基本情報を表示
-            info = f"データ形状: {df.shape}\n\n"
-            info += "列情報:\n"
-            for column in df.columns:
-                info += f"{column}: {df[column].dtype}\n"
-            info += f"\nデータプレビュー:\n{df.head().to_string()}"
-            
-            self.data_preview.setText(info)
+            # データはコピーせずにテーブルモデルから参照して表示する
+            self.data_preview.set_data(df, f"読み込みレポート:\n{report.to_text()}" if report is not None else None)
             self.on_data_imported_callback(df)
             QMessageBox.information(self, "成功", "データが正常にインポートされました。")
         except Exception as e:
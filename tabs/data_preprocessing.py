@@ -1,7 +1,8 @@
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QComboBox, QLabel, QLineEdit, QHBoxLayout, QCheckBox, QMessageBox, QScrollArea
-import pandas as pd
-import numpy as np
-from scipy import stats
+
+from preprocessing import (ENCODING_METHODS, MISSING_METHODS, OUTLIER_METHODS, SCALING_METHODS,
+                           TRANSFORM_METHODS, PreprocessingPipeline)
+from tabs.data_preview import DataPreviewWidget
 
 class DataPreprocessingTab(QWidget):
     def __init__(self, on_data_preprocessed_callback):
@@ -9,6 +10,8 @@ class DataPreprocessingTab(QWidget):
         self.layout = QVBoxLayout(self)
         self.on_data_preprocessed_callback = on_data_preprocessed_callback
         self.data = None
+        # 段階ごとの出力を保持し、変更した段階以降だけを計算し直す
+        self.pipeline = PreprocessingPipeline()
 
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
@@ -17,7 +20,7 @@ class DataPreprocessingTab(QWidget):
 
         # 外れ値処理
         self.outlier_method = QComboBox()
-        self.outlier_method.addItems(["なし", "Z-score", "IQR"])
+        self.outlier_method.addItems(list(OUTLIER_METHODS))
         scroll_layout.addWidget(QLabel("外れ値処理方法:"))
         scroll_layout.addWidget(self.outlier_method)
 
@@ -28,25 +31,25 @@ class DataPreprocessingTab(QWidget):
 
         # 正規化
         self.normalization_method = QComboBox()
-        self.normalization_method.addItems(["なし", "標準化", "最小最大スケーリング"])
+        self.normalization_method.addItems(list(SCALING_METHODS))
         scroll_layout.addWidget(QLabel("正規化方法:"))
         scroll_layout.addWidget(self.normalization_method)
 
         # 欠損値処理
         self.missing_value_method = QComboBox()
-        self.missing_value_method.addItems(["なし", "削除", "平均値で補完", "中央値で補完"])
+        self.missing_value_method.addItems(list(MISSING_METHODS))
         scroll_layout.addWidget(QLabel("欠損値処理方法:"))
         scroll_layout.addWidget(self.missing_value_method)
 
         # カテゴリカルデータのエンコーディング
         self.encoding_method = QComboBox()
-        self.encoding_method.addItems(["なし", "One-hot encoding", "Label encoding"])
+        self.encoding_method.addItems(list(ENCODING_METHODS))
         scroll_layout.addWidget(QLabel("カテゴリカルデータのエンコーディング:"))
         scroll_layout.addWidget(self.encoding_method)
 
         # データ変換
         self.transformation_method = QComboBox()
-        self.transformation_method.addItems(["なし", "対数変換", "平方根変換"])
+        self.transformation_method.addItems(list(TRANSFORM_METHODS))
         scroll_layout.addWidget(QLabel("データ変換:"))
         scroll_layout.addWidget(self.transformation_method)
 
@@ -54,83 +57,70 @@ class DataPreprocessingTab(QWidget):
         self.process_button.clicked.connect(self.preprocess_data)
         scroll_layout.addWidget(self.process_button)
 
+        # 前の段階に戻す
+        revert_layout = QHBoxLayout()
+        self.revert_stage = QComboBox()
+        self.revert_stage.addItems(self.pipeline.history())
+        revert_layout.addWidget(self.revert_stage)
+        self.revert_button = QPushButton("この段階に戻す")
+        self.revert_button.clicked.connect(self.revert_to_stage)
+        revert_layout.addWidget(self.revert_button)
+        scroll_layout.addWidget(QLabel("前処理の段階:"))
+        scroll_layout.addLayout(revert_layout)
+
         scroll_area.setWidget(scroll_content)
         self.layout.addWidget(scroll_area)
 
         # データプレビュー
-        self.data_preview = QTextEdit()
-        self.data_preview.setReadOnly(True)
+        self.data_preview = DataPreviewWidget()
         self.layout.addWidget(QLabel("データプレビュー:"))
         self.layout.addWidget(self.data_preview)
 
     def set_data(self, data):
         self.data = data
+        self.pipeline.set_source(data)
+        self.update_stage_list()
         self.update_data_preview()
 
+    def update_stage_list(self):
+        self.revert_stage.clear()
+        self.revert_stage.addItems(self.pipeline.history())
+        self.revert_stage.setCurrentIndex(self.revert_stage.count() - 1)
+
     def update_data_preview(self):
-        if self.data is not None:
-            preview = f"データ形状: {self.data.shape}\n\n"
-            preview += "列情報:\n"
-            for column in self.data.columns:
-                preview += f"{column}: {self.data[column].dtype}\n"
-            preview += f"\nデータプレビュー:\n{self.data.head().to_string()}"
-            self.data_preview.setText(preview)
-        else:
-            self.data_preview.setText("データがありません")
+        self.data_preview.set_data(self.data)
 
     def preprocess_data(self):
-        if self.data is None:
+        if self.pipeline.source is None:
             QMessageBox.warning(self, "警告", "データが読み込まれていません。")
             return
 
         try:
-            # 外れ値処理
-            outlier_method = self.outlier_method.currentText()
-            if outlier_method != "なし":
-                outlier_threshold = float(self.outlier_threshold.text() or 3.0)
-                if outlier_method == "Z-score":
-                    z_scores = np.abs(stats.zscore(self.data.select_dtypes(include=[np.number])))
-                    self.data = self.data[(z_scores < outlier_threshold).all(axis=1)]
-                elif outlier_method == "IQR":
-                    Q1 = self.data.select_dtypes(include=[np.number]).quantile(0.25)
-                    Q3 = self.data.select_dtypes(include=[np.number]).quantile(0.75)
-                    IQR = Q3 - Q1
-                    self.data = self.data[~((self.data.select_dtypes(include=[np.number]) < (Q1 - outlier_threshold * IQR)) | 
-                                            (self.data.select_dtypes(include=[np.number]) > (Q3 + outlier_threshold * IQR))).any(axis=1)]
-
-            # 正規化
-            normalization_method = self.normalization_method.currentText()
-            if normalization_method == "標準化":
-                self.data.select_dtypes(include=[np.number]) = (self.data.select_dtypes(include=[np.number]) - self.data.select_dtypes(include=[np.number]).mean()) / self.data.select_dtypes(include=[np.number]).std()
-            elif normalization_method == "最小最大スケーリング":
-                self.data.select_dtypes(include=[np.number]) = (self.data.select_dtypes(include=[np.number]) - self.data.select_dtypes(include=[np.number]).min()) / (self.data.select_dtypes(include=[np.number]).max() - self.data.select_dtypes(include=[np.number]).min())
-
-            # 欠損値処理
-            missing_value_method = self.missing_value_method.currentText()
-            if missing_value_method == "削除":
-                self.data = self.data.dropna()
-            elif missing_value_method == "平均値で補完":
-                self.data = self.data.fillna(self.data.mean())
-            elif missing_value_method == "中央値で補完":
-                self.data = self.data.fillna(self.data.median())
-
-            # カテゴリカルデータのエンコーディング
-            encoding_method = self.encoding_method.currentText()
-            if encoding_method == "One-hot encoding":
-                self.data = pd.get_dummies(self.data, columns=self.data.select_dtypes(include=['object', 'category']).columns)
-            elif encoding_method == "Label encoding":
-                for column in self.data.select_dtypes(include=['object', 'category']).columns:
-                    self.data[column] = self.data[column].astype('category').cat.codes
-
-            # データ変換
-            transformation_method = self.transformation_method.currentText()
-            if transformation_method == "対数変換":
-                self.data.select_dtypes(include=[np.number]) = np.log1p(self.data.select_dtypes(include=[np.number]))
-            elif transformation_method == "平方根変換":
-                self.data.select_dtypes(include=[np.number]) = np.sqrt(self.data.select_dtypes(include=[np.number]))
+            # 設定は読み込んだデータに対して毎回まとめて適用する（前回の結果に重ねがけしない）
+            self.data, report = self.pipeline.run(dict(
+                outlier=OUTLIER_METHODS[self.outlier_method.currentText()],
+                threshold=float(self.outlier_threshold.text() or 3.0),
+                scaling=SCALING_METHODS[self.normalization_method.currentText()],
+                missing=MISSING_METHODS[self.missing_value_method.currentText()],
+                encoding=ENCODING_METHODS[self.encoding_method.currentText()],
+                transform=TRANSFORM_METHODS[self.transformation_method.currentText()]
+            ))
+
+            self.update_stage_list()
+            self.update_data_preview()
+            self.on_data_preprocessed_callback(self.data)
+            QMessageBox.information(self, "成功", f"データの前処理が完了しました。\n\n{report.to_text()}")
+        except Exception as e:
+            QMessageBox.critical(self, "エラー", f"データの前処理中にエラーが発生しました: {str(e)}")
 
+    def revert_to_stage(self):
+        if self.pipeline.source is None:
+            QMessageBox.warning(self, "警告", "データが読み込まれていません。")
+            return
+
+        try:
+            self.data = self.pipeline.revert(self.revert_stage.currentIndex())
             self.update_data_preview()
             self.on_data_preprocessed_callback(self.data)
-            QMessageBox.information(self, "成功", "データの前処理が完了しました。")
         except Exception as e:
-            QMessageBox.critical(self, "エラー", f"データの前処理中にエラーが発生しました: {str(e)}")
\ No newline at end of file
+            QMessageBox.critical(self, "エラー", f"前処理の段階を戻す際にエラーが発生しました: {str(e)}")
@@ -0,0 +1,203 @@
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTableView, QHeaderView,
+                               QSplitter, QMessageBox)
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+import operator
+import numpy as np
+import pandas as pd
+
+from columnar_io import parse_filters
+
+FILTER_FUNCTIONS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+                    '>': operator.gt, '>=': operator.ge}
+
+
+def column_summary(df):
+    # 列ごとの型・欠損数・メモリ量をまとめて計算する（列ごとのループで Series を作らない）
+    rows = len(df)
+    nulls = rows - df.count()
+    memory = df.memory_usage(index=False, deep=True)
+    return pd.DataFrame({
+        '列名': [str(column) for column in df.columns],
+        '型': [str(dtype) for dtype in df.dtypes],
+        '欠損数': nulls.to_numpy(),
+        '欠損率': nulls.to_numpy() / rows if rows else np.zeros(len(df.columns)),
+        'メモリ (KB)': memory.to_numpy() / 1024,
+    })
+
+
+def format_value(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def _sort_keys(series):
+    # NaN を末尾に並べられる数値キーを作る
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    codes, _ = pd.factorize(series, sort=True)
+    return np.where(codes < 0, np.iinfo(codes.dtype).max, codes)
+
+
+def _numeric_columns(df):
+    # 右寄せにする列。セルごとに df.dtypes を作り直すと列の多い表のスクロールが遅くなるので、最初に一度だけ求める
+    return np.array([pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes], dtype=bool)
+
+
+class DataFrameModel(QAbstractTableModel):
+    # DataFrame を参照するだけのモデル。表示するセルだけをその都度取り出し、
+    # 並べ替えと絞り込みは行番号の配列（self.rows）を入れ替えて表現する。
+    def __init__(self, df=None, parent=None):
+        super().__init__(parent)
+        self.df = pd.DataFrame() if df is None else df
+        self.rows = np.arange(len(self.df))
+        self.filter_mask = None
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+        self._arrays = {}
+        self.numeric = _numeric_columns(self.df)
+
+    def set_frame(self, df):
+        self.beginResetModel()
+        self.df = df
+        self.rows = np.arange(len(df))
+        self.filter_mask = None
+        self.sort_column = None
+        self._arrays = {}
+        self.numeric = _numeric_columns(df)
+        self.endResetModel()
+
+    def _array(self, column):
+        # 列の値はコピーせずに保持する（.array は元の列のバッファを参照する）
+        array = self._arrays.get(column)
+        if array is None:
+            array = self._arrays[column] = self.df.iloc[:, column].array
+        return array
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.df.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return format_value(self._array(index.column())[self.rows[index.row()]])
+        if role == Qt.TextAlignmentRole and self.numeric[index.column()]:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self.df.columns[section])
+        return str(self.df.index[self.rows[section]])
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        # 列が -1（並べ替えなし）の場合は元の順序に戻す
+        self.sort_column = column if 0 <= column < len(self.df.columns) else None
+        self.sort_order = order
+        self._apply()
+        self.layoutChanged.emit()
+
+    def set_filter(self, filters):
+        # filters は columnar_io.parse_filters と同じ (列, 演算子, 値) のリスト
+        self.beginResetModel()
+        mask = None
+        for column, op, value in filters:
+            series = self.df[column]
+            if op == 'in':
+                condition = series.isin(value)
+            else:
+                if isinstance(value, str) and pd.api.types.is_numeric_dtype(series.dtype):
+                    raise ValueError(f"列 '{column}' は数値列です: {value}")
+                condition = FILTER_FUNCTIONS[op](series, value)
+            condition = condition.to_numpy(dtype=bool, na_value=False)
+            mask = condition if mask is None else mask & condition
+        self.filter_mask = mask
+        self._apply()
+        self.endResetModel()
+
+    def _apply(self):
+        rows = np.arange(len(self.df)) if self.filter_mask is None else np.flatnonzero(self.filter_mask)
+        if self.sort_column is not None:
+            keys = _sort_keys(self.df.iloc[:, self.sort_column])[rows]
+            order = np.argsort(keys, kind='stable')
+            if self.sort_order == Qt.DescendingOrder:
+                # 欠損値は降順でも末尾に置く
+                missing = np.isnan(keys[order]) if keys.dtype.kind == 'f' else keys[order] == np.iinfo(keys.dtype).max
+                order = np.concatenate([order[~missing][::-1], order[missing]])
+            rows = rows[order]
+        self.rows = rows
+
+
+def _fixed_header(view):
+    # 行・列が非常に多くても、セルの大きさを測り直さない
+    view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+    view.verticalHeader().setDefaultSectionSize(22)
+    view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+    view.horizontalHeader().setDefaultSectionSize(110)
+
+
+class DataPreviewWidget(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+
+        self.info_label = QLabel("データがありません")
+        self.info_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.layout.addWidget(self.info_label)
+
+        filter_layout = QHBoxLayout()
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("絞り込み（例: group == A; value > 3）")
+        self.filter_input.returnPressed.connect(self.apply_filter)
+        filter_layout.addWidget(self.filter_input)
+        self.filter_button = QPushButton("絞り込み")
+        self.filter_button.clicked.connect(self.apply_filter)
+        filter_layout.addWidget(self.filter_button)
+        self.layout.addLayout(filter_layout)
+
+        splitter = QSplitter(Qt.Vertical)
+        self.model = DataFrameModel(parent=self)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        _fixed_header(self.table_view)
+        splitter.addWidget(self.table_view)
+
+        self.summary_model = DataFrameModel(parent=self)
+        self.summary_view = QTableView()
+        self.summary_view.setModel(self.summary_model)
+        self.summary_view.setSortingEnabled(True)
+        _fixed_header(self.summary_view)
+        splitter.addWidget(self.summary_view)
+        splitter.setSizes([300, 150])
+        self.layout.addWidget(splitter)
+
+    def set_data(self, df, info=None):
+        if df is None:
+            self.model.set_frame(pd.DataFrame())
+            self.summary_model.set_frame(pd.DataFrame())
+            self.info_label.setText("データがありません")
+            return
+        self.model.set_frame(df)
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.summary_model.set_frame(column_summary(df))
+        text = f"データ形状: {df.shape}　メモリ: {df.memory_usage(index=True, deep=False).sum() / 1024 / 1024:,.1f} MB"
+        self.info_label.setText(f"{info}\n{text}" if info else text)
+        self.filter_input.clear()
+
+    def apply_filter(self):
+        try:
+            self.model.set_filter(parse_filters(self.filter_input.text()))
+        except Exception as e:
+            QMessageBox.warning(self, "警告", f"絞り込み条件を適用できません: {str(e)}")
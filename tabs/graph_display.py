@@ -1,107 +1,246 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QComboBox
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QSpinBox
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 import seaborn as sns
 import pandas as pd
-import matplotlib.pyplot as plt
 from scipy import stats
 import numpy as np
 
+from pair_plot import draw_pair_plot
+from fast_kde import plot_kde, plot_violin
+from correlation import plot_correlation_heatmap
+from graph_lod import LOD_THRESHOLD, DensityScatter, MinMaxLines, group_series, retained_bytes
+from result_cache import ResultCache, fingerprint
+
+GRAPH_TYPES = [
+    "棒グラフ", "箱ひげグラフ", "バイオリンプロット", "散布図",
+    "ヒストグラム", "カーネル密度推定", "ヒートマップ", "ペアプロット",
+    "折れ線グラフ", "面グラフ", "円グラフ", "レーダーチャート"
+]
+
+# タイトル・軸ラベルだけの変更は、描画済みの Figure の文字を書き換えるだけで済ませる
+LABEL_KEYS = ('graph_name', 'x_axis_name', 'y_axis_name')
+FIGURE_CACHE_ENTRIES = 24
+FIGURE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def figure_params(customization, lod_threshold):
+    params = {key: value for key, value in (customization or {}).items() if key not in LABEL_KEYS}
+    params['lod_threshold'] = lod_threshold
+    return params
+
+
+def figure_bytes(figure):
+    # 描画バッファ + 各アーティストが保持する配列のおおよその量
+    width, height = figure.get_size_inches() * figure.dpi
+    total = int(width * height * 4) + retained_bytes(figure)
+    for ax in figure.axes:
+        for artist in ax.get_children():
+            for getter in ('get_xydata', 'get_offsets', 'get_array'):
+                values = getattr(artist, getter, lambda: None)()
+                if isinstance(values, np.ndarray):
+                    total += values.nbytes
+            for path in getattr(artist, 'get_paths', lambda: [])():
+                total += path.vertices.nbytes
+    return total
+
+
+def draw_graph(ax, data, graph_type, lod_threshold=LOD_THRESHOLD):
+    # 点数が多い散布図・折れ線・面グラフは、表示範囲ごとに集約して描く（拡大すると集約し直す）
+    large = lod_threshold is not None and len(data) > lod_threshold
+    if graph_type == "棒グラフ":
+        sns.barplot(x='group', y='value', data=data, ax=ax)
+    elif graph_type == "箱ひげグラフ":
+        sns.boxplot(x='group', y='value', data=data, ax=ax)
+    elif graph_type == "バイオリンプロット":
+        # 格子に集約した FFT の KDE を使う（カーネル密度推定と同じ計算結果を共有する）
+        plot_violin(ax, data)
+    elif graph_type == "散布図" and large:
+        DensityScatter(ax, data['x'].to_numpy(), data['y'].to_numpy())
+    elif graph_type == "散布図":
+        sns.scatterplot(x='x', y='y', hue='group', data=data, ax=ax)
+    elif graph_type == "ヒストグラム":
+        sns.histplot(data=data, x='value', hue='group', element="step", stat="density", common_norm=False, ax=ax)
+    elif graph_type == "カーネル密度推定":
+        plot_kde(ax, data)
+    elif graph_type == "ヒートマップ":
+        # 数値列の相関行列を列ブロックごとに計算し、データごとにキャッシュしたものを使う
+        plot_correlation_heatmap(ax, data)
+    elif graph_type in ("折れ線グラフ", "面グラフ") and large:
+        MinMaxLines(ax, group_series(data, 'x', 'value'), area=graph_type == "面グラフ")
+    elif graph_type == "折れ線グラフ":
+        sns.lineplot(x='x', y='value', hue='group', data=data, ax=ax)
+    elif graph_type == "面グラフ":
+        data.pivot(index='x', columns='group', values='value').plot(kind='area', stacked=False, ax=ax)
+    elif graph_type == "円グラフ":
+        data.groupby('group')['value'].sum().plot(kind='pie', autopct='%1.1f%%', ax=ax)
+    elif graph_type == "レーダーチャート":
+        plot_radar_chart(ax, data)
+    else:
+        ax.text(0.5, 0.5, "選択されたグラフタイプはサポートされていません", ha='center', va='center')
+
+
+def apply_labels(ax, test_type, graph_type, customization=None):
+    customization = customization or {}
+    ax.set_title(customization.get('graph_name') or f"{test_type} - {graph_type}")
+    ax.set_xlabel(customization.get('x_axis_name') or "グループ")
+    ax.set_ylabel(customization.get('y_axis_name') or "値")
+
+
+def apply_figure_labels(figure, test_type, graph_type, customization=None):
+    # ペアプロットは複数のパネルからなるので、タイトルを Figure 全体に付ける
+    if graph_type == "ペアプロット":
+        customization = customization or {}
+        figure.suptitle(customization.get('graph_name') or f"{test_type} - {graph_type}")
+    elif figure.axes:
+        apply_labels(figure.axes[0], test_type, graph_type, customization)
+
+
+def render_figure(data, test_type, graph_type, customization=None, figsize=(8, 6), dpi=100,
+                  lod_threshold=LOD_THRESHOLD):
+    # Qt に依存しない Figure に描画するので、ワーカースレッドからも呼び出せる
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    try:
+        if graph_type == "ペアプロット":
+            draw_pair_plot(figure, data)
+        else:
+            ax = figure.add_subplot(111, projection='polar' if graph_type == "レーダーチャート" else None)
+            draw_graph(ax, data, graph_type, lod_threshold)
+        apply_figure_labels(figure, test_type, graph_type, customization)
+    except Exception as e:
+        figure.clear()
+        ax = figure.add_subplot(111)
+        ax.text(0.5, 0.5, f"グラフの作成中にエラーが発生しました:\n{str(e)}", ha='center', va='center', wrap=True)
+    return figure
+
+
+def plot_radar_chart(ax, data):
+    # Prepare the data for radar chart
+    grouped_data = data.groupby('group')['value'].mean().reset_index()
+    values = grouped_data['value'].values
+    groups = grouped_data['group'].values
+
+    # Number of variables
+    num_vars = len(values)
+
+    # Compute angle for each variable
+    angles = np.linspace(0, 2 * np.pi, num_vars, endpoint=False).tolist()
+    values = np.concatenate((values, [values[0]]))  # complete the loop
+    angles += angles[:1]  # complete the loop
+
+    # Plot
+    ax.plot(angles, values, 'o-', linewidth=2)
+    ax.fill(angles, values, alpha=0.25)
+    ax.set_xticks(angles[:-1])
+    ax.set_xticklabels(groups)
+
+
 class GraphDisplayTab(QWidget):
     def __init__(self):
         super().__init__()
         self.layout = QVBoxLayout(self)
 
         self.graph_type_combo = QComboBox()
-        self.graph_type_combo.addItems([
-            "棒グラフ", "箱ひげグラフ", "バイオリンプロット", "散布図",
-            "ヒストグラム", "カーネル密度推定", "ヒートマップ", "ペアプロット",
-            "折れ線グラフ", "面グラフ", "円グラフ", "レーダーチャート"
-        ])
+        self.graph_type_combo.addItems(GRAPH_TYPES)
         self.graph_type_combo.currentIndexChanged.connect(self.update_graph)
         self.layout.addWidget(QLabel("グラフタイプ:"))
         self.layout.addWidget(self.graph_type_combo)
 
+        lod_layout = QHBoxLayout()
+        lod_layout.addWidget(QLabel("集約表示に切り替える点数:"))
+        self.lod_threshold_spin = QSpinBox()
+        self.lod_threshold_spin.setRange(1000, 100_000_000)
+        self.lod_threshold_spin.setSingleStep(50_000)
+        self.lod_threshold_spin.setValue(LOD_THRESHOLD)
+        self.lod_threshold_spin.editingFinished.connect(self.update_graph)
+        lod_layout.addWidget(self.lod_threshold_spin)
+        self.layout.addLayout(lod_layout)
+
         self.figure = Figure(figsize=(8, 6), dpi=100)
         self.canvas = FigureCanvas(self.figure)
+        # 拡大・移動すると、集約表示のグラフは表示範囲で集約し直される
+        self.toolbar = NavigationToolbar(self.canvas, self)
+        self.layout.addWidget(self.toolbar)
         self.layout.addWidget(self.canvas)
 
         self.data = None
+        self.data_key = None
         self.test_type = None
+        self.customization = {}
+        # データ・グラフの種類・（ラベル以外の）カスタマイズごとに描画済みの Figure を保持する
+        self.figure_cache = ResultCache(max_entries=FIGURE_CACHE_ENTRIES, max_bytes=FIGURE_CACHE_BYTES,
+                                        sizeof=figure_bytes)
 
     def set_data(self, data, test_type):
+        self.set_graph_state(data, test_type, self.customization)
+        self.update_graph()
+
+    def resolve_graph_type(self, graph_type=None):
+        # グラフ選択タブの種類がこのタブにもあれば切り替え、なければ現在の種類を使う
+        if graph_type in GRAPH_TYPES and graph_type != self.graph_type_combo.currentText():
+            self.graph_type_combo.blockSignals(True)
+            self.graph_type_combo.setCurrentText(graph_type)
+            self.graph_type_combo.blockSignals(False)
+        return self.graph_type_combo.currentText()
+
+    def set_graph_state(self, data, test_type, customization=None, data_key=None):
+        # data_key にはフィンガープリントを持つオブジェクト（GroupedData）を渡せる。
+        # 渡されなければ、最初にキャッシュを引くときに一度だけ計算する
+        if data is not self.data or data_key is not None:
+            self.data_key = data_key
         self.data = data
         self.test_type = test_type
+        self.customization = customization or {}
+
+    def cache_key_source(self):
+        if self.data_key is None:
+            self.data_key = fingerprint(self.data)
+        return self.data_key
+
+    def plot_graph(self, data, test_type, graph_type=None, customization=None):
+        self.set_graph_state(data, test_type, customization)
+        self.resolve_graph_type(graph_type)
         self.update_graph()
+        return self.figure
 
     def update_graph(self):
         if self.data is None:
             return
-
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-
         graph_type = self.graph_type_combo.currentText()
-
-        try:
-            if graph_type == "棒グラフ":
-                sns.barplot(x='group', y='value', data=self.data, ax=ax)
-            elif graph_type == "箱ひげグラフ":
-                sns.boxplot(x='group', y='value', data=self.data, ax=ax)
-            elif graph_type == "バイオリンプロット":
-                sns.violinplot(x='group', y='value', data=self.data, ax=ax)
-            elif graph_type == "散布図":
-                sns.scatterplot(x='x', y='y', hue='group', data=self.data, ax=ax)
-            elif graph_type == "ヒストグラム":
-                sns.histplot(data=self.data, x='value', hue='group', element="step", stat="density", common_norm=False, ax=ax)
-            elif graph_type == "カーネル密度推定":
-                sns.kdeplot(data=self.data, x='value', hue='group', shade=True, ax=ax)
-            elif graph_type == "ヒートマップ":
-                sns.heatmap(self.data.corr(), annot=True, cmap='coolwarm', ax=ax)
-            elif graph_type == "ペアプロット":
-                sns.pairplot(self.data, hue='group', height=2.5)
-                plt.close()  # Close the seaborn figure
-                self.canvas.draw()
-                return
-            elif graph_type == "折れ線グラフ":
-                sns.lineplot(x='x', y='value', hue='group', data=self.data, ax=ax)
-            elif graph_type == "面グラフ":
-                self.data.pivot(index='x', columns='group', values='value').plot(kind='area', stacked=False, ax=ax)
-            elif graph_type == "円グラフ":
-                self.data.groupby('group')['value'].sum().plot(kind='pie', autopct='%1.1f%%', ax=ax)
-            elif graph_type == "レーダーチャート":
-                self.plot_radar_chart(ax)
-            else:
-                ax.text(0.5, 0.5, "選択されたグラフタイプはサポートされていません", ha='center', va='center')
-
-            ax.set_title(f"{self.test_type} - {graph_type}")
-            ax.set_xlabel("グループ")
-            ax.set_ylabel("値")
-
-            self.canvas.draw()
-        except Exception as e:
-            print(f"グラフの作成中にエラーが発生しました: {str(e)}")
-
-    def plot_radar_chart(self, ax):
-        # Prepare the data for radar chart
-        grouped_data = self.data.groupby('group')['value'].mean().reset_index()
-        values = grouped_data['value'].values
-        groups = grouped_data['group'].values
-
-        # Number of variables
-        num_vars = len(values)
-
-        # Compute angle for each variable
-        angles = np.linspace(0, 2 * np.pi, num_vars, endpoint=False).tolist()
-        values = np.concatenate((values, [values[0]]))  # complete the loop
-        angles += angles[:1]  # complete the loop
-
-        # Plot
-        ax.polar(angles, values, 'o-', linewidth=2)
-        ax.fill(angles, values, alpha=0.25)
-        ax.set_xticks(angles[:-1])
-        ax.set_xticklabels(groups)
+        lod_threshold = self.lod_threshold()
+        figure = self.figure_cache.get_or_compute(
+            ("figure", graph_type),
+            self.cache_key_source(),
+            lambda: render_figure(self.data, self.test_type, graph_type, self.customization,
+                                  lod_threshold=lod_threshold),
+            figure_params(self.customization, lod_threshold)
+        )
+        self.show_graph(figure, graph_type)
+
+    def show_graph(self, figure, graph_type):
+        # キャッシュから取り出した Figure は、ラベルだけ描画したときの種類と現在の設定に書き換えて表示する。
+        # 描画中に種類が切り替えられていても、コンボボックスは再描画させずに Figure の種類へ戻す
+        graph_type = self.resolve_graph_type(graph_type)
+        apply_figure_labels(figure, self.test_type, graph_type, self.customization)
+        self.show_figure(figure)
+
+    def lod_threshold(self):
+        return self.lod_threshold_spin.value()
+
+    def show_figure(self, figure):
+        # 別スレッドで描画した Figure をキャンバスに差し替える
+        figure.set_dpi(self.figure.dpi)
+        figure.set_size_inches(self.figure.get_size_inches())
+        self.figure = figure
+        self.canvas.figure = figure
+        figure.set_canvas(self.canvas)
+        # ツールバーの拡大・移動の履歴は前の Figure のものなので消す
+        self.toolbar.update()
+        self.canvas.draw_idle()
 
     def clear_graph(self):
         self.figure.clear()
-        self.canvas.draw()
\ No newline at end of file
+        self.canvas.draw()
@@ -1,4 +1,4 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QTextEdit
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QTextEdit, QComboBox
 
 class PostHocTab(QWidget):
     def __init__(self, on_post_hoc_test_callback):
@@ -11,6 +11,13 @@ class PostHocTab(QWidget):
             "Holm法", "Scheffe法", "Games-Howell法"
         ]
 
+        control_layout = QHBoxLayout()
+        control_layout.addWidget(QLabel("Dunnett検定の対照群:"))
+        self.control_combo = QComboBox()
+        control_layout.addWidget(self.control_combo)
+        control_layout.addStretch()
+        self.layout.addLayout(control_layout)
+
         self.create_post_hoc_buttons()
 
         self.result_label = QLabel("Post Hoc検定結果:")
@@ -29,6 +36,17 @@ class PostHocTab(QWidget):
     def run_post_hoc(self, test):
         self.on_post_hoc_test_callback(test)
 
+    def set_groups(self, labels):
+        # データが変わったら対照群の候補を入れ替える（同じグループがあれば選択を保つ）
+        current = self.control_combo.currentText()
+        self.control_combo.clear()
+        self.control_combo.addItems([str(label) for label in labels])
+        if current in labels:
+            self.control_combo.setCurrentText(current)
+
+    def control_group(self):
+        return self.control_combo.currentText() or None
+
     def update_results(self, results):
         self.result_text.setText(results)
 
@@ -1,4 +1,4 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QTextEdit, QScrollArea
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QScrollArea, QProgressBar, QPushButton
 
 class StatisticalResultsTab(QWidget):
     def __init__(self):
@@ -19,6 +19,15 @@ class StatisticalResultsTab(QWidget):
         self.significance_label = QLabel()
         self.layout.addWidget(self.significance_label)
 
+        progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        progress_layout.addWidget(self.progress_bar)
+        self.cancel_button = QPushButton("中止")
+        progress_layout.addWidget(self.cancel_button)
+        self.layout.addLayout(progress_layout)
+        self.set_running(False)
+
     def update_results(self, results, is_significant):
         self.result_text.setPlainText(results)
         if is_significant:
@@ -26,6 +35,17 @@ class StatisticalResultsTab(QWidget):
         else:
             self.significance_label.setText("有意差なし (p ≥ 0.05)")
 
+    def set_running(self, running, message="検定を実行中..."):
+        self.progress_bar.setVisible(running)
+        self.cancel_button.setVisible(running)
+        self.progress_bar.setValue(0)
+        if running:
+            self.progress_bar.setFormat(f"{message} %p%")
+            self.significance_label.clear()
+
+    def update_progress(self, value):
+        self.progress_bar.setValue(value)
+
     def clear_results(self):
         self.result_text.clear()
         self.significance_label.clear()
\ No newline at end of file
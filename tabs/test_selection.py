@@ -1,7 +1,17 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, QPushButton, QScrollArea
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, QPushButton, QScrollArea, QCheckBox,
+                               QLabel, QSpinBox, QComboBox)
+from PySide6.QtCore import Qt, Signal
+
+from mass_testing import MASS_TESTS
+from multiple_testing import CORRECTION_METHODS
+from resampling import BOOTSTRAP_COUNT, PERMUTATION_COUNT
 
 class TestSelectionTab(QWidget):
+    # p 値の計算方法が変わったときに通知する
+    options_changed = Signal()
+    # 一括検定の実行を要求する（検定名、補正方法の表示名）
+    mass_test_requested = Signal(str, str)
+
     def __init__(self, on_test_selected_callback):
         super().__init__()
         self.layout = QVBoxLayout(self)
@@ -24,9 +34,88 @@ class TestSelectionTab(QWidget):
         ])
         scroll_layout.addWidget(nonparametric_group)
 
+        scroll_layout.addWidget(self.create_options_group())
+        scroll_layout.addWidget(self.create_mass_test_group())
+
         scroll.setWidget(content)
         self.layout.addWidget(scroll)
 
+    def create_options_group(self):
+        group = QGroupBox("p値の計算方法")
+        group_layout = QVBoxLayout()
+
+        self.permutation_check = QCheckBox("並べ替え検定（permutation test）でもp値を求める")
+        self.permutation_check.setToolTip("t検定・分散分析・Mann-Whitney U・Wilcoxon・Kruskal-Wallis検定で利用できます")
+        self.permutation_check.toggled.connect(self.on_options_changed)
+        group_layout.addWidget(self.permutation_check)
+
+        count_layout = QHBoxLayout()
+        count_layout.addWidget(QLabel("並べ替えの回数（上限）:"))
+        self.permutation_count = QSpinBox()
+        self.permutation_count.setRange(1000, 1_000_000)
+        self.permutation_count.setSingleStep(1000)
+        self.permutation_count.setValue(PERMUTATION_COUNT)
+        self.permutation_count.setToolTip("有意水準に対する判定が確定した時点で早期終了します")
+        self.permutation_count.editingFinished.connect(self.on_options_changed)
+        count_layout.addWidget(self.permutation_count)
+        count_layout.addWidget(QLabel("乱数シード:"))
+        self.permutation_seed = QSpinBox()
+        self.permutation_seed.setRange(0, 2_147_483_647)
+        self.permutation_seed.editingFinished.connect(self.on_options_changed)
+        count_layout.addWidget(self.permutation_seed)
+        group_layout.addLayout(count_layout)
+
+        self.bootstrap_check = QCheckBox("ブートストラップ信頼区間（平均値・中央値の差、効果量）を求める")
+        self.bootstrap_check.setToolTip("パーセンタイル法とBCa法の信頼区間を検定結果に追加します")
+        self.bootstrap_check.toggled.connect(self.on_options_changed)
+        group_layout.addWidget(self.bootstrap_check)
+
+        resample_layout = QHBoxLayout()
+        resample_layout.addWidget(QLabel("ブートストラップの回数:"))
+        self.bootstrap_count = QSpinBox()
+        self.bootstrap_count.setRange(1000, 1_000_000)
+        self.bootstrap_count.setSingleStep(1000)
+        self.bootstrap_count.setValue(BOOTSTRAP_COUNT)
+        self.bootstrap_count.editingFinished.connect(self.on_options_changed)
+        resample_layout.addWidget(self.bootstrap_count)
+        resample_layout.addStretch()
+        group_layout.addLayout(resample_layout)
+
+        group.setLayout(group_layout)
+        return group
+
+    def create_mass_test_group(self):
+        group = QGroupBox("一括検定（group 以外のすべての数値列）")
+        group_layout = QHBoxLayout()
+        group_layout.addWidget(QLabel("検定:"))
+        self.mass_test_combo = QComboBox()
+        self.mass_test_combo.addItems(list(MASS_TESTS))
+        group_layout.addWidget(self.mass_test_combo)
+        group_layout.addWidget(QLabel("多重比較の補正:"))
+        self.correction_combo = QComboBox()
+        self.correction_combo.addItems(list(CORRECTION_METHODS))
+        group_layout.addWidget(self.correction_combo)
+        self.mass_test_button = QPushButton("一括検定を実行")
+        self.mass_test_button.clicked.connect(self.on_mass_test_clicked)
+        group_layout.addWidget(self.mass_test_button)
+        group.setLayout(group_layout)
+        return group
+
+    def on_mass_test_clicked(self):
+        self.mass_test_requested.emit(self.mass_test_combo.currentText(), self.correction_combo.currentText())
+
+    def get_test_options(self):
+        return {
+            'permutation': self.permutation_check.isChecked(),
+            'permutations': self.permutation_count.value(),
+            'bootstrap': self.bootstrap_check.isChecked(),
+            'resamples': self.bootstrap_count.value(),
+            'seed': self.permutation_seed.value(),
+        }
+
+    def on_options_changed(self, *args):
+        self.options_changed.emit()
+
     def create_test_group(self, title, tests):
         group = QGroupBox(title)
         group_layout = QVBoxLayout()
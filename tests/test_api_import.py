@@ -0,0 +1,132 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from api_import import PaginatedAPIClient, ResponseCache
+
+ROWS = [{'id': i, 'value': i * 0.5} for i in range(237)]
+PAGE_SIZE = 50
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # ローカルで API の代わりをするサーバー。オフセット・カーソル・Link ヘッダーの 3 方式でページを返し、
+    # ETag が一致すれば 304 を返す
+    def do_GET(self):
+        parts = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        headers = {}
+        if parts.path == '/offset':
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', PAGE_SIZE))
+            payload = {'data': ROWS[offset:offset + limit], 'total': len(ROWS)}
+        elif parts.path == '/cursor':
+            position = int(query.get('cursor', 0))
+            following = position + PAGE_SIZE
+            payload = {'results': ROWS[position:following],
+                       'next_cursor': str(following) if following < len(ROWS) else None}
+        elif parts.path == '/link':
+            page = int(query.get('page', 0))
+            payload = ROWS[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+            if (page + 1) * PAGE_SIZE < len(ROWS):
+                host, port = self.server.server_address[:2]
+                headers['Link'] = f'<http://{host}:{port}/link?page={page + 1}>; rel="next"'
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps(payload).encode('utf-8')
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        with self.server.lock:
+            self.server.requests.append(self.path)
+        if self.headers.get('If-None-Match') == etag:
+            with self.server.lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.not_modified = 0
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _url(server, path):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{path}"
+
+
+@pytest.mark.parametrize('path, pagination', [
+    ('/offset', 'offset'),
+    ('/cursor', 'cursor'),
+    ('/cursor', 'auto'),
+    ('/link', 'link'),
+    ('/link', 'auto'),
+])
+def test_all_rows_returned_once_in_order(server, tmp_path, path, pagination):
+    client = PaginatedAPIClient(cache_dir=str(tmp_path), max_workers=4)
+    df, _ = client.fetch(_url(server, path), pagination=pagination, page_size=PAGE_SIZE)
+
+    assert df['id'].tolist() == [row['id'] for row in ROWS]
+    assert df['value'].tolist() == [row['value'] for row in ROWS]
+
+
+def test_offset_pages_fetched_in_parallel_without_total(server, tmp_path, monkeypatch):
+    # 総件数がない場合も短いページで止まり、先読みした空のページは結果に入らない
+    monkeypatch.setattr('api_import.TOTAL_KEYS', ())
+    client = PaginatedAPIClient(cache_dir=None, max_workers=3)
+    df, _ = client.fetch(_url(server, '/offset'), pagination='offset', page_size=PAGE_SIZE)
+
+    assert df['id'].tolist() == [row['id'] for row in ROWS]
+
+
+@pytest.mark.parametrize('path, pagination', [('/offset', 'offset'), ('/cursor', 'cursor'), ('/link', 'link')])
+def test_etag_revalidation_reuses_cached_pages(server, tmp_path, path, pagination):
+    url = _url(server, path)
+    first, _ = PaginatedAPIClient(cache_dir=str(tmp_path)).fetch(url, pagination=pagination, page_size=PAGE_SIZE)
+    pages = len(server.requests)
+    assert server.not_modified == 0
+
+    second, report = PaginatedAPIClient(cache_dir=str(tmp_path)).fetch(url, pagination=pagination,
+                                                                       page_size=PAGE_SIZE)
+
+    assert server.not_modified == pages
+    assert second.equals(first)
+    assert any(f"キャッシュ利用 {pages}" in note for note in report.notes)
+
+
+def test_response_cache_keeps_link_header(server, tmp_path):
+    url = _url(server, '/link')
+    PaginatedAPIClient(cache_dir=str(tmp_path)).fetch_page(url)
+    meta, body = ResponseCache(str(tmp_path)).load(url)
+
+    assert 'rel="next"' in meta['link']
+    assert json.loads(body) == ROWS[:PAGE_SIZE]
+    page = PaginatedAPIClient(cache_dir=str(tmp_path), cache_max_age=3600).fetch_page(url)
+    assert page.from_cache
+    assert page.links['next']['url'].endswith('/link?page=1')
@@ -0,0 +1,75 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import streaming_stats
+
+
+def _frame_with_missing_group():
+    # 整数のグループ列で、最後のチャンクにだけグループが空のセルがある（そのチャンクは float として読まれる）
+    rng = np.random.default_rng(0)
+    groups = np.tile([1, 2, 1], 2000).astype(object)
+    groups[5500] = None
+    return pd.DataFrame({'group': groups, 'value': rng.normal(size=6000), 'covariate': rng.normal(size=6000)})
+
+
+def _expected(frame):
+    clean = frame.dropna(subset=['group'])
+    return [clean.loc[clean['group'] == label, 'value'] for label in (1, 2)]
+
+
+def _write(frame, tmp_path, kind):
+    if kind == 'csv':
+        path = tmp_path / 'data.csv'
+        frame.to_csv(path, index=False)
+        return {'path': str(path)}
+    if kind == 'sqlite':
+        path = tmp_path / 'data.db'
+        with sqlite3.connect(path) as conn:
+            frame.astype({'group': 'Int64'}).to_sql('data', conn, index=False)
+        conn.close()
+        return {'path': str(path), 'table': 'data'}
+    path = tmp_path / 'data.parquet'
+    frame.astype({'group': 'Int64'}).to_parquet(path, row_group_size=1000)
+    return {'path': str(path)}
+
+
+@pytest.mark.parametrize('kind', ['csv', 'sqlite', 'parquet'])
+def test_missing_group_cell_does_not_split_groups(tmp_path, kind):
+    frame = _frame_with_missing_group()
+    source = _write(frame, tmp_path, kind)
+    moments = streaming_stats.GroupMoments()
+    for partition in streaming_stats.partition_source(source):
+        moments.merge(streaming_stats.accumulate_partition(partition, chunksize=1000))
+
+    assert moments.labels == ['1', '2']
+    group1, group2 = _expected(frame)
+    assert moments.n.tolist() == [len(group1), len(group2)]
+    t_stat, p_value, _ = streaming_stats.t_test(moments)
+    expected = stats.ttest_ind(group1, group2)
+    assert t_stat == pytest.approx(expected.statistic, rel=1e-9)
+    assert p_value == pytest.approx(expected.pvalue, rel=1e-9)
+
+
+def test_missing_group_cell_in_rank_runs(tmp_path):
+    frame = _frame_with_missing_group()
+    source = _write(frame, tmp_path, 'csv')
+    partition = streaming_stats.partition_source(source)[0]
+    runs = streaming_stats.sort_partition(partition, 0, str(tmp_path), chunksize=1000)
+    assert {label for _, _, labels in runs for label in labels} == {'1', '2'}
+
+    result, _ = streaming_stats.run_streaming_test("Mann-Whitney U検定", source, workers=1)
+    group1, group2 = _expected(frame)
+    expected = stats.mannwhitneyu(group1, group2)
+    assert f"U統計量: {expected.statistic:.4f}" in result
+    assert f"p値: {expected.pvalue:.4f}" in result
+
+
+def test_label_normalizes_integral_floats():
+    assert streaming_stats._label(2.0) == '2'
+    assert streaming_stats._label(np.float64(3.0)) == '3'
+    assert streaming_stats._label(2.5) == '2.5'
+    assert streaming_stats._label('a') == 'a'
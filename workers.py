@@ -0,0 +1,47 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(object)
+    error = Signal(object)
+
+
+class Worker(QRunnable):
+    # 関数をスレッドプールで実行し、結果を Qt のシグナルで GUI スレッドに返す。
+    # 関数には progress_callback と is_cancelled がキーワード引数として渡される。
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def run(self):
+        try:
+            result = self.fn(
+                *self.args,
+                progress_callback=self.signals.progress.emit,
+                is_cancelled=self.is_cancelled,
+                **self.kwargs
+            )
+        except Exception as e:
+            self.signals.error.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+def start_worker(worker, pool=None):
+    (pool or QThreadPool.globalInstance()).start(worker)
+    return worker